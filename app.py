@@ -1,45 +1,121 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, Flask, Response, abort, render_template, request, redirect, url_for, flash, session
 from functools import wraps
+from pathlib import Path
+import io
+import os
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
 from db import get_connection
+from cache import fragment_cache, data_versions, version_key, SEARCH_TABLES, BORROWER_TABLES, FINES_TABLES
 import search
 import loans
 import borrowers
 import fines
 import auth
+import assets
+import compression
+import exports
+import payments
+import spelling
+import authors
+import rollups
+import branches
+import maintenance
+import metrics
+import profiler
+import startup
+from isbn import looks_like_isbn
+import writequeue
 
-app = Flask(__name__)
-app.secret_key = 'library_secret_key_change_in_production'  # Change this in production!
+# Compiled templates are kept on disk so worker restarts skip template compilation
+TEMPLATE_CACHE_DIR = Path(".jinja_cache")
 
-# Initialize default admin user on startup
-with get_connection() as conn:
-    auth.initialize_default_user(conn)
+# Every page lives on this blueprint; create_app() builds an app around it
+bp = Blueprint('library', __name__)
+
+# Set LIBRARY_GROUP_COMMIT=1 to commit circulation writes in batches from one writer thread.
+# Under serve.py every worker sends its writes to the shared writer process instead.
+write_queue = None
+
+def create_app():
+    """Build the Flask app.
+
+    Importing this module and creating the app touch neither the database
+    nor the network: the one-time database setup runs on the first request,
+    or earlier from startup.init_database() / startup.warmup() (serve.py
+    calls them before forking its workers).
+    """
+    global write_queue
+    app = Flask(__name__)
+    app.secret_key = 'library_secret_key_change_in_production'  # Change this in production!
+
+    TEMPLATE_CACHE_DIR.mkdir(exist_ok=True)
+    app.jinja_options = {**app.jinja_options, 'bytecode_cache': FileSystemBytecodeCache(str(TEMPLATE_CACHE_DIR))}
+
+    # Content-hashed static URLs with long-lived caching, and gzip/brotli for large responses
+    assets.init_app(app)
+    compression.init_app(app)
+    # Request, SQL and database metrics for Prometheus at /metrics (see LIBRARY_METRICS_TOKEN)
+    metrics.init_app(app)
+    # Database setup on first use, optional warmup (LIBRARY_WARMUP=1), /healthz and /readyz
+    startup.init_app(app)
+    # Admins can add ?profile=1 to any page to get its sampled stacks instead
+    profiler.init_app(app, is_admin_session)
+    app.register_blueprint(bp)
+
+    if write_queue is None:
+        write_queue = writequeue.from_environment()
+    return app
+
+def __getattr__(name):
+    # `from app import app` (bench_serve.py, flask run) builds one app on first use
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def run_write(operation, *args):
+    """Run a circulation write, through the group-commit queue when it is enabled."""
+    if write_queue is not None:
+        return write_queue.call(operation, *args)
+    with get_connection() as conn:
+        return operation(conn, *args)
+
+def render_fragment(template_name, **context):
+    """Render a partial template to markup that can be cached and embedded in a page."""
+    return Markup(render_template(template_name, **context))
 
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'logged_in' not in session:
             flash('Please log in to access this page.', 'error')
-            return redirect(url_for('login'))
+            return redirect(url_for('library.login'))
         return f(*args, **kwargs)
     return decorated_function
 
+def is_admin_session():
+    """True if the logged-in user is (still) an admin."""
+    if 'logged_in' not in session:
+        return False
+    with get_connection() as conn:
+        return auth.is_admin(conn, session.get('username'))
+
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'logged_in' not in session:
             flash('Please log in to access this page.', 'error')
-            return redirect(url_for('login'))
+            return redirect(url_for('library.login'))
         
-        username = session.get('username')
-        with get_connection() as conn:
-            if not auth.is_admin(conn, username):
-                flash('Access denied. Admin privileges required.', 'error')
-                return redirect(url_for('index'))
+        if not is_admin_session():
+            flash('Access denied. Admin privileges required.', 'error')
+            return redirect(url_for('library.index'))
         
         return f(*args, **kwargs)
     return decorated_function
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form.get('username')
@@ -51,13 +127,13 @@ def login():
                 session['username'] = username
                 session['is_admin'] = auth.is_admin(conn, username)
                 flash('Login successful!', 'success')
-                return redirect(url_for('index'))
+                return redirect(url_for('library.index'))
             else:
                 flash('Invalid username or password.', 'error')
     
     return render_template('login.html')
 
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         username = request.form.get('username')
@@ -82,7 +158,7 @@ def register():
                     auth.create_user(conn, username, password, card_id=card_id)
                     
                     flash(f'Account created successfully! Your Borrower Card ID is: {card_id}', 'success')
-                    return redirect(url_for('login'))
+                    return redirect(url_for('library.login'))
             except ValueError as e:
                 flash(str(e), 'error')
             except Exception as e:
@@ -90,13 +166,13 @@ def register():
     
     return render_template('register.html')
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     session.clear()
     flash('You have been logged out.', 'success')
-    return redirect(url_for('login'))
+    return redirect(url_for('library.login'))
 
-@app.route('/profile')
+@bp.route('/profile')
 @login_required
 def profile():
     username = session.get('username')
@@ -142,7 +218,7 @@ def profile():
                          fines=outstanding_fines,
                          total_fines=total_fines)
 
-@app.route('/profile/link-borrower', methods=['POST'])
+@bp.route('/profile/link-borrower', methods=['POST'])
 @login_required
 def link_borrower():
     card_id = request.form.get('card_id')
@@ -150,7 +226,7 @@ def link_borrower():
     
     if not card_id:
         flash('Card ID is required.', 'error')
-        return redirect(url_for('profile'))
+        return redirect(url_for('library.profile'))
     
     try:
         card_id = int(card_id)
@@ -164,7 +240,7 @@ def link_borrower():
             
             if not borrower:
                 flash(f'Borrower with Card ID {card_id} not found.', 'error')
-                return redirect(url_for('profile'))
+                return redirect(url_for('library.profile'))
             
             # Check if this borrower is already linked to another user
             existing_user = conn.execute(
@@ -174,7 +250,7 @@ def link_borrower():
             
             if existing_user:
                 flash(f'This borrower account is already linked to another user.', 'error')
-                return redirect(url_for('profile'))
+                return redirect(url_for('library.profile'))
             
             # Link borrower to current user
             conn.execute(
@@ -189,9 +265,9 @@ def link_borrower():
     except Exception as e:
         flash(f'Error linking borrower: {str(e)}', 'error')
     
-    return redirect(url_for('profile'))
+    return redirect(url_for('library.profile'))
 
-@app.route('/profile/return-book', methods=['POST'])
+@bp.route('/profile/return-book', methods=['POST'])
 @login_required
 def return_book():
     """Allow users to return their own books"""
@@ -200,7 +276,7 @@ def return_book():
     
     if not loan_id:
         flash('Loan ID is required.', 'error')
-        return redirect(url_for('profile'))
+        return redirect(url_for('library.profile'))
     
     try:
         loan_id = int(loan_id)
@@ -214,7 +290,7 @@ def return_book():
             
             if not user_card_id or not user_card_id['Card_id']:
                 flash('You do not have a borrower account linked.', 'error')
-                return redirect(url_for('profile'))
+                return redirect(url_for('library.profile'))
             
             user_card_id = user_card_id['Card_id']
             
@@ -226,28 +302,28 @@ def return_book():
             
             if not loan:
                 flash('Loan not found.', 'error')
-                return redirect(url_for('profile'))
+                return redirect(url_for('library.profile'))
             
             if loan['Card_id'] != user_card_id:
                 flash('You can only return your own books.', 'error')
-                return redirect(url_for('profile'))
+                return redirect(url_for('library.profile'))
             
             if loan['Date_in'] is not None:
                 flash('This book has already been returned.', 'error')
-                return redirect(url_for('profile'))
+                return redirect(url_for('library.profile'))
             
-            # Return the book
-            loans.checkin(conn, loan_id)
-            flash('Book returned successfully!', 'success')
+        # Return the book
+        run_write(loans.checkin, loan_id)
+        flash('Book returned successfully!', 'success')
             
     except ValueError:
         flash('Invalid loan ID.', 'error')
     except Exception as e:
         flash(f'Error returning book: {str(e)}', 'error')
     
-    return redirect(url_for('profile'))
+    return redirect(url_for('library.profile'))
 
-@app.route('/profile/pay-fine', methods=['POST'])
+@bp.route('/profile/pay-fine', methods=['POST'])
 @login_required
 def pay_fine():
     """Allow users to pay their own fines"""
@@ -256,7 +332,7 @@ def pay_fine():
     
     if not loan_id:
         flash('Loan ID is required.', 'error')
-        return redirect(url_for('profile'))
+        return redirect(url_for('library.profile'))
     
     try:
         loan_id = int(loan_id)
@@ -270,147 +346,141 @@ def pay_fine():
             
             if not user_card_id or not user_card_id['Card_id']:
                 flash('You do not have a borrower account linked.', 'error')
-                return redirect(url_for('profile'))
+                return redirect(url_for('library.profile'))
             
             user_card_id = user_card_id['Card_id']
-            
-            # Verify this fine belongs to the current user
-            fine = conn.execute(
-                """
-                SELECT f.Loan_id, f.Fine_amt, f.Paid, bl.Card_id
-                FROM FINES f
-                JOIN BOOK_LOANS bl ON f.Loan_id = bl.Loan_id
-                WHERE f.Loan_id = ?
-                """,
-                (loan_id,)
-            ).fetchone()
-            
-            if not fine:
-                flash('Fine not found.', 'error')
-                return redirect(url_for('profile'))
-            
-            if fine['Card_id'] != user_card_id:
-                flash('You can only pay your own fines.', 'error')
-                return redirect(url_for('profile'))
-            
-            if fine['Paid'] == 1:
-                flash('This fine has already been paid.', 'error')
-                return redirect(url_for('profile'))
-            
-            # Pay the fine
-            conn.execute(
-                "UPDATE FINES SET Paid = 1 WHERE Loan_id = ?",
-                (loan_id,)
-            )
-            conn.commit()
-            
-            flash(f'Fine of ${fine["Fine_amt"]:.2f} paid successfully!', 'success')
+        
+        # Pay the fine (checks it belongs to the current user and is unpaid)
+        try:
+            fine_amt = run_write(fines.pay_fine, loan_id, user_card_id)
+        except ValueError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('library.profile'))
+        
+        flash(f'Fine of ${fine_amt:.2f} paid successfully!', 'success')
             
     except ValueError:
         flash('Invalid loan ID.', 'error')
     except Exception as e:
         flash(f'Error paying fine: {str(e)}', 'error')
     
-    return redirect(url_for('profile'))
+    return redirect(url_for('library.profile'))
 
-@app.route('/')
+@bp.route('/')
 @login_required
 def index():
     return render_template('index.html')
 
-@app.route('/search', methods=['GET'])
+def _render_search_results(conn, query, status_filter, page, per_page):
+    """Run the catalog query for one results page and render its table."""
+    offset = (page - 1) * per_page
+    total_count, results = search.search_page(conn, query, status_filter, offset, per_page)
+
+    total_pages = (total_count + per_page - 1) // per_page
+    results_table = None
+    if results:
+        results_table = render_fragment('_search_results.html',
+                                        results=results,
+                                        query=query,
+                                        page=page,
+                                        total_pages=total_pages,
+                                        status_filter=status_filter)
+    return total_count, total_pages, results_table
+
+@bp.route('/search', methods=['GET'])
 @login_required
 def search_books():
     query = request.args.get('q', '')
     page = int(request.args.get('page', 1))
     status_filter = request.args.get('status', 'all')  # all, available, checked_out
     per_page = 50
-    offset = (page - 1) * per_page
-    
-    results = []
-    total_count = 0
     
     # Get current user's card_id
     username = session.get('username')
     user_card_id = None
     
     with get_connection() as conn:
-        cursor = conn.cursor()
-        
         # Get user's card_id if they have one linked
-        user_row = cursor.execute("SELECT Card_id FROM USERS WHERE Username = ?", (username,)).fetchone()
+        user_row = conn.execute("SELECT Card_id FROM USERS WHERE Username = ?", (username,)).fetchone()
         if user_row and user_row['Card_id']:
             user_card_id = user_row['Card_id']
         
-        # Build WHERE clause based on filters
-        where_conditions = []
-        params = []
-        
-        if query:
-            # Search in ISBN, Title, or Author
-            where_conditions.append("(LOWER(b.Isbn) LIKE ? OR LOWER(b.Title) LIKE ? OR LOWER(a.Name) LIKE ?)")
-            search_term = f"%{query.lower()}%"
-            params.extend([search_term, search_term, search_term])
-        
-        # Status filter
-        if status_filter == 'available':
-            where_conditions.append("NOT EXISTS (SELECT 1 FROM BOOK_LOANS bl WHERE bl.Isbn = b.Isbn AND bl.Date_in IS NULL)")
-        elif status_filter == 'checked_out':
-            where_conditions.append("EXISTS (SELECT 1 FROM BOOK_LOANS bl WHERE bl.Isbn = b.Isbn AND bl.Date_in IS NULL)")
+        # Repeat views of an unchanged catalog reuse the rendered table and skip the query
+        cache_key = ('search', query, status_filter, page,
+                     version_key(data_versions(conn), SEARCH_TABLES))
+        total_count, total_pages, results_table = fragment_cache.get_or_render(
+            cache_key, lambda: _render_search_results(conn, query, status_filter, page, per_page))
         
-        where_clause = " WHERE " + " AND ".join(where_conditions) if where_conditions else ""
-        
-        # Get total count for pagination
-        count_query = f"""
-            SELECT COUNT(DISTINCT b.Isbn)
-            FROM BOOK b
-            LEFT JOIN BOOK_AUTHORS ba ON b.Isbn = ba.Isbn
-            LEFT JOIN AUTHORS a ON ba.Author_id = a.Author_id
-            {where_clause}
-        """
-        total_count = cursor.execute(count_query, params).fetchone()[0]
-        
-        # Get paginated results
-        results_query = f"""
-            SELECT
-                b.Isbn,
-                b.Title,
-                COALESCE(GROUP_CONCAT(a.Name, ', '), '') AS Authors,
-                CASE
-                    WHEN EXISTS (
-                        SELECT 1 FROM BOOK_LOANS bl WHERE bl.Isbn = b.Isbn AND bl.Date_in IS NULL
-                    ) THEN 'OUT'
-                    ELSE 'IN'
-                END AS Status,
-                (
-                    SELECT bl.Card_id 
-                    FROM BOOK_LOANS bl 
-                    WHERE bl.Isbn = b.Isbn AND bl.Date_in IS NULL 
-                    LIMIT 1
-                ) AS Borrower_id
-            FROM BOOK b
-            LEFT JOIN BOOK_AUTHORS ba ON b.Isbn = ba.Isbn
-            LEFT JOIN AUTHORS a ON ba.Author_id = a.Author_id
-            {where_clause}
-            GROUP BY b.Isbn, b.Title
-            ORDER BY b.Title
-            LIMIT ? OFFSET ?
-        """
-        cursor.execute(results_query, params + [per_page, offset])
-        results = [dict(row) for row in cursor.fetchall()]
-    
-    total_pages = (total_count + per_page - 1) // per_page
+        # Nothing matched: retry with misspelled title/author words corrected
+        corrected_query = None
+        if total_count == 0 and query.strip() and not looks_like_isbn(query):
+            corrected_query = spelling.suggest_query(conn, query)
+            if corrected_query:
+                cache_key = ('search', corrected_query, status_filter, page,
+                             version_key(data_versions(conn), SEARCH_TABLES))
+                total_count, total_pages, results_table = fragment_cache.get_or_render(
+                    cache_key, lambda: _render_search_results(conn, corrected_query, status_filter, page, per_page))
     
     return render_template('search.html', 
-                         results=results, 
+                         results_table=results_table, 
                          query=query,
+                         corrected_query=corrected_query,
                          page=page,
                          total_pages=total_pages,
                          total_count=total_count,
                          status_filter=status_filter,
-                         user_card_id=user_card_id)
+                         user_card_id=user_card_id,
+                         branch_count=len(branches.configured_branches()))
+
+@bp.route('/branches')
+@login_required
+def branch_search():
+    """Search once and show each match's availability at every branch (LIBRARY_BRANCHES)."""
+    query = request.args.get('q', '').strip()
+    page = max(int(request.args.get('page', 1)), 1)
+    per_page = 50
 
-@app.route('/loans', methods=['GET', 'POST'])
+    branch_list = branches.configured_branches()
+    total_count, results, branch_status = 0, [], {}
+    if query:
+        total_count, results, branch_status = branches.federated_search(
+            query, (page - 1) * per_page, per_page, branch_list)
+    total_pages = (total_count + per_page - 1) // per_page
+    return render_template('branches.html', query=query, results=results, total_count=total_count,
+                           page=page, total_pages=total_pages, branch_status=branch_status,
+                           branch_names=[branch.name for branch in branch_list])
+
+@bp.route('/authors')
+@login_required
+def browse_authors():
+    query = request.args.get('q', '').strip()
+    page = max(int(request.args.get('page', 1)), 1)
+    per_page = 100
+    
+    with get_connection() as conn:
+        total_count, author_page = authors.get_index(conn).browse(query, (page - 1) * per_page, per_page)
+    
+    total_pages = max((total_count + per_page - 1) // per_page, 1)
+    return render_template('authors.html',
+                         authors=author_page,
+                         query=query,
+                         page=page,
+                         total_pages=total_pages,
+                         total_count=total_count)
+
+@bp.route('/authors/<int:author_id>')
+@login_required
+def author_detail(author_id):
+    with get_connection() as conn:
+        found = authors.author_books(conn, author_id)
+    if found is None:
+        abort(404)
+    
+    author, books = found
+    available = sum(1 for book in books if book['Status'] == 'IN')
+    return render_template('author.html', author=author, books=books, available=available)
+
+@bp.route('/loans', methods=['GET', 'POST'])
 @admin_required
 def view_loans():
     # Helper to checkin
@@ -422,12 +492,11 @@ def view_loans():
                 try:
                     # Convert strings to ints
                     ids = [int(x) for x in loan_ids]
-                    with get_connection() as conn:
-                        loans.checkin_multiple(conn, ids)
+                    run_write(loans.checkin_multiple, ids)
                     flash(f"Successfully checked in {len(loan_ids)} book(s).", "success")
                 except Exception as e:
                     flash(str(e), "error")
-        return redirect(url_for('view_loans'))
+        return redirect(url_for('library.view_loans'))
 
     # GET request - Search for loans to checkin or view
     search_term = request.args.get('q', '')
@@ -448,7 +517,7 @@ def view_loans():
 
     return render_template('loans.html', loans=open_loans, search_term=search_term, search_type=search_type)
 
-@app.route('/checkout', methods=['POST'])
+@bp.route('/checkout', methods=['POST'])
 @login_required
 def checkout_book():
     isbn_list = request.form.getlist('isbn')  # Support multiple ISBNs
@@ -456,13 +525,12 @@ def checkout_book():
     
     if not isbn_list or not card_id:
         flash("At least one ISBN and Card ID are required.", "error")
-        return redirect(request.referrer or url_for('search_books'))
+        return redirect(request.referrer or url_for('library.search_books'))
 
     try:
-        with get_connection() as conn:
-            for isbn in isbn_list:
-                if isbn.strip():  # Skip empty values
-                    loans.checkout(conn, isbn.strip(), card_id)
+        for isbn in isbn_list:
+            if isbn.strip():  # Skip empty values
+                run_write(loans.checkout, isbn.strip(), card_id)
         
         if len(isbn_list) == 1:
             flash(f"Book {isbn_list[0]} checked out to Card {card_id}.", "success")
@@ -471,11 +539,65 @@ def checkout_book():
     except Exception as e:
         flash(str(e), "error")
     
-    return redirect(request.referrer or url_for('search_books'))
+    return redirect(request.referrer or url_for('library.search_books'))
+
+def _render_borrower_rows(conn, page, per_page, query=''):
+    """Fetch one page of borrowers, or the ranked matches for a lookup, and render its table."""
+    if query:
+        matches = borrowers.lookup_borrowers(conn, query, limit=per_page)
+        borrowers_table = None
+        if matches:
+            borrowers_table = render_fragment('_borrower_rows.html', borrowers=matches, page=1, total_pages=1)
+        return len(matches), 1, borrowers_table
+
+    offset = (page - 1) * per_page
+    cursor = conn.cursor()
+    
+    # Get total count
+    total_count = cursor.execute("SELECT COUNT(*) FROM BORROWER").fetchone()[0]
+    
+    # Get paginated results
+    cursor.execute("""
+        SELECT Card_id, Ssn, Bname, Address, Phone
+        FROM BORROWER
+        ORDER BY Card_id DESC
+        LIMIT ? OFFSET ?
+    """, (per_page, offset))
+    all_borrowers = [dict(row) for row in cursor.fetchall()]
+    
+    total_pages = (total_count + per_page - 1) // per_page
+    borrowers_table = None
+    if all_borrowers:
+        borrowers_table = render_fragment('_borrower_rows.html',
+                                          borrowers=all_borrowers,
+                                          page=page,
+                                          total_pages=total_pages)
+    return total_count, total_pages, borrowers_table
 
-@app.route('/borrowers', methods=['GET', 'POST'])
+@bp.route('/borrowers', methods=['GET', 'POST'])
 @admin_required
 def manage_borrowers():
+    if request.method == 'POST' and request.form.get('action') == 'import':
+        upload = request.files.get('borrowers_file')
+        if not upload or not upload.filename:
+            flash("Choose a borrower CSV to import.", "error")
+            return redirect(url_for('library.manage_borrowers'))
+        try:
+            with get_connection() as conn:
+                handle = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+                summary = borrowers.import_borrowers(conn, handle)
+            if summary['imported']:
+                flash(f"Imported {summary['imported']} borrower(s), Card IDs "
+                      f"{summary['first_card_id']}-{summary['last_card_id']}.", "success")
+            rejected = summary['rejected']
+            if rejected:
+                shown = "; ".join(f"line {line}: {reason}" for line, reason in rejected[:5])
+                more = f" (and {len(rejected) - 5} more)" if len(rejected) > 5 else ""
+                flash(f"{len(rejected)} row(s) skipped - {shown}{more}", "error")
+        except Exception as e:
+            flash(f"Borrower import failed: {str(e)}", "error")
+        return redirect(url_for('library.manage_borrowers'))
+
     if request.method == 'POST':
         ssn = request.form.get('ssn')
         name = request.form.get('name')
@@ -486,35 +608,19 @@ def manage_borrowers():
             with get_connection() as conn:
                 new_id = borrowers.create_borrower(conn, ssn, name, address, phone)
             flash(f"Borrower created successfully! Card ID: {new_id}", "success")
-            return redirect(url_for('manage_borrowers'))
+            return redirect(url_for('library.manage_borrowers'))
         except Exception as e:
             flash(str(e), "error")
     
     # Pagination
     page = int(request.args.get('page', 1))
+    query = request.args.get('q', '').strip()
     per_page = 50
-    offset = (page - 1) * per_page
-    
-    # Get all borrowers with pagination
-    all_borrowers = []
-    total_count = 0
     
     with get_connection() as conn:
-        cursor = conn.cursor()
-        
-        # Get total count
-        total_count = cursor.execute("SELECT COUNT(*) FROM BORROWER").fetchone()[0]
-        
-        # Get paginated results
-        cursor.execute("""
-            SELECT Card_id, Ssn, Bname, Address, Phone
-            FROM BORROWER
-            ORDER BY Card_id DESC
-            LIMIT ? OFFSET ?
-        """, (per_page, offset))
-        all_borrowers = [dict(row) for row in cursor.fetchall()]
-    
-    total_pages = (total_count + per_page - 1) // per_page
+        cache_key = ('borrowers', query, page, version_key(data_versions(conn), BORROWER_TABLES))
+        total_count, total_pages, borrowers_table = fragment_cache.get_or_render(
+            cache_key, lambda: _render_borrower_rows(conn, page, per_page, query))
     
     # Get current user's card_id
     user_card_id = None
@@ -525,13 +631,14 @@ def manage_borrowers():
             user_card_id = row[0]
 
     return render_template('borrowers.html', 
-                         borrowers=all_borrowers,
+                         borrowers_table=borrowers_table,
+                         query=query,
                          page=page,
                          total_pages=total_pages,
                          total_count=total_count,
                          user_card_id=user_card_id)
 
-@app.route('/borrowers/delete/<int:card_id>', methods=['POST'])
+@bp.route('/borrowers/delete/<int:card_id>', methods=['POST'])
 @admin_required
 def delete_borrower(card_id):
     try:
@@ -546,7 +653,7 @@ def delete_borrower(card_id):
             
             if user_card_id and user_card_id[0] == card_id:
                 flash("You cannot delete your own borrower account.", "error")
-                return redirect(url_for('manage_borrowers'))
+                return redirect(url_for('library.manage_borrowers'))
             
             # Check if borrower has active loans
             active_loans = conn.execute(
@@ -567,9 +674,9 @@ def delete_borrower(card_id):
     except Exception as e:
         flash(f"Error deleting borrower: {str(e)}", "error")
     
-    return redirect(url_for('manage_borrowers'))
+    return redirect(url_for('library.manage_borrowers'))
 
-@app.route('/profile/unlink-borrower', methods=['POST'])
+@bp.route('/profile/unlink-borrower', methods=['POST'])
 @login_required
 def unlink_borrower():
     """Manually unlink a broken borrower account"""
@@ -583,75 +690,141 @@ def unlink_borrower():
     except Exception as e:
         flash(f"Error unlinking borrower: {str(e)}", "error")
     
-    return redirect(url_for('profile'))
+    return redirect(url_for('library.profile'))
 
-@app.route('/fines', methods=['GET', 'POST'])
+def _render_fines_table(conn, query):
+    """Look up outstanding fines, optionally filtered, and render their table."""
+    if query:
+        # Search by Card ID, or by name, phone or SSN last four through the lookup index
+        lookup_sql, params = borrowers.lookup_condition(query, "bor.Card_id")
+        try:
+            card_id = int(query)
+            lookup_sql = f"(bor.Card_id = ? OR {lookup_sql})"
+            params = [card_id] + params
+        except ValueError:
+            pass
+        
+        cursor = conn.execute(f"""
+            SELECT
+                bor.Card_id,
+                bor.Bname,
+                ROUND(bf.Unpaid_amt, 2) AS Total_Fines
+            FROM BORROWER_FINES bf
+            JOIN BORROWER bor ON bf.Card_id = bor.Card_id
+            WHERE bf.Unpaid_count > 0 AND {lookup_sql}
+            ORDER BY bor.Bname
+        """, params)
+        outstanding = [dict(row) for row in cursor.fetchall()]
+    else:
+        # No search query - show all outstanding fines
+        outstanding = fines.list_outstanding_fines(conn)
+    
+    fines_table = None
+    if outstanding:
+        fines_table = render_fragment('_fines_table.html', fines=outstanding)
+    return len(outstanding), fines_table
+
+@bp.route('/fines', methods=['GET', 'POST'])
 @admin_required
 def manage_fines():
     # Handle fine payment or refresh
     if request.method == 'POST':
         action = request.form.get('action')
         if action == 'refresh':
-            with get_connection() as conn:
-                fines.refresh_fines(conn)
+            run_write(fines.refresh_fines)
             flash("Fines refreshed successfully.", "success")
         elif action == 'pay':
             card_id = request.form.get('card_id')
             try:
-                with get_connection() as conn:
-                    fines.pay_fines(conn, card_id)
+                run_write(fines.pay_fines, card_id)
                 flash(f"Fines paid for Card ID {card_id}.", "success")
             except Exception as e:
                 flash(str(e), "error")
-        return redirect(url_for('manage_fines'))
+        elif action == 'import':
+            upload = request.files.get('settlement')
+            if not upload or not upload.filename:
+                flash("Choose a settlement file to import.", "error")
+                return redirect(url_for('library.manage_fines'))
+            try:
+                with get_connection() as conn:
+                    # Parse the upload as a stream instead of reading it into memory
+                    handle = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+                    summary = payments.import_payments(conn, handle)
+                    exceptions = list(payments.iter_report(conn, (payments.DUPLICATE, payments.UNMATCHED)))
+                return render_template('payments_report.html', summary=summary, exceptions=exceptions)
+            except Exception as e:
+                flash(f"Settlement import failed: {str(e)}", "error")
+        return redirect(url_for('library.manage_fines'))
 
     # Get search query
     query = request.args.get('q', '').strip()
     
     # List outstanding fines with optional search filter
-    outstanding = []
     with get_connection() as conn:
-        if query:
-            # Search by Card ID or borrower name
-            cursor = conn.cursor()
-            
-            # Try to parse as Card ID (integer)
-            try:
-                card_id = int(query)
-                # Search by exact Card ID
-                cursor.execute("""
-                    SELECT
-                        bor.Card_id,
-                        bor.Bname,
-                        SUM(f.Fine_amt) AS Total_Fines
-                    FROM FINES f
-                    JOIN BOOK_LOANS bl ON f.Loan_id = bl.Loan_id
-                    JOIN BORROWER bor  ON bl.Card_id = bor.Card_id
-                    WHERE f.Paid = 0 AND bor.Card_id = ?
-                    GROUP BY bor.Card_id, bor.Bname
-                    ORDER BY bor.Bname
-                """, (card_id,))
-            except ValueError:
-                # Search by borrower name substring (case-insensitive)
-                cursor.execute("""
-                    SELECT
-                        bor.Card_id,
-                        bor.Bname,
-                        SUM(f.Fine_amt) AS Total_Fines
-                    FROM FINES f
-                    JOIN BOOK_LOANS bl ON f.Loan_id = bl.Loan_id
-                    JOIN BORROWER bor  ON bl.Card_id = bor.Card_id
-                    WHERE f.Paid = 0 AND LOWER(bor.Bname) LIKE ?
-                    GROUP BY bor.Card_id, bor.Bname
-                    ORDER BY bor.Bname
-                """, (f"%{query.lower()}%",))
-            
-            outstanding = [dict(row) for row in cursor.fetchall()]
-        else:
-            # No search query - show all outstanding fines
-            outstanding = fines.list_outstanding_fines(conn)
+        cache_key = ('fines', query, version_key(data_versions(conn), FINES_TABLES))
+        fine_count, fines_table = fragment_cache.get_or_render(
+            cache_key, lambda: _render_fines_table(conn, query))
     
-    return render_template('fines.html', fines=outstanding, query=query)
+    return render_template('fines.html', fines_table=fines_table, fine_count=fine_count, query=query)
+
+@bp.route('/admin/dashboard')
+@admin_required
+def admin_dashboard():
+    """Circulation overview read from the rollup tables, so its cost does not grow with loan history."""
+    with get_connection() as conn:
+        stats = rollups.dashboard(conn)
+    return render_template('dashboard.html', stats=stats)
+
+@bp.route('/export/<dataset>.<fmt>')
+@admin_required
+def export_data(dataset, fmt):
+    """Stream a full dataset as CSV or NDJSON without materializing it in memory."""
+    if dataset not in exports.DATASETS or fmt not in exports.FORMATS:
+        abort(404)
+    response = Response(exports.stream_export(dataset, fmt), mimetype=exports.FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename={dataset}.{fmt}'
+    return response
+
+def _profiler_response(body, filename):
+    response = Response(body, mimetype='text/plain')
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+@bp.route('/admin/profiler/cpu')
+@admin_required
+def profile_cpu():
+    """Sample the requests this process serves for ?seconds= and return collapsed stacks for a flame graph."""
+    try:
+        seconds = profiler.seconds_arg(request.args.get('seconds'))
+        stacks = profiler.profile(seconds, route=request.args.get('route') or None,
+                                  all_threads=bool(request.args.get('all_threads')))
+    except ValueError as e:
+        abort(400, str(e))
+    except RuntimeError as e:
+        abort(409, str(e))
+    return _profiler_response(stacks, 'cpu.folded')
+
+@bp.route('/admin/profiler/memory')
+@admin_required
+def profile_memory():
+    """Trace allocations for ?seconds= and list where memory grew."""
+    try:
+        seconds = profiler.seconds_arg(request.args.get('seconds'))
+        report = profiler.memory_diff(seconds, group=request.args.get('group', 'lineno'))
+    except ValueError as e:
+        abort(400, str(e))
+    except RuntimeError as e:
+        abort(409, str(e))
+    return _profiler_response(report, 'memory.txt')
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    app = create_app()
+    startup.init_database()
+    # Checkpoints, PRAGMA optimize and incremental vacuum on a background thread
+    maintenance.background_checkpoints()
+    use_reloader = True
+    # With the reloader on, the process that serves requests is the reloaded
+    # child; the parent only watches files and must not maintain as well
+    if not use_reloader or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        maintenance.Maintainer().start()
+    app.run(debug=True, use_reloader=use_reloader)
@@ -0,0 +1,226 @@
+import argparse
+import sys
+import time
+from datetime import date
+from pathlib import Path
+from typing import Optional
+
+from db import DB_PATH, database_file, day_number, db_transaction, get_connection
+from maintenance import optimize
+
+ARCHIVE_SCHEMA = "archive"
+DEFAULT_RETENTION_DAYS = 365
+# Each chunk is two short write transactions, so checkouts and checkins
+# keep going while a large backlog of history is archived.
+ARCHIVE_BATCH_SIZE = 5000
+
+# Same columns as the hot tables. No foreign keys: a borrower or book may be
+# deleted long after its loans were archived.
+ARCHIVE_TABLES = """
+CREATE TABLE IF NOT EXISTS archive.BOOK_LOANS (
+    Loan_id INTEGER PRIMARY KEY,
+    Isbn CHAR(10) NOT NULL,
+    Card_id INTEGER NOT NULL,
+    Date_out DATE NOT NULL,
+    Due_date DATE NOT NULL,
+    Date_in DATE
+);
+
+CREATE TABLE IF NOT EXISTS archive.FINES (
+    Loan_id INTEGER PRIMARY KEY,
+    Fine_amt DECIMAL(7, 2) NOT NULL,
+    Paid INTEGER NOT NULL CHECK (Paid IN (0, 1))
+);
+"""
+
+# History views: the hot tables plus whatever has been archived. A loan is
+# copied to the archive before it is deleted from BOOK_LOANS, so the archive
+# side skips any loan still present in the hot table (a chunk that was copied
+# but not yet deleted) and every loan appears exactly once.
+HISTORY_VIEWS = """
+CREATE TEMP VIEW LOAN_HISTORY AS
+    SELECT Loan_id, Isbn, Card_id, Date_out, Due_date, Date_in FROM main.BOOK_LOANS
+    UNION ALL
+    SELECT a.Loan_id, a.Isbn, a.Card_id, a.Date_out, a.Due_date, a.Date_in
+    FROM archive.BOOK_LOANS a
+    WHERE NOT EXISTS (SELECT 1 FROM main.BOOK_LOANS bl WHERE bl.Loan_id = a.Loan_id);
+
+CREATE TEMP VIEW FINE_HISTORY AS
+    SELECT f.Loan_id, bl.Card_id, bl.Isbn, f.Fine_amt, f.Paid
+    FROM main.FINES f
+    JOIN main.BOOK_LOANS bl ON f.Loan_id = bl.Loan_id
+    UNION ALL
+    SELECT f.Loan_id, a.Card_id, a.Isbn, f.Fine_amt, f.Paid
+    FROM archive.FINES f
+    JOIN archive.BOOK_LOANS a ON f.Loan_id = a.Loan_id
+    WHERE NOT EXISTS (SELECT 1 FROM main.FINES mf WHERE mf.Loan_id = f.Loan_id);
+"""
+
+# Without an archive the views are just the hot tables
+HOT_VIEWS = """
+CREATE TEMP VIEW LOAN_HISTORY AS
+    SELECT Loan_id, Isbn, Card_id, Date_out, Due_date, Date_in FROM main.BOOK_LOANS;
+
+CREATE TEMP VIEW FINE_HISTORY AS
+    SELECT f.Loan_id, bl.Card_id, bl.Isbn, f.Fine_amt, f.Paid
+    FROM main.FINES f
+    JOIN main.BOOK_LOANS bl ON f.Loan_id = bl.Loan_id;
+"""
+
+# Closed loans returned before the cutoff that can no longer change: returned
+# on time, or returned late with the fine already paid.
+ARCHIVABLE = """
+    bl.In_day < :cutoff
+    AND (f.Paid = 1 OR (f.Loan_id IS NULL AND bl.In_day <= bl.Due_day))
+"""
+
+CANDIDATES_SQL = f"""
+    SELECT bl.Loan_id
+    FROM BOOK_LOANS bl
+    LEFT JOIN FINES f ON f.Loan_id = bl.Loan_id
+    WHERE bl.Loan_id > :after AND {ARCHIVABLE}
+    ORDER BY bl.Loan_id
+    LIMIT :limit
+"""
+
+
+def archive_path(db_path: Path) -> Path:
+    return Path(db_path).with_suffix(".archive.db")
+
+
+def attach_archive(conn, path: Optional[Path] = None) -> Path:
+    """Attach the archive database to conn (creating it if needed) and define the history views.
+
+    The archive defaults to library.archive.db beside the main database.
+    ATTACH cannot run inside a transaction, so call this first.
+    """
+    attached = database_file(conn, ARCHIVE_SCHEMA)
+    if attached is not None:
+        return attached
+    if path is None:
+        db_file = database_file(conn)
+        if db_file is None:
+            raise ValueError("An in-memory database has no archive location.")
+        path = archive_path(db_file)
+    conn.execute("ATTACH DATABASE ? AS archive", (str(path),))
+    conn.executescript(ARCHIVE_TABLES)
+    _define_history_views(conn, HISTORY_VIEWS)
+    return Path(path)
+
+
+def attach_history(conn) -> None:
+    """Define LOAN_HISTORY and FINE_HISTORY on conn, covering the archive if one exists.
+
+    History readers (exports, rollup rebuilds) query these views instead of
+    BOOK_LOANS and FINES, so archived rows stay visible to them.
+    """
+    if database_file(conn, ARCHIVE_SCHEMA) is not None:
+        return
+    db_file = database_file(conn)
+    if db_file is not None and archive_path(db_file).exists():
+        attach_archive(conn)
+    else:
+        _define_history_views(conn, HOT_VIEWS)
+
+
+def _define_history_views(conn, script: str) -> None:
+    conn.executescript("DROP VIEW IF EXISTS temp.LOAN_HISTORY; DROP VIEW IF EXISTS temp.FINE_HISTORY;" + script)
+
+
+def archive_history(conn, today: Optional[date] = None, retention_days: int = DEFAULT_RETENTION_DAYS,
+                    batch_size: int = ARCHIVE_BATCH_SIZE, path: Optional[Path] = None) -> dict:
+    """Move closed loans returned more than retention_days ago, and their paid fines, to the archive.
+
+    Works in Loan_id chunks. Each chunk is copied to the archive and
+    committed there first, then deleted from the hot tables in a second
+    transaction, so a crash can leave a chunk in both places but never in
+    neither. Candidates are picked by what is still in the hot tables, so
+    running it again after an interruption simply carries on. Returns the
+    number of loans and fines moved.
+    """
+    today = today or date.today()
+    if retention_days < 0:
+        raise ValueError("Retention must be zero or more days.")
+    if batch_size < 1:
+        raise ValueError("Batch size must be at least 1.")
+    attach_archive(conn, path)
+    params = {"after": 0, "cutoff": day_number(today) - retention_days, "limit": batch_size}
+    moved = {"loans": 0, "fines": 0}
+
+    while True:
+        ids = [row[0] for row in conn.execute(CANDIDATES_SQL, params)]
+        if not ids:
+            if moved["loans"]:
+                # The hot tables just shrank; let the planner notice
+                optimize(conn)
+            return moved
+        params["first"], params["last"] = ids[0], ids[-1]
+
+        with db_transaction(conn, immediate=True):
+            conn.execute(
+                f"""
+                INSERT OR IGNORE INTO archive.BOOK_LOANS (Loan_id, Isbn, Card_id, Date_out, Due_date, Date_in)
+                SELECT bl.Loan_id, bl.Isbn, bl.Card_id, bl.Date_out, bl.Due_date, bl.Date_in
+                FROM main.BOOK_LOANS bl
+                LEFT JOIN main.FINES f ON f.Loan_id = bl.Loan_id
+                WHERE bl.Loan_id BETWEEN :first AND :last AND {ARCHIVABLE}
+                """,
+                params,
+            )
+            conn.execute(
+                """
+                INSERT OR IGNORE INTO archive.FINES (Loan_id, Fine_amt, Paid)
+                SELECT Loan_id, Fine_amt, Paid
+                FROM main.FINES
+                WHERE Paid = 1
+                  AND Loan_id IN (SELECT Loan_id FROM archive.BOOK_LOANS WHERE Loan_id BETWEEN :first AND :last)
+                """,
+                params,
+            )
+
+        with db_transaction(conn, immediate=True):
+            # Only what the archive now holds is deleted
+            fines = conn.execute(
+                """
+                DELETE FROM main.FINES
+                WHERE Loan_id IN (SELECT Loan_id FROM archive.FINES WHERE Loan_id BETWEEN :first AND :last)
+                """,
+                params,
+            ).rowcount
+            loans = conn.execute(
+                """
+                DELETE FROM main.BOOK_LOANS
+                WHERE Loan_id IN (SELECT Loan_id FROM archive.BOOK_LOANS WHERE Loan_id BETWEEN :first AND :last)
+                """,
+                params,
+            ).rowcount
+        moved["loans"] += loans
+        moved["fines"] += fines
+        params["after"] = params["last"]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Move old closed loans and paid fines to the archive database.")
+    parser.add_argument("--days", type=int, default=DEFAULT_RETENTION_DAYS,
+                        help=f"keep loans returned within this many days in the hot tables (default {DEFAULT_RETENTION_DAYS})")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE, help="loans moved per transaction")
+    parser.add_argument("--db", default=str(DB_PATH), help=f"library database (default {DB_PATH})")
+    parser.add_argument("--archive", help="archive database (default: the database path with an .archive.db suffix)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    with get_connection(Path(args.db)) as conn:
+        try:
+            moved = archive_history(conn, retention_days=args.days, batch_size=args.batch_size,
+                                    path=Path(args.archive) if args.archive else None)
+        except ValueError as err:
+            print(err, file=sys.stderr)
+            return 1
+        location = database_file(conn, ARCHIVE_SCHEMA)
+    print(f"Archived {moved['loans']} loan(s) and {moved['fines']} fine(s) to {location} "
+          f"in {time.perf_counter() - start:.1f}s.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+import hashlib
+import os
+import threading
+
+from flask import request
+
+# Fingerprinted URLs never change content, so browsers may keep them for a year.
+LONG_CACHE_SECONDS = 365 * 24 * 60 * 60
+
+_versions = {}
+_lock = threading.Lock()
+
+
+def static_version(static_folder: str, filename: str) -> str:
+    """Return a short content hash for a static file, recomputed only when it changes."""
+    path = os.path.join(static_folder, filename)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return ""
+
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        cached = _versions.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(65536), b""):
+            digest.update(chunk)
+    version = digest.hexdigest()[:12]
+
+    with _lock:
+        _versions[path] = (key, version)
+    return version
+
+
+def init_app(app) -> None:
+    @app.url_defaults
+    def add_static_version(endpoint, values):
+        """Append ?v=<content hash> to every url_for('static', ...) link."""
+        if endpoint == "static" and "filename" in values and "v" not in values:
+            version = static_version(app.static_folder, values["filename"])
+            if version:
+                values["v"] = version
+
+    @app.after_request
+    def cache_static(response):
+        """Let browsers cache fingerprinted assets forever; unversioned ones revalidate via ETag."""
+        if request.endpoint != "static" or response.status_code not in (200, 304):
+            return response
+
+        filename = (request.view_args or {}).get("filename")
+        requested = request.args.get("v")
+        if filename and requested and requested == static_version(app.static_folder, filename):
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = LONG_CACHE_SECONDS
+            response.cache_control.immutable = True
+        return response
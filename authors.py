@@ -0,0 +1,157 @@
+import re
+import threading
+from array import array
+from bisect import bisect_left
+from typing import List, Optional, Tuple
+
+from cache import data_versions, version_key
+
+AUTHOR_TABLES = ("AUTHORS", "BOOK_AUTHORS")
+
+# BOOK.Isbn is always a canonical ISBN-10, so ISBNs are packed back to back
+# in one bytearray instead of being kept as 30k separate str objects.
+ISBN_WIDTH = 10
+
+
+def sort_name(name: str) -> str:
+    """Browse key: surname first, as in a card catalog ('J.R.R. Tolkien' -> 'tolkien j.r.r.')."""
+    # Roles such as "(Adapter)" or "(Illustrator)" are not part of the name
+    parts = re.findall(r"[\w.'-]+", re.sub(r"\(.*", "", name or "").lower())
+    if not parts:
+        return ""
+    return " ".join(parts[-1:] + parts[:-1])
+
+
+class AuthorIndex:
+    """Compressed-sparse-row adjacency from authors to their books.
+
+    Authors are stored sorted by Author_id. The ISBNs of the author at
+    position i are entries offsets[i] to offsets[i + 1] of the packed isbns
+    buffer, so listing an author's books costs one bisect plus a slice.
+    by_name holds author positions in surname order for browsing, and
+    name_keys their surname keys in the same order.
+    """
+
+    def __init__(self, conn):
+        self.ids = array("q")
+        self.names: List[str] = []
+        for author_id, name in conn.execute("SELECT Author_id, Name FROM AUTHORS ORDER BY Author_id"):
+            self.ids.append(author_id)
+            self.names.append(name)
+
+        self.offsets = array("q", [0]) * (len(self.ids) + 1)
+        self.isbns = bytearray()
+        position = 0
+        count = 0
+        for author_id, isbn in conn.execute("SELECT Author_id, Isbn FROM BOOK_AUTHORS ORDER BY Author_id, Isbn"):
+            while position < len(self.ids) and self.ids[position] < author_id:
+                position += 1
+                self.offsets[position] = count
+            if position == len(self.ids) or self.ids[position] != author_id:
+                continue  # book linked to an author that no longer exists
+            self.isbns += isbn.encode("ascii").ljust(ISBN_WIDTH)[:ISBN_WIDTH]
+            count += 1
+        for rest in range(position + 1, len(self.ids) + 1):
+            self.offsets[rest] = count
+
+        keys = [sort_name(name) for name in self.names]
+        self.by_name = array("q", sorted(range(len(self.ids)), key=lambda i: (keys[i], self.ids[i])))
+        # Surname keys in by_name order, for prefix bisects (bisect's key= needs Python 3.10)
+        self.name_keys = [keys[position] for position in self.by_name]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def position(self, author_id: int) -> Optional[int]:
+        index = bisect_left(self.ids, author_id)
+        if index < len(self.ids) and self.ids[index] == author_id:
+            return index
+        return None
+
+    def book_count(self, position: int) -> int:
+        return self.offsets[position + 1] - self.offsets[position]
+
+    def isbns_at(self, position: int) -> List[str]:
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return [
+            self.isbns[offset * ISBN_WIDTH:(offset + 1) * ISBN_WIDTH].decode("ascii").rstrip()
+            for offset in range(start, end)
+        ]
+
+    def browse(self, prefix: str = "", offset: int = 0, limit: int = 100) -> Tuple[int, List[dict]]:
+        """Return (matching author count, one page of authors) in surname order, optionally by surname prefix."""
+        prefix = prefix.strip().lower()
+        first, last = 0, len(self.by_name)
+        if prefix:
+            first = bisect_left(self.name_keys, prefix)
+            last = bisect_left(self.name_keys, prefix + "\uffff", lo=first)
+
+        page = self.by_name[first + offset:min(first + offset + limit, last)]
+        authors = [
+            {"Author_id": self.ids[position], "Name": self.names[position], "Books": self.book_count(position)}
+            for position in page
+        ]
+        return last - first, authors
+
+    def memory_bytes(self) -> int:
+        return (
+            self.ids.itemsize * len(self.ids)
+            + self.offsets.itemsize * len(self.offsets)
+            + len(self.isbns)
+            + self.by_name.itemsize * len(self.by_name)
+            + sum(len(name) for name in self.names)
+            + sum(len(key) for key in self.name_keys)
+        )
+
+
+_index = None
+_index_key = None
+_lock = threading.Lock()
+
+
+def get_index(conn) -> AuthorIndex:
+    """Return the process-wide index, rebuilding it after AUTHORS or BOOK_AUTHORS change."""
+    global _index, _index_key
+    key = version_key(data_versions(conn), AUTHOR_TABLES)
+    with _lock:
+        if _index is None or _index_key != key:
+            _index = AuthorIndex(conn)
+            _index_key = key
+        return _index
+
+
+def author_books(conn, author_id: int) -> Optional[Tuple[dict, List[dict]]]:
+    """Return (author, books with availability) for one author, or None if the author does not exist.
+
+    Only the author's own ISBNs are fetched, by primary key, so the cost
+    grows with the number of books by that author rather than the catalog.
+    """
+    index = get_index(conn)
+    position = index.position(int(author_id))
+    if position is None:
+        return None
+
+    author = {"Author_id": index.ids[position], "Name": index.names[position]}
+    isbns = index.isbns_at(position)
+    if not isbns:
+        return author, []
+
+    placeholders = ", ".join("?" for _ in isbns)
+    rows = conn.execute(
+        f"""
+        SELECT
+            b.Isbn,
+            b.Title,
+            CASE
+                WHEN EXISTS (
+                    SELECT 1 FROM BOOK_LOANS bl WHERE bl.Isbn = b.Isbn AND bl.Date_in IS NULL
+                ) THEN 'OUT'
+                ELSE 'IN'
+            END AS Status
+        FROM BOOK b
+        WHERE b.Isbn IN ({placeholders})
+        ORDER BY b.Title
+        """,
+        isbns,
+    ).fetchall()
+    return author, [dict(row) for row in rows]
@@ -0,0 +1,141 @@
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List
+
+from db import DB_PATH
+
+BACKUP_DIR = Path("backups")
+# Pages copied per step, and the pause after each step that lets the disk
+# serve the app's own reads and writes between bursts of backup I/O.
+PAGES_PER_STEP = 256
+STEP_PAUSE = 0.01
+KEEP_BACKUPS = 7
+# The backup job runs at the lowest CPU priority so the copy and the
+# integrity check only use time the app leaves idle.
+NICENESS = 19
+
+
+def _backup_name(db_path: Path, when: datetime) -> str:
+    return f"{db_path.stem}-{when:%Y%m%d-%H%M%S}.db"
+
+
+def list_backups(db_path: Path = DB_PATH, backup_dir: Path = BACKUP_DIR) -> List[Path]:
+    """Backups of db_path in backup_dir, oldest first."""
+    return sorted(Path(backup_dir).glob(f"{Path(db_path).stem}-????????-??????.db"))
+
+
+def rotate_backups(db_path: Path = DB_PATH, backup_dir: Path = BACKUP_DIR, keep: int = KEEP_BACKUPS) -> List[Path]:
+    """Delete all but the newest keep backups and return the deleted paths."""
+    backups = list_backups(db_path, backup_dir)
+    expired = backups[:-keep] if keep > 0 else backups
+    for path in expired:
+        path.unlink()
+    return expired
+
+
+def _settle(fd: int, pause: float) -> None:
+    # Push each step's pages to disk now instead of leaving gigabytes of dirty
+    # pages for the final commit: that one huge flush stalls every other fsync
+    # on the disk, including the app's commits.
+    os.fsync(fd)
+    time.sleep(pause)
+
+
+def backup_database(db_path: Path = DB_PATH, backup_dir: Path = BACKUP_DIR,
+                    pages: int = PAGES_PER_STEP, pause: float = STEP_PAUSE) -> Path:
+    """Copy a live database into backup_dir a few pages at a time and return the new file.
+
+    In WAL mode the copy reads from one snapshot held open for the whole
+    backup: writers carry on appending to the WAL, and since the snapshot
+    never changes, their commits do not restart the copy (which they would
+    otherwise do on every step). A database still in rollback-journal mode
+    is copied in one step instead, because holding its read lock between
+    steps would block writers. The copy is integrity-checked before it is
+    renamed into place; a copy that fails the check raises RuntimeError.
+    """
+    db_path = Path(db_path)
+    if not db_path.exists():
+        raise ValueError(f"Database {db_path} not found.")
+    if pages < 1:
+        raise ValueError("Pages per step must be at least 1.")
+    backup_dir = Path(backup_dir)
+    backup_dir.mkdir(parents=True, exist_ok=True)
+    target = backup_dir / _backup_name(db_path, datetime.now())
+    partial = target.with_name(target.name + ".partial")
+
+    source = sqlite3.connect(db_path, isolation_level=None)
+    destination = sqlite3.connect(partial)
+    try:
+        wal = source.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        if wal:
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            flush = os.open(partial, os.O_RDWR)
+            try:
+                source.backup(destination, pages=pages,
+                              progress=lambda status, remaining, total: _settle(flush, pause))
+            finally:
+                os.close(flush)
+            source.execute("COMMIT")
+        else:
+            source.backup(destination)
+        check = [row[0] for row in destination.execute("PRAGMA integrity_check")]
+    except BaseException:
+        destination.close()
+        partial.unlink(missing_ok=True)
+        raise
+    finally:
+        source.close()
+    destination.close()
+
+    if check != ["ok"]:
+        partial.unlink()
+        raise RuntimeError(f"Backup of {db_path} failed its integrity check: {'; '.join(check[:5])}")
+    os.replace(partial, target)
+    return target
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Back up the library database while the app keeps running.")
+    parser.add_argument("--db", default=str(DB_PATH), help=f"database to back up (default {DB_PATH})")
+    parser.add_argument("--output", "-o", default=str(BACKUP_DIR), help=f"backup directory (default {BACKUP_DIR})")
+    parser.add_argument("--keep", type=int, default=KEEP_BACKUPS, help=f"backups to keep (default {KEEP_BACKUPS})")
+    parser.add_argument("--pages", type=int, default=PAGES_PER_STEP, help="pages copied per step")
+    parser.add_argument("--pause", type=float, default=STEP_PAUSE, help="seconds to wait between steps")
+    parser.add_argument("--every", type=float, metavar="HOURS",
+                        help="keep running and take a backup every HOURS instead of once")
+    args = parser.parse_args(argv)
+    if args.keep < 1:
+        parser.error("--keep must be at least 1")
+    if hasattr(os, "nice"):
+        os.nice(NICENESS)
+
+    while True:
+        start = time.perf_counter()
+        try:
+            path = backup_database(Path(args.db), Path(args.output), args.pages, args.pause)
+            expired = rotate_backups(Path(args.db), Path(args.output), args.keep)
+        except (ValueError, RuntimeError) as err:
+            print(err, file=sys.stderr, flush=True)
+            if args.every is None:
+                return 1
+        except (sqlite3.Error, OSError) as err:
+            # A busy or locked database or a full disk may clear up by the next run
+            print(f"Backup failed: {type(err).__name__}: {err}", file=sys.stderr, flush=True)
+            if args.every is None:
+                return 1
+        else:
+            print(f"Backed up {args.db} to {path} ({path.stat().st_size / 1e6:.1f} MB) "
+                  f"in {time.perf_counter() - start:.1f}s; removed {len(expired)} old backup(s).", flush=True)
+        if args.every is None:
+            return 0
+        time.sleep(max(0.0, args.every * 3600 - (time.perf_counter() - start)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
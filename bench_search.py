@@ -0,0 +1,146 @@
+import argparse
+import mmap
+import random
+import sqlite3
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import memsearch
+import search
+import snapshot
+from db import SCHEMA_FILE
+
+DEFAULT_SIZES = "25000,1000000,10000000"
+PAGE_SIZE = 50
+INSERT_BATCH = 50000
+
+COMMON_WORDS = ["the", "of", "and", "a", "in", "to", "for", "with", "on", "from"]
+SYLLABLES = ["ka", "lo", "mi", "ren", "tor", "ba", "shi", "vel", "qua", "dor", "ne", "zu", "pal", "ith", "gar", "eon"]
+
+
+def _word(rng: random.Random) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3)))
+
+
+def build_catalog(path: Path, books: int, seed: int = 4347) -> None:
+    """Create a synthetic library database with the given number of books (and books / 2 authors)."""
+    rng = random.Random(seed)
+    vocabulary = [_word(rng) for _ in range(20000)]
+    author_count = max(books // 2, 1)
+
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA_FILE.read_text(encoding="utf-8"))
+    # Bulk load: skip the per-row version-counter and lookup triggers
+    for (trigger,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall():
+        conn.execute(f"DROP TRIGGER {trigger}")
+
+    def authors():
+        for author_id in range(1, author_count + 1):
+            yield author_id, f"{rng.choice(vocabulary).title()} {rng.choice(vocabulary).title()}"
+
+    def titles():
+        for row in range(books):
+            words = [rng.choice(COMMON_WORDS) if rng.random() < 0.3 else rng.choice(vocabulary)
+                     for _ in range(rng.randint(2, 6))]
+            yield f"{row:010d}", " ".join(words).title()
+
+    def links():
+        for row in range(books):
+            for author_id in rng.sample(range(1, author_count + 1), min(rng.randint(1, 2), author_count)):
+                yield author_id, f"{row:010d}"
+
+    for sql, rows in (
+        ("INSERT INTO AUTHORS (Author_id, Name) VALUES (?, ?)", authors()),
+        ("INSERT INTO BOOK (Isbn, Title) VALUES (?, ?)", titles()),
+        ("INSERT OR IGNORE INTO BOOK_AUTHORS (Author_id, Isbn) VALUES (?, ?)", links()),
+    ):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= INSERT_BATCH:
+                conn.executemany(sql, batch)
+                batch = []
+        conn.executemany(sql, batch)
+        conn.commit()
+    conn.close()
+
+
+def _queries(conn) -> dict:
+    title = conn.execute("SELECT Title FROM BOOK WHERE rowid = (SELECT MAX(rowid) / 2 FROM BOOK)").fetchone()[0]
+    surname = conn.execute("SELECT Name FROM AUTHORS WHERE Author_id = 1").fetchone()[0].split()[-1]
+    return {
+        "common word": "the",
+        "title word": max(title.split(), key=len).lower(),
+        "author surname": surname.lower(),
+        "no match": "zzqx",
+    }
+
+
+def _time(fn, repeat: int):
+    """Return (median milliseconds, last result) over repeat calls."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000, result
+
+
+def run(sizes, backends, repeat: int, workdir: Path) -> None:
+    workdir.mkdir(parents=True, exist_ok=True)
+    print(f"numpy: {'yes' if memsearch.np is not None else 'no'}")
+    for size in sizes:
+        path = workdir / f"catalog_{size}.db"
+        if not path.exists():
+            start = time.perf_counter()
+            build_catalog(path, size)
+            print(f"\nbuilt {path} in {time.perf_counter() - start:.1f}s")
+
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        conn.executescript(SCHEMA_FILE.read_text(encoding="utf-8"))
+        memsearch.clear()
+        queries = _queries(conn)
+        print(f"\n{size:,} books")
+
+        if "memory" in backends:
+            if not snapshot.snapshot_path(path).exists():
+                start = time.perf_counter()
+                snapshot.write_snapshot(conn)
+                print(f"  memory: snapshot written in {time.perf_counter() - start:.2f}s")
+            start = time.perf_counter()
+            columns = memsearch.get_columns(conn)
+            print(f"  memory: columns {'mapped' if isinstance(columns.isbns, mmap.mmap) else 'built'} "
+                  f"in {time.perf_counter() - start:.3f}s, {columns.memory_bytes() / 1e6:.1f} MB")
+
+        for label, query in queries.items():
+            line = f"  {label:15} {query!r:14}"
+            for backend in backends:
+                ms, (total, _) = _time(
+                    lambda: search.search_page(conn, query, "all", 0, PAGE_SIZE, backend=backend), repeat)
+                line += f" | {backend} {ms:10.2f} ms ({total:,} hits)"
+            print(line, flush=True)
+        conn.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare catalog search backends on synthetic catalogs.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"comma-separated book counts (default {DEFAULT_SIZES})")
+    parser.add_argument("--backends", default=",".join(search.BACKENDS))
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per query; the median is reported")
+    parser.add_argument("--workdir", default="bench_data", help="where generated catalogs are kept between runs")
+    parser.add_argument("--no-numpy", action="store_true", help="time the pure-Python memory scan")
+    args = parser.parse_args(argv)
+
+    if args.no_numpy:
+        memsearch.np = None
+    sizes = [int(size) for size in args.sizes.split(",")]
+    backends = args.backends.split(",")
+    run(sizes, backends, args.repeat, Path(args.workdir))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
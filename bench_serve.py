@@ -0,0 +1,153 @@
+import argparse
+import http.client
+import multiprocessing
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+from pathlib import Path
+
+from db import DB_PATH
+
+DEFAULT_CLIENTS = 8
+DEFAULT_SECONDS = 15.0
+# Load applied before counting starts, so every worker's page cache is warm
+DEFAULT_WARMUP = 10.0
+DEFAULT_WRITE_SHARE = 0.1
+PORT = 8765
+
+# name -> command that starts the server on PORT, run from a scratch copy of the project
+SERVERS = {
+    "dev": [sys.executable, "-c",
+            f"from app import app; app.run(debug=True, use_reloader=False, port={PORT})"],
+    "serve": [sys.executable, "serve.py", "--port", str(PORT)],
+    "serve-no-writer": [sys.executable, "serve.py", "--port", str(PORT), "--no-writer"],
+}
+
+SEARCH_TERMS = ["the", "history", "king", "love", "war", "art", "life", "world", "science", "night"]
+
+
+def _wait_for_server(timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", PORT, timeout=2)
+            connection.request("GET", "/login")
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+def _login() -> str:
+    connection = http.client.HTTPConnection("127.0.0.1", PORT)
+    body = urllib.parse.urlencode({"username": "admin", "password": "admin"})
+    connection.request("POST", "/login", body, {"Content-Type": "application/x-www-form-urlencoded"})
+    response = connection.getresponse()
+    response.read()
+    return response.getheader("Set-Cookie").split(";", 1)[0]
+
+
+def _client(index: int, clients: int, warmup: float, seconds: float, write_share: float, cookie: str,
+            db_path: str, results) -> None:
+    """Send a mix of catalog searches and checkout/checkin pairs over one keep-alive connection."""
+    rng = random.Random(index)
+    db = sqlite3.connect(db_path)
+    cards = [row[0] for row in db.execute("SELECT Card_id FROM BORROWER ORDER BY Card_id")][index::clients]
+    isbns = [row[0] for row in db.execute("SELECT Isbn FROM BOOK ORDER BY Isbn")][index::clients]
+    connection = http.client.HTTPConnection("127.0.0.1", PORT, timeout=60)
+    headers = {"Cookie": cookie, "Content-Type": "application/x-www-form-urlencoded"}
+    reads = writes = errors = 0
+
+    def send(method, path, body=None) -> bool:
+        nonlocal connection
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status < 500
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            connection = http.client.HTTPConnection("127.0.0.1", PORT, timeout=60)
+            return False
+
+    counting = time.monotonic() + warmup
+    deadline = counting + seconds
+    while time.monotonic() < deadline:
+        measuring = time.monotonic() >= counting
+        if rng.random() < write_share:
+            isbn, card = rng.choice(isbns), rng.choice(cards)
+            ok = send("POST", "/checkout", urllib.parse.urlencode({"isbn": isbn, "card_id": card}))
+            loan = db.execute("SELECT Loan_id FROM BOOK_LOANS WHERE Isbn = ? AND Date_in IS NULL", (isbn,)).fetchone()
+            if loan:
+                ok = send("POST", "/loans", urllib.parse.urlencode({"action": "checkin", "loan_id": loan[0]})) and ok
+            if measuring:
+                writes += 2
+                errors += not ok
+        else:
+            ok = send("GET", f"/search?q={rng.choice(SEARCH_TERMS)}&page={rng.randint(1, 5)}")
+            if measuring:
+                reads += 1
+                errors += not ok
+    results.put((reads, writes, errors))
+
+
+def run(server: str, clients: int, warmup: float, seconds: float, write_share: float, db_path: Path) -> dict:
+    """Start one server against a scratch copy of the project and database, and load it with clients."""
+    workdir = Path(tempfile.mkdtemp(prefix="bench-serve-"))
+    try:
+        project = workdir / "project"
+        shutil.copytree(Path(__file__).resolve().parent, project,
+                        ignore=shutil.ignore_patterns(".git", "bench_data", "__pycache__", "*.db", "*.snap"))
+        shutil.copy(db_path, project / DB_PATH)
+        process = subprocess.Popen(SERVERS[server], cwd=project, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            _wait_for_server()
+            cookie = _login()
+            results = multiprocessing.Queue()
+            workers = [
+                multiprocessing.Process(target=_client, args=(index, clients, warmup, seconds, write_share, cookie,
+                                                              str(project / DB_PATH), results))
+                for index in range(clients)
+            ]
+            for worker in workers:
+                worker.start()
+            totals = [results.get() for _ in workers]
+            for worker in workers:
+                worker.join()
+        finally:
+            process.terminate()
+            process.wait()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    reads, writes, errors = (sum(column) for column in zip(*totals))
+    return {"requests": reads + writes, "reads": reads, "writes": writes, "errors": errors,
+            "rps": (reads + writes) / seconds}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Measure request throughput of the dev server and serve.py.")
+    parser.add_argument("--servers", default=",".join(SERVERS), help=f"comma-separated, from {', '.join(SERVERS)}")
+    parser.add_argument("--clients", type=int, default=DEFAULT_CLIENTS, help="concurrent client processes")
+    parser.add_argument("--warmup", type=float, default=DEFAULT_WARMUP, help="uncounted load before measuring")
+    parser.add_argument("--seconds", type=float, default=DEFAULT_SECONDS, help="measured load duration per server")
+    parser.add_argument("--write-share", type=float, default=DEFAULT_WRITE_SHARE,
+                        help="fraction of client steps that are a checkout + checkin pair")
+    parser.add_argument("--db", default=str(DB_PATH), help="database to copy for each run")
+    args = parser.parse_args(argv)
+
+    for server in args.servers.split(","):
+        result = run(server, args.clients, args.warmup, args.seconds, args.write_share, Path(args.db))
+        print(f"{server:16} {result['rps']:8.1f} req/s  ({result['reads']:,} reads, {result['writes']:,} writes, "
+              f"{result['errors']:,} errors)", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+import argparse
+import json
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from db import DB_PATH
+
+# Entry points whose import time is tracked: the web app, serve.py and the command-line tools
+MODULES = ["app", "serve", "cli", "main", "load_data", "normalize"]
+# Optional or heavy dependencies none of them should import up front
+HEAVY_MODULES = ["pandas", "numpy", "multiprocessing"]
+DEFAULT_REPEAT = 5
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{"seconds": time.perf_counter() - start,
+                   "heavy": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+# Startup of one worker, phase by phase, against the scratch copy of the database
+PHASES_SCRIPT = """
+import json, time
+phases = {}
+start = time.perf_counter()
+import app as app_module
+import startup
+phases["import app"] = time.perf_counter() - start
+mark = time.perf_counter()
+app = app_module.create_app()
+phases["create_app"] = time.perf_counter() - mark
+mark = time.perf_counter()
+startup.init_database()
+phases["init_database"] = time.perf_counter() - mark
+mark = time.perf_counter()
+startup.warmup(app)
+phases["warmup"] = time.perf_counter() - mark
+mark = time.perf_counter()
+app.test_client().get("/login")
+phases["first request"] = time.perf_counter() - mark
+print(json.dumps(phases))
+"""
+
+
+def _run(project: Path, script: str, *flags: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *flags, "-c", script], cwd=project, capture_output=True,
+                          text=True, check=True)
+
+
+def time_imports(project: Path, modules, repeat: int) -> dict:
+    """Median import time of each module in a fresh interpreter, and the heavy modules it pulled in."""
+    results = {}
+    for module in modules:
+        script = IMPORT_SCRIPT.format(module=module, heavy=HEAVY_MODULES)
+        runs = [json.loads(_run(project, script).stdout) for _ in range(repeat)]
+        results[module] = {"seconds": statistics.median(run["seconds"] for run in runs),
+                           "heavy": runs[0]["heavy"]}
+    return results
+
+
+def time_phases(project: Path, repeat: int) -> dict:
+    runs = [json.loads(_run(project, PHASES_SCRIPT).stdout) for _ in range(repeat)]
+    return {phase: statistics.median(run[phase] for run in runs) for phase in runs[0]}
+
+
+def top_imports(project: Path, module: str, count: int) -> list:
+    """The count modules with the largest own (self) import time, from python -X importtime."""
+    stderr = _run(project, f"import {module}", "-X", "importtime").stderr
+    rows = []
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "|" in line and "self" not in line:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            rows.append((int(self_us), int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Track import and startup time of the app and command-line tools.")
+    parser.add_argument("--db", default=str(DB_PATH), help="database to copy for the startup phases")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="runs per measurement; the median is reported")
+    parser.add_argument("--top", type=int, default=10, help="slowest modules imported by app.py to list")
+    parser.add_argument("--json", action="store_true", help="print one JSON line instead (to append to a history file)")
+    args = parser.parse_args(argv)
+    if not Path(args.db).exists():
+        print(f"{args.db} not found. Run load_data.py first.", file=sys.stderr)
+        return 1
+
+    workdir = Path(tempfile.mkdtemp(prefix="bench-startup-"))
+    try:
+        project = workdir / "project"
+        shutil.copytree(Path(__file__).resolve().parent, project,
+                        ignore=shutil.ignore_patterns(".git", "bench_data", "__pycache__", "*.db", "*.snap"))
+        shutil.copy(args.db, project / DB_PATH)
+        # Compile bytecode once, so every timed run starts the way a deployed server does
+        subprocess.run([sys.executable, "-m", "compileall", "-q", str(project)], check=True)
+
+        imports = time_imports(project, MODULES, args.repeat)
+        phases = time_phases(project, args.repeat)
+        slowest = top_imports(project, "app", args.top)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps({"python": sys.version.split()[0],
+                          "imports": {module: round(result["seconds"], 4) for module, result in imports.items()},
+                          "phases": {phase: round(seconds, 4) for phase, seconds in phases.items()}}))
+        return 0
+    print(f"{'import':<12} {'ms':>8}  heavy modules loaded")
+    for module, result in imports.items():
+        print(f"{module:<12} {result['seconds'] * 1000:8.1f}  {', '.join(result['heavy']) or '-'}")
+    print(f"\n{'startup phase':<16} {'ms':>8}")
+    for phase, seconds in phases.items():
+        print(f"{phase:<16} {seconds * 1000:8.1f}")
+    print("\nSlowest imports under app.py (own time, ms):")
+    for self_us, cumulative_us, name in slowest:
+        print(f"{self_us / 1000:8.1f}  {name}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,60 @@
-from typing import Optional
+import argparse
+import csv
+import re
+import sys
+from typing import IO, Iterator, List, Optional, Tuple
 
-from db import db_transaction
+from db import db_transaction, get_connection
 
+LOOKUP_LIMIT = 25
+IMPORT_BATCH_SIZE = 2000
 
-def _next_card_id(conn) -> int:
-    row = conn.execute("SELECT COALESCE(MAX(Card_id), 0) + 1 FROM BORROWER").fetchone()
+# Trigram index queries need at least three characters; shorter terms fall
+# back to a prefix scan of BORROWER.
+MIN_TRIGRAM_LENGTH = 3
+
+
+def reserve_card_ids(conn, count: int = 1) -> int:
+    """Reserve count consecutive Card_ids and return the first of them.
+
+    Call inside the transaction that inserts the borrowers: if it rolls back,
+    the reservation is released with it.
+    """
+    row = conn.execute(
+        "UPDATE CARD_SEQUENCE SET Next_id = Next_id + ? WHERE Name = 'BORROWER' RETURNING Next_id - ?",
+        (count, count),
+    ).fetchone()
     return row[0]
 
 
+def normalize_ssn(ssn: str) -> Optional[str]:
+    """Return the SSN as xxx-xx-xxxx, or None if it does not have nine digits."""
+    digits = re.sub(r"\D", "", ssn or "")
+    if len(digits) != 9:
+        return None
+    return f"{digits[:3]}-{digits[3:5]}-{digits[5:]}"
+
+
+# What normalize_ssn produces; anything else in BORROWER.Ssn predates it
+NORMALIZED_SSN_GLOB = "[0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9][0-9][0-9]"
+
+
+def normalize_stored_ssns(conn) -> int:
+    """Rewrite SSNs stored in another format (123456789, 123 45 6789) as xxx-xx-xxxx. Returns rows updated.
+
+    Run by db.ensure_schema, so duplicate checks can be exact lookups on the
+    UNIQUE(Ssn) index. A row whose normalized SSN another borrower already
+    has, or that has no nine digits, is left as it is.
+    """
+    rows = conn.execute("SELECT Card_id, Ssn FROM BORROWER WHERE Ssn NOT GLOB ?", (NORMALIZED_SSN_GLOB,)).fetchall()
+    updates = [(normalize_ssn(ssn), card_id) for card_id, ssn in rows if normalize_ssn(ssn)]
+    if not updates:
+        return 0
+    updated = conn.executemany("UPDATE OR IGNORE BORROWER SET Ssn = ? WHERE Card_id = ?", updates).rowcount
+    conn.commit()
+    return updated
+
+
 def create_borrower(
     conn,
     ssn: str,
@@ -15,21 +62,226 @@ def create_borrower(
     address: str,
     phone: Optional[str] = None,
 ) -> int:
-    ssn = (ssn or "").strip()
+    raw_ssn = (ssn or "").strip()
     name = (name or "").strip()
     address = (address or "").strip()
     phone = (phone or "").strip() or None
 
-    if not ssn or not name or not address:
+    if not raw_ssn or not name or not address:
         raise ValueError("SSN, name, and address are required")
+    ssn = normalize_ssn(raw_ssn)
+    if ssn is None:
+        raise ValueError("SSN must have nine digits")
 
-    with db_transaction(conn):
+    with db_transaction(conn, immediate=True):
         if conn.execute("SELECT 1 FROM BORROWER WHERE Ssn = ?", (ssn,)).fetchone():
             raise ValueError("Borrower with this SSN already exists")
 
-        card_id = _next_card_id(conn)
+        card_id = reserve_card_ids(conn)
         conn.execute(
             "INSERT INTO BORROWER(Card_id, Ssn, Bname, Address, Phone) VALUES (?, ?, ?, ?, ?)",
             (card_id, ssn, name, address, phone),
         )
         return card_id
+
+
+def _lookup_match(term: str) -> Optional[str]:
+    """Build an FTS5 MATCH expression for a desk search term, or None if it is too short."""
+    digits = re.sub(r"\D", "", term)
+    if digits and not re.search(r"[A-Za-z]", term):
+        # Phone numbers and SSNs are typed with arbitrary punctuation
+        if len(digits) < MIN_TRIGRAM_LENGTH:
+            return None
+        return f'{{Phone_digits Ssn_last4}} : "{digits}"'
+
+    if len(term) < MIN_TRIGRAM_LENGTH:
+        return None
+    return 'Bname : "' + term.replace('"', '""') + '"'
+
+
+def lookup_condition(term: str, card_column: str) -> Tuple[str, list]:
+    """Return a SQL condition limiting card_column to borrowers matching term.
+
+    Matches any substring of the name, phone digits or SSN last four through
+    the BORROWER_LOOKUP trigram index.
+    """
+    term = (term or "").strip()
+    match = _lookup_match(term)
+    if match is None:
+        return (
+            f"{card_column} IN (SELECT Card_id FROM BORROWER WHERE LOWER(Bname) LIKE ?)",
+            [f"{term.lower()}%"],
+        )
+    return (
+        f"{card_column} IN (SELECT rowid FROM BORROWER_LOOKUP WHERE BORROWER_LOOKUP MATCH ?)",
+        [match],
+    )
+
+
+def lookup_borrowers(conn, term: str, limit: int = LOOKUP_LIMIT) -> List[dict]:
+    """Find borrowers by Card ID, any part of their name, phone digits or SSN last four.
+
+    Results are ranked: exact Card ID first, then names starting with the
+    term, then by FTS relevance.
+    """
+    term = (term or "").strip()
+    if not term:
+        return []
+
+    match = _lookup_match(term)
+    card_id = int(term) if term.isdigit() else None
+    ssn = normalize_ssn(term) or term
+    if match is None:
+        rows = conn.execute(
+            """
+            SELECT Card_id, Ssn, Bname, Address, Phone
+            FROM BORROWER
+            WHERE Card_id = ? OR LOWER(Bname) LIKE ?
+            ORDER BY Card_id = ? DESC, Bname
+            LIMIT ?
+            """,
+            (card_id, f"{term.lower()}%", card_id, limit),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    rows = conn.execute(
+        """
+        SELECT bor.Card_id, bor.Ssn, bor.Bname, bor.Address, bor.Phone
+        FROM (
+            SELECT rowid AS Card_id, rank AS Score, 0 AS Exact
+            FROM BORROWER_LOOKUP
+            WHERE BORROWER_LOOKUP MATCH ?
+            UNION ALL
+            SELECT Card_id, 0, 1 FROM BORROWER WHERE Card_id = ? OR Ssn = ?
+        ) hit
+        JOIN BORROWER bor ON bor.Card_id = hit.Card_id
+        GROUP BY bor.Card_id
+        ORDER BY MAX(hit.Exact) DESC, LOWER(bor.Bname) LIKE ? DESC, MIN(hit.Score)
+        LIMIT ?
+        """,
+        (match, card_id, ssn, f"{term.lower()}%", limit),
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def _field(row: dict, *names: str) -> str:
+    for name in names:
+        for key, value in row.items():
+            if key and key.strip().lower() == name:
+                return (value or "").strip()
+    return ""
+
+
+def parse_borrowers(handle: IO[str], existing_ssns: set) -> Iterator[Tuple[int, Optional[tuple], Optional[str]]]:
+    """Yield (line, (ssn, name, address, phone), None) for each valid row, or (line, None, reason).
+
+    SSNs are checked against existing_ssns, which is extended as rows are
+    accepted so duplicates within the file are caught too.
+    """
+    reader = csv.DictReader(handle)
+    for row in reader:
+        ssn = normalize_ssn(_field(row, "ssn"))
+        name = _field(row, "bname", "name", "full name")
+        address = _field(row, "address")
+        phone = _field(row, "phone") or None
+
+        if not ssn:
+            yield reader.line_num, None, "invalid SSN"
+        elif not name or not address:
+            yield reader.line_num, None, "name and address are required"
+        elif ssn in existing_ssns:
+            yield reader.line_num, None, f"SSN {ssn} already registered"
+        else:
+            existing_ssns.add(ssn)
+            yield reader.line_num, (ssn, name, address, phone), None
+
+
+def _insert_batch(conn, batch: List[Tuple[int, tuple]]) -> Tuple[List[int], List[Tuple[int, str]]]:
+    """Insert (line, borrower) rows in one transaction; return the Card_ids used and the rows rejected.
+
+    A row whose SSN was registered after the import read the existing SSNs
+    (through the web form, say) is skipped and reported instead of rolling
+    back the whole batch. Card_ids reserved for skipped rows are handed back.
+    """
+    card_ids, rejected = [], []
+    with db_transaction(conn, immediate=True):
+        card_id = reserve_card_ids(conn, len(batch))
+        for line, row in batch:
+            inserted = conn.execute(
+                "INSERT INTO BORROWER(Card_id, Ssn, Bname, Address, Phone) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(Ssn) DO NOTHING",
+                (card_id, *row),
+            ).rowcount
+            if inserted:
+                card_ids.append(card_id)
+                card_id += 1
+            else:
+                rejected.append((line, f"SSN {row[0]} already registered"))
+        if rejected:
+            # Nothing else can reserve while this transaction holds the write lock
+            conn.execute(
+                "UPDATE CARD_SEQUENCE SET Next_id = Next_id - ? WHERE Name = 'BORROWER'", (len(rejected),)
+            )
+    return card_ids, rejected
+
+
+def import_borrowers(conn, handle: IO[str], batch_size: int = IMPORT_BATCH_SIZE) -> dict:
+    """Register every valid borrower in a CSV (Ssn, Bname, Address, Phone) and return a summary.
+
+    Existing SSNs are read once into memory instead of being queried per row,
+    and rows are inserted batch_size at a time, each batch in one transaction
+    with one block of reserved Card_ids. Rejected rows, including any whose
+    SSN was registered while the import ran, are listed in the summary as
+    (line, reason) and do not stop the import.
+    """
+    existing_ssns = {row[0] for row in conn.execute("SELECT Ssn FROM BORROWER")}
+    summary = {"imported": 0, "first_card_id": None, "last_card_id": None, "rejected": []}
+
+    def flush(batch):
+        card_ids, rejected = _insert_batch(conn, batch)
+        summary["imported"] += len(card_ids)
+        summary["rejected"].extend(rejected)
+        if card_ids:
+            if summary["first_card_id"] is None:
+                summary["first_card_id"] = card_ids[0]
+            summary["last_card_id"] = card_ids[-1]
+
+    batch = []
+    for line, borrower, reason in parse_borrowers(handle, existing_ssns):
+        if borrower is None:
+            summary["rejected"].append((line, reason))
+            continue
+        batch.append((line, borrower))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    summary["rejected"].sort()
+    return summary
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Bulk-register borrowers from a CSV file.")
+    parser.add_argument("csv_file", help="CSV with Ssn, Bname, Address and optional Phone columns")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    with get_connection() as conn:
+        with open(args.csv_file, newline="", encoding="utf-8-sig") as handle:
+            summary = import_borrowers(conn, handle, args.batch_size)
+
+    if summary["imported"]:
+        print(
+            f"Imported {summary['imported']} borrowers "
+            f"(Card IDs {summary['first_card_id']}-{summary['last_card_id']})"
+        )
+    else:
+        print("No borrowers imported")
+    for line, reason in summary["rejected"]:
+        print(f"Line {line}: {reason}", file=sys.stderr)
+    return 0 if not summary["rejected"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
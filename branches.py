@@ -0,0 +1,194 @@
+import os
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from db import DB_PATH, get_connection
+import search
+
+# "Main=library.db,East=east.db": every branch's circulation database. Each
+# branch runs its own app against its database (LIBRARY_DB in db.py);
+# federated search reads all of them.
+BRANCHES_ENV = "LIBRARY_BRANCHES"
+# Optional database whose BOOK, AUTHORS and BOOK_AUTHORS every branch shares
+# for matching. Without it the first branch's catalog is searched. A
+# branch's own BOOK table lists the titles it holds.
+CATALOG_ENV = "LIBRARY_CATALOG_DB"
+DEFAULT_BRANCH = "Main"
+
+# How long a federated search waits for the branches. One that has not
+# answered by then is interrupted and shown as unknown instead of holding
+# up the others.
+BRANCH_TIMEOUT = 2.0
+SEARCH_LIMIT = 20
+MAX_BRANCH_THREADS = 16
+
+IN, OUT, NOT_HELD, UNKNOWN = "IN", "OUT", "NOT HELD", "UNKNOWN"
+
+AVAILABILITY_SQL = """
+SELECT
+    b.Isbn,
+    EXISTS (SELECT 1 FROM BOOK_LOANS bl WHERE bl.Isbn = b.Isbn AND bl.Date_in IS NULL) AS Out
+FROM BOOK b
+WHERE b.Isbn IN ({marks})
+"""
+
+
+class Branch(NamedTuple):
+    name: str
+    db_path: Path
+
+
+def parse_branches(spec: str) -> List[Branch]:
+    """Parse 'Name=path,Name=path' into branches, in the order given."""
+    branches = []
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        name, sep, path = item.partition("=")
+        name, path = name.strip(), path.strip()
+        if not sep or not name or not path:
+            raise ValueError(f"Invalid branch '{item.strip()}': expected Name=path")
+        if any(branch.name == name for branch in branches):
+            raise ValueError(f"Branch '{name}' is listed twice")
+        branches.append(Branch(name, Path(path)))
+    if not branches:
+        raise ValueError("No branches configured")
+    return branches
+
+
+def configured_branches() -> List[Branch]:
+    """Branches from LIBRARY_BRANCHES, or this database as the only branch."""
+    spec = os.environ.get(BRANCHES_ENV)
+    return parse_branches(spec) if spec else [Branch(DEFAULT_BRANCH, DB_PATH)]
+
+
+def catalog_path(branches: Sequence[Branch]) -> Path:
+    path = os.environ.get(CATALOG_ENV)
+    return Path(path) if path else branches[0].db_path
+
+
+def branch_availability(conn, isbns: Sequence[str]) -> Dict[str, str]:
+    """IN or OUT for each of isbns this branch holds; titles it does not hold are left out."""
+    if not isbns:
+        return {}
+    marks = ", ".join("?" * len(isbns))
+    rows = conn.execute(AVAILABILITY_SQL.format(marks=marks), list(isbns)).fetchall()
+    return {row["Isbn"]: OUT if row["Out"] else IN for row in rows}
+
+
+# Branch queries run on one pool per process. A branch whose last late query
+# is still running is not sent another until it finishes, so a stuck
+# database ties up one thread rather than the whole pool.
+_pool = None
+_pool_lock = threading.Lock()
+_late: Dict[Path, Future] = {}
+# Searches run on concurrent request threads; _late is only read or changed under this
+_late_lock = threading.Lock()
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(MAX_BRANCH_THREADS, thread_name_prefix="branch")
+        return _pool
+
+
+def _query_branch(branch: Branch, isbns: Sequence[str], opened: list) -> Dict[str, str]:
+    conn = get_connection(branch.db_path)
+    # Lets the caller interrupt the query once it gives up waiting
+    opened.append(conn)
+    try:
+        return branch_availability(conn, isbns)
+    finally:
+        conn.close()
+
+
+def _interrupt(opened: list) -> None:
+    for conn in opened:
+        try:
+            conn.interrupt()
+        except sqlite3.ProgrammingError:
+            # Finished and closed in the meantime
+            pass
+
+
+def _after_fork() -> None:
+    # Pool threads do not survive fork
+    global _pool, _pool_lock, _late_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+    _late_lock = threading.Lock()
+    _late.clear()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def federated_search(query: str, offset: int = 0, limit: int = SEARCH_LIMIT,
+                     branches: Optional[Sequence[Branch]] = None,
+                     timeout: float = BRANCH_TIMEOUT) -> Tuple[int, List[dict], Dict[str, str]]:
+    """Search the catalog once and look up each match's availability at every branch in parallel.
+
+    Returns (total matches, one page of books, branch status). Books keep the
+    catalog's order (by title) and have Isbn, Title, Authors, Branches (branch
+    name -> IN, OUT, NOT HELD or UNKNOWN) and Status: IN if any branch has
+    the book on the shelf, else OUT if any has it on loan. Branch status is
+    'ok' or why that branch's availability is UNKNOWN.
+    """
+    branches = list(branches or configured_branches())
+    catalog = catalog_path(branches)
+    conn = get_connection(catalog)
+    try:
+        # The memory backend keeps one process-wide copy, of this process's own database
+        backend = None if catalog == DB_PATH else "sqlite"
+        total, books = search.search_page(conn, query, offset=offset, limit=limit, backend=backend)
+    finally:
+        conn.close()
+    isbns = [book["Isbn"] for book in books]
+
+    pending = {}
+    status = {}
+    for branch in branches:
+        with _late_lock:
+            previous = _late.get(branch.db_path)
+            if previous is not None and not previous.done():
+                status[branch.name] = "still answering an earlier search"
+                continue
+            _late.pop(branch.db_path, None)
+        opened = []
+        pending[_executor().submit(_query_branch, branch, isbns, opened)] = (branch, opened)
+    done, late = wait(pending, timeout=timeout)
+
+    answers = {}
+    for future, (branch, opened) in pending.items():
+        if future in late:
+            with _late_lock:
+                # A search that ran at the same time may have recorded its own late query
+                previous = _late.get(branch.db_path)
+                if previous is None or previous.done():
+                    _late[branch.db_path] = future
+            _interrupt(opened)
+            status[branch.name] = f"no answer within {timeout:g}s"
+        elif future.exception() is not None:
+            status[branch.name] = f"{type(future.exception()).__name__}: {future.exception()}"
+        else:
+            answers[branch.name] = future.result()
+            status[branch.name] = "ok"
+
+    results = []
+    for book in books:
+        availability = {branch.name: (answers[branch.name].get(book["Isbn"], NOT_HELD)
+                                      if branch.name in answers else UNKNOWN)
+                        for branch in branches}
+        results.append({
+            "Isbn": book["Isbn"],
+            "Title": book["Title"],
+            "Authors": book["Authors"],
+            "Branches": availability,
+            "Status": next((value for value in (IN, OUT, UNKNOWN) if value in availability.values()), NOT_HELD),
+        })
+    return total, results, {branch.name: status[branch.name] for branch in branches}
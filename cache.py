@@ -0,0 +1,53 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Tuple
+
+# Tables each cached page depends on. A fragment is reused only while the
+# DATA_VERSION counters of all of its tables are unchanged.
+SEARCH_TABLES = ("BOOK", "AUTHORS", "BOOK_AUTHORS", "BOOK_LOANS")
+BORROWER_TABLES = ("BORROWER",)
+FINES_TABLES = ("FINES", "BOOK_LOANS", "BORROWER")
+
+
+def data_versions(conn) -> Dict[str, int]:
+    """Return the current write counter of every versioned table."""
+    return {row["Name"]: row["Version"] for row in conn.execute("SELECT Name, Version FROM DATA_VERSION")}
+
+
+def version_key(versions: Dict[str, int], tables: Tuple[str, ...]) -> Tuple[int, ...]:
+    return tuple(versions.get(name, 0) for name in tables)
+
+
+class FragmentCache:
+    """Thread-safe LRU cache for rendered template fragments."""
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, object]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key: Hashable, render: Callable[[], object]):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        # Render outside the lock so a slow query does not block other pages.
+        value = render()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+fragment_cache = FragmentCache()
@@ -0,0 +1,245 @@
+import argparse
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import date
+from pathlib import Path
+from typing import IO, Callable, Iterator, Tuple
+
+import branches
+from db import DB_PATH, get_connection, run_batch
+from exports import DATASETS, FORMATS, stream_export
+from fines import pay_fines, refresh_fines
+from isbn import looks_like_isbn, resolve_isbn
+from loans import checkin, checkout
+from search import search_page
+
+# Operations read from a file are applied CLI_BATCH_SIZE at a time with
+# db.run_batch: one transaction and one disk sync per batch, while each
+# operation still succeeds or fails on its own.
+CLI_BATCH_SIZE = 500
+SEARCH_LIMIT = 20
+
+EXIT_OK = 0
+# At least one operation was refused (unknown book, loan limit, no match, ...)
+EXIT_REJECTED = 1
+# argparse exits with 2 on bad arguments
+EXIT_USAGE = 2
+# The database is missing, locked or failed mid-run, or an operation failed
+# unexpectedly (its batch is still reported line by line)
+EXIT_ERROR = 3
+
+
+def iter_input(handle: IO[str]) -> Iterator[Tuple[int, str]]:
+    """Yield (line number, text) for each non-blank line that is not a # comment."""
+    for number, line in enumerate(handle, start=1):
+        text = line.strip()
+        if text and not text.startswith("#"):
+            yield number, text
+
+
+def _fields(text: str, *names: str) -> list:
+    """Split an input line into the named fields.
+
+    A line is either a JSON object with those keys or the values themselves
+    separated by spaces or commas, as a scanner or a spreadsheet writes them.
+    """
+    if text.startswith("{"):
+        try:
+            record = json.loads(text)
+        except json.JSONDecodeError as err:
+            raise ValueError(f"Invalid JSON: {err.msg}")
+        if not isinstance(record, dict):
+            raise ValueError("Expected a JSON object")
+        return [record.get(name) for name in names]
+    values = text.replace(",", " ").split()
+    return values + [None] * (len(names) - len(values))
+
+
+def _int(value, label: str) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {label}: {value!r}")
+
+
+def _checkout(conn, text: str) -> dict:
+    isbn, card_id = _fields(text, "isbn", "card_id")
+    if not isbn:
+        raise ValueError("ISBN is required")
+    return {"loan_id": checkout(conn, str(isbn), _int(card_id, "card ID"))}
+
+
+def _checkin(conn, text: str) -> dict:
+    """Check in by Loan_id or, for a scanned book, by the ISBN of its open loan."""
+    if text.startswith("{"):
+        loan_id, isbn = _fields(text, "loan_id", "isbn")
+    else:
+        value = _fields(text, "value")[0]
+        loan_id, isbn = (None, value) if looks_like_isbn(value) else (value, None)
+    if loan_id is None and isbn:
+        row = conn.execute(
+            "SELECT Loan_id FROM BOOK_LOANS WHERE Isbn = ? AND Date_in IS NULL",
+            (resolve_isbn(conn, str(isbn)) or "",),
+        ).fetchone()
+        if not row:
+            raise ValueError(f"No open loan for ISBN '{isbn}'")
+        loan_id = row[0]
+    loan_id = _int(loan_id, "loan ID")
+    checkin(conn, loan_id)
+    return {"loan_id": loan_id}
+
+
+def _pay(conn, text: str) -> dict:
+    card_id = _int(_fields(text, "card_id")[0], "card ID")
+    pay_fines(conn, card_id)
+    return {"card_id": card_id}
+
+
+OPERATIONS = {
+    "checkout": _checkout,
+    "checkin": _checkin,
+    "pay": _pay,
+}
+
+
+def apply_operations(conn, operation: Callable, items: Iterator[Tuple[int, str]], out: IO[str],
+                     batch_size: int = CLI_BATCH_SIZE) -> dict:
+    """Apply operation to each (line, text) item in batched transactions, writing one JSON line per item.
+
+    A refused operation (ValueError) is reported and rolled back on its own;
+    the rest of its batch still commits. Any other error is reported the same
+    way, and the batch it happened in is the last one: the rest of that batch
+    has already committed, so every line of it is written before stopping.
+    Returns counts of ok, rejected and failed items.
+    """
+    summary = {"ok": 0, "rejected": 0, "failed": 0}
+    while True:
+        chunk = list(itertools.islice(items, batch_size))
+        if not chunk:
+            return summary
+        outcomes = run_batch(conn, [(operation, (text,), {}) for _, text in chunk])
+        for (line, _), (result, err) in zip(chunk, outcomes):
+            if err is None:
+                record = {"line": line, "ok": True, **result}
+                summary["ok"] += 1
+            elif isinstance(err, ValueError):
+                record = {"line": line, "ok": False, "error": str(err)}
+                summary["rejected"] += 1
+            else:
+                record = {"line": line, "ok": False, "error": f"{type(err).__name__}: {err}"}
+                summary["failed"] += 1
+            out.write(json.dumps(record) + "\n")
+        out.flush()
+        if summary["failed"]:
+            return summary
+
+
+def search_queries(conn, items: Iterator[Tuple[int, str]], out: IO[str], limit: int = SEARCH_LIMIT) -> dict:
+    """Write one JSON line per query with its total match count and at most limit books."""
+    summary = {"ok": 0, "rejected": 0}
+    for line, query in items:
+        total, books = search_page(conn, query, limit=limit)
+        out.write(json.dumps({"line": line, "query": query, "total": total, "results": books}) + "\n")
+        summary["ok" if total else "rejected"] += 1
+    return summary
+
+
+def search_branches(items: Iterator[Tuple[int, str]], out: IO[str], limit: int = SEARCH_LIMIT) -> dict:
+    """Like search_queries, with each book's availability at every configured branch."""
+    summary = {"ok": 0, "rejected": 0}
+    for line, query in items:
+        total, books, status = branches.federated_search(query, limit=limit)
+        out.write(json.dumps({"line": line, "query": query, "total": total, "results": books,
+                              "branches": status}) + "\n")
+        summary["ok" if total else "rejected"] += 1
+    return summary
+
+
+def _open_input(path: str) -> IO[str]:
+    if path == "-":
+        return sys.stdin
+    return open(path, newline="", encoding="utf-8-sig")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Run circulation operations in bulk from a file or stdin, one JSON line of output per input line.",
+        epilog=f"Exit status: {EXIT_OK} all succeeded, {EXIT_REJECTED} some were refused or matched nothing, "
+               f"{EXIT_USAGE} bad arguments, {EXIT_ERROR} database or unexpected error.",
+    )
+    parser.add_argument("--db", default=str(DB_PATH), help=f"database (default {DB_PATH})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    search = commands.add_parser("search", help="one ISBN, title or author query per line")
+    search.add_argument("--limit", type=int, default=SEARCH_LIMIT, help=f"books per query (default {SEARCH_LIMIT})")
+    search.add_argument("--branches", action="store_true",
+                        help=f"availability at every branch in ${branches.BRANCHES_ENV} instead of --db alone")
+    checkout_cmd = commands.add_parser("checkout", help="'ISBN CARD_ID' or {\"isbn\": ..., \"card_id\": ...} per line")
+    checkin_cmd = commands.add_parser("checkin", help="a Loan_id or a book's ISBN per line")
+    pay = commands.add_parser("pay", help="pay all fines of one Card_id per line")
+    for command in (search, checkout_cmd, checkin_cmd, pay):
+        command.add_argument("input", nargs="?", default="-", help="input file (default: stdin)")
+    for command in (checkout_cmd, checkin_cmd, pay):
+        command.add_argument("--batch-size", type=int, default=CLI_BATCH_SIZE,
+                             help=f"operations per transaction (default {CLI_BATCH_SIZE})")
+
+    refresh = commands.add_parser("refresh-fines", help="recompute unpaid fines")
+    refresh.add_argument("--date", type=date.fromisoformat, default=None, help="as of YYYY-MM-DD (default today)")
+    export = commands.add_parser("export", help="stream a dataset")
+    export.add_argument("dataset", choices=sorted(DATASETS))
+    export.add_argument("--format", choices=sorted(FORMATS), default="ndjson")
+    args = parser.parse_args(argv)
+
+    if getattr(args, "batch_size", 1) < 1:
+        parser.error("--batch-size must be at least 1")
+    if not Path(args.db).exists():
+        print(f"{args.db} not found.", file=sys.stderr)
+        return EXIT_ERROR
+
+    out = sys.stdout
+    start = time.perf_counter()
+    try:
+        if args.command == "export":
+            for chunk in stream_export(args.dataset, args.format, connect=lambda: get_connection(Path(args.db))):
+                out.write(chunk)
+            return EXIT_OK
+        with get_connection(Path(args.db)) as conn:
+            if args.command == "refresh-fines":
+                changed = refresh_fines(conn, args.date)
+                out.write(json.dumps({"ok": True, "fines_changed": changed}) + "\n")
+                return EXIT_OK
+            handle = _open_input(args.input)
+            try:
+                if args.command == "search" and args.branches:
+                    summary = search_branches(iter_input(handle), out, args.limit)
+                elif args.command == "search":
+                    summary = search_queries(conn, iter_input(handle), out, args.limit)
+                else:
+                    summary = apply_operations(conn, OPERATIONS[args.command], iter_input(handle), out,
+                                               args.batch_size)
+            finally:
+                if handle is not sys.stdin:
+                    handle.close()
+    except (sqlite3.Error, RuntimeError) as err:
+        print(f"{args.command} failed: {err}", file=sys.stderr)
+        return EXIT_ERROR
+    except BrokenPipeError:
+        # The reader (head, a closed socket) went away; whatever was applied stays applied
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return EXIT_ERROR
+
+    failed = summary.get("failed", 0)
+    print(f"{args.command}: {summary['ok']} ok, {summary['rejected']} refused"
+          f"{f', {failed} failed (stopped after that batch)' if failed else ''} "
+          f"in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    if failed:
+        return EXIT_ERROR
+    return EXIT_OK if summary["rejected"] == 0 else EXIT_REJECTED
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,26 @@
 #!/usr/bin/env python3
 """
-Create test data: overdue book loan with fines for Card ID 1003
+Create test data: overdue book loan with fines for a borrower (Card ID 1000 by default)
+
+The data goes into a copy of the template database (fine_test.db by
+default, see db.clone_database), made on the first run and reused after
+that; library.db is left alone. Run the app against the copy with
+LIBRARY_DB=fine_test.db.
 """
-import sqlite3
 from datetime import date, timedelta
+from pathlib import Path
+
+from auth import initialize_default_user
+from db import clone_database, get_connection
+
+TEST_DB = 'fine_test.db'
+# Borrowers in the template database have Card IDs 1 to 1000
+DEFAULT_CARD_ID = 1000
 
-def create_overdue_loan_with_fine(db_path='library.db', card_id=1003):
+def create_overdue_loan_with_fine(db_path=TEST_DB, card_id=DEFAULT_CARD_ID):
     """Create an overdue loan with calculated fine"""
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
+    conn = get_connection(db_path) if Path(db_path).exists() else clone_database(db_path)
+    initialize_default_user(conn)
     cursor = conn.cursor()
     
     print("=" * 70)
@@ -93,6 +105,7 @@ def create_overdue_loan_with_fine(db_path='library.db', card_id=1003):
     print(f"   - Fine Amount: ${fine_amount:.2f}")
     print(f"   - Fine Status: UNPAID")
     
+    print(f"\n🗄️  Database: {db_path} (start the app with LIBRARY_DB={db_path})")
     print(f"\n🧪 Test Scenarios:")
     print(f"   1. Login as user with Card ID {card_id}")
     print(f"   2. Go to Profile page")
@@ -121,8 +134,8 @@ def create_overdue_loan_with_fine(db_path='library.db', card_id=1003):
 if __name__ == '__main__':
     import sys
     
-    card_id = int(sys.argv[1]) if len(sys.argv) > 1 else 1003
-    db_path = sys.argv[2] if len(sys.argv) > 2 else 'library.db'
+    card_id = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_CARD_ID
+    db_path = sys.argv[2] if len(sys.argv) > 2 else TEST_DB
     
     success = create_overdue_loan_with_fine(db_path, card_id)
     sys.exit(0 if success else 1)
@@ -1,21 +1,164 @@
+import itertools
+import os
 import sqlite3
+import threading
 from contextlib import contextmanager
+from datetime import date
 from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Tuple, Union
 
-DB_PATH = Path("library.db")
+# The database this process serves. Each branch of a multi-branch deployment
+# runs the app with LIBRARY_DB set to its own database (see branches.py).
+DB_PATH_ENV = "LIBRARY_DB"
+DB_PATH = Path(os.environ.get(DB_PATH_ENV, "library.db"))
+SCHEMA_FILE = Path("schema.sql")
+
+# Columns added to tables after their first release. ensure_schema adds any
+# that an older database is missing before schema.sql indexes them.
+ADDED_COLUMNS = [
+    ("BOOK", "Isbn13", "CHAR(13)"),
+    ("BOOK_LOANS", "Due_day", "INTEGER GENERATED ALWAYS AS (CAST(julianday(Due_date) - 2440587.5 AS INTEGER)) VIRTUAL"),
+    ("BOOK_LOANS", "In_day", "INTEGER GENERATED ALWAYS AS (CAST(julianday(Date_in) - 2440587.5 AS INTEGER)) VIRTUAL"),
+]
+
+# BOOK_LOANS.Due_day and In_day are day numbers (days since 1970-01-01) of the
+# ISO dates beside them; compare them against day_number(today).
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Set by maintenance.background_checkpoints() in processes where a Maintainer
+# checkpoints the WAL. Commits then only checkpoint once the WAL passes
+# BACKGROUND_AUTOCHECKPOINT pages (about 40 MB): a background checkpoint can
+# copy frames but only a committing writer can restart the WAL from the top.
+BACKGROUND_CHECKPOINT_ENV = "LIBRARY_BACKGROUND_CHECKPOINT"
+BACKGROUND_AUTOCHECKPOINT = 10000
+
+_savepoint_ids = itertools.count()
+
+# Connection class get_connection opens; metrics.enable() swaps in one that
+# times every statement.
+connection_factory = sqlite3.Connection
+
+# Tests and sandboxes work on clones of one fully loaded template instead of
+# library.db. The template is built once per process; a clone is a page copy
+# made with the backup API and shares nothing with the template or other clones.
+_template = None
+_template_lock = threading.Lock()
 
 
 def get_connection(db_path: Path = DB_PATH) -> sqlite3.Connection:
-    conn = sqlite3.connect(db_path)
+    conn = sqlite3.connect(db_path, factory=connection_factory)
     conn.row_factory = sqlite3.Row
+    if os.environ.get(BACKGROUND_CHECKPOINT_ENV) == "1":
+        conn.execute(f"PRAGMA wal_autocheckpoint = {BACKGROUND_AUTOCHECKPOINT}")
     return conn
 
 
+def day_number(day: date) -> int:
+    return day.toordinal() - _EPOCH_ORDINAL
+
+
+def database_file(conn: sqlite3.Connection, schema: str = "main") -> Optional[Path]:
+    """Path of an open database's file, or None for an in-memory or unattached one."""
+    for _, name, filename in conn.execute("PRAGMA database_list"):
+        if name == schema:
+            return Path(filename) if filename else None
+    return None
+
+
 @contextmanager
-def db_transaction(conn: sqlite3.Connection):
+def db_transaction(conn: sqlite3.Connection, immediate: bool = False):
+    """Commit the block's writes, or roll them back if it raises.
+
+    Inside an enclosing transaction (a group-commit batch, or a caller that
+    has already written) the block runs in a savepoint instead: a failure
+    undoes only its own writes and the enclosing transaction does the commit.
+    Pass immediate=True to take the write lock up front.
+    """
+    if conn.in_transaction:
+        name = f"sp_{next(_savepoint_ids)}"
+        conn.execute(f"SAVEPOINT {name}")
+        try:
+            yield
+        except Exception:
+            conn.execute(f"ROLLBACK TO {name}")
+            conn.execute(f"RELEASE {name}")
+            raise
+        conn.execute(f"RELEASE {name}")
+        return
+
+    if immediate:
+        conn.execute("BEGIN IMMEDIATE")
     try:
         yield
         conn.commit()
     except Exception:
         conn.rollback()
         raise
+
+
+def run_batch(conn: sqlite3.Connection, operations: Sequence[Tuple[Callable, tuple, dict]]) -> List[tuple]:
+    """Run write operations in a single transaction with one commit.
+
+    Each (fn, args, kwargs) is called as fn(conn, *args, **kwargs) inside its
+    own savepoint, so one failing operation is rolled back without affecting
+    the rest. Returns a (result, error) pair per operation, in order.
+    """
+    outcomes = []
+    with db_transaction(conn, immediate=True):
+        for fn, args, kwargs in operations:
+            try:
+                with db_transaction(conn):
+                    outcomes.append((fn(conn, *args, **kwargs), None))
+            except Exception as err:
+                outcomes.append((None, err))
+    return outcomes
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    """Create any tables, indexes and triggers missing from an existing database.
+
+    Every statement in schema.sql is idempotent, so this is safe to run on
+    each startup against a database created by an older version of the app.
+    """
+    for table, column, declaration in ADDED_COLUMNS:
+        # table_xinfo also lists generated columns
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_xinfo({table})")}
+        if existing and column not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+    conn.executescript(SCHEMA_FILE.read_text(encoding="utf-8"))
+
+    from borrowers import normalize_stored_ssns
+    from isbn import backfill_isbn13
+    from maintenance import enable_wal
+    from rollups import ensure_rollups
+    from spelling import ensure_vocabulary
+    enable_wal(conn)
+    backfill_isbn13(conn)
+    normalize_stored_ssns(conn)
+    ensure_vocabulary(conn)
+    ensure_rollups(conn)
+
+
+def template_database() -> sqlite3.Connection:
+    """The process's template: an in-memory database loaded from the CSVs by load_data, built on first use."""
+    global _template
+    with _template_lock:
+        if _template is None:
+            from load_data import load_all
+            conn = sqlite3.connect(":memory:", check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            load_all(conn, snapshot=False)
+            _template = conn
+        return _template
+
+
+def clone_database(target: Union[str, Path] = ":memory:") -> sqlite3.Connection:
+    """Return a connection to a fresh copy of the template database.
+
+    target is ":memory:" or a file path; an existing file is overwritten.
+    """
+    template = template_database()
+    conn = get_connection(target)
+    with _template_lock:
+        template.backup(conn)
+    return conn
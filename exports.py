@@ -0,0 +1,158 @@
+import argparse
+import csv
+import io
+import json
+import sys
+from typing import Callable, Dict, Iterator, List
+
+from archive import attach_history
+from db import get_connection
+
+# Rows are read in keyset-paginated chunks: each chunk is a short statement
+# that releases its read lock before the next, so a long export never holds
+# the database against writers and memory stays bounded by the chunk size.
+EXPORT_BATCH_SIZE = 1000
+CSV_FLUSH_ROWS = 200
+
+DATASETS: Dict[str, dict] = {
+    "loans": {
+        "columns": ["Loan_id", "Isbn", "Card_id", "Date_out", "Due_date", "Date_in"],
+        "key": "Loan_id",
+        "start": 0,
+        "sql": """
+            SELECT Loan_id, Isbn, Card_id, Date_out, Due_date, Date_in
+            FROM LOAN_HISTORY
+            WHERE Loan_id > ?
+            ORDER BY Loan_id
+            LIMIT ?
+        """,
+    },
+    "fines": {
+        "columns": ["Loan_id", "Card_id", "Bname", "Isbn", "Fine_amt", "Paid"],
+        "key": "Loan_id",
+        "start": 0,
+        "sql": """
+            SELECT f.Loan_id, f.Card_id, bor.Bname, f.Isbn, f.Fine_amt, f.Paid
+            FROM FINE_HISTORY f
+            LEFT JOIN BORROWER bor ON f.Card_id = bor.Card_id
+            WHERE f.Loan_id > ?
+            ORDER BY f.Loan_id
+            LIMIT ?
+        """,
+    },
+    "borrowers": {
+        "columns": ["Card_id", "Ssn", "Bname", "Address", "Phone"],
+        "key": "Card_id",
+        "start": -1,
+        "sql": """
+            SELECT Card_id, Ssn, Bname, Address, Phone
+            FROM BORROWER
+            WHERE Card_id > ?
+            ORDER BY Card_id
+            LIMIT ?
+        """,
+    },
+    "catalog": {
+        "columns": ["Isbn", "Title", "Authors"],
+        "key": "Isbn",
+        "start": "",
+        "sql": """
+            SELECT b.Isbn, b.Title, COALESCE(GROUP_CONCAT(a.Name, ', '), '') AS Authors
+            FROM BOOK b
+            LEFT JOIN BOOK_AUTHORS ba ON b.Isbn = ba.Isbn
+            LEFT JOIN AUTHORS a ON ba.Author_id = a.Author_id
+            WHERE b.Isbn > ?
+            GROUP BY b.Isbn
+            ORDER BY b.Isbn
+            LIMIT ?
+        """,
+    },
+}
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def iter_rows(conn, dataset: str, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[dict]:
+    """Yield every row of a dataset as a dict, one keyset chunk at a time."""
+    if dataset not in DATASETS:
+        raise ValueError(f"Unknown export dataset '{dataset}'")
+    spec = DATASETS[dataset]
+    last_key = spec["start"]
+    # Loans and fines include the archive (see archive.py)
+    attach_history(conn)
+
+    while True:
+        chunk = conn.execute(spec["sql"], (last_key, batch_size)).fetchall()
+        if not chunk:
+            return
+        for row in chunk:
+            yield dict(row)
+        last_key = chunk[-1][spec["key"]]
+        if len(chunk) < batch_size:
+            return
+
+
+def to_csv(rows: Iterator[dict], columns: List[str]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, lineterminator="\n")
+    writer.writeheader()
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= CSV_FLUSH_ROWS:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue()
+
+
+def to_ndjson(rows: Iterator[dict]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(row) + "\n"
+
+
+def stream_export(dataset: str, fmt: str, connect: Callable = get_connection) -> Iterator[str]:
+    """Generate an export in the requested format using a connection owned by the generator."""
+    if dataset not in DATASETS:
+        raise ValueError(f"Unknown export dataset '{dataset}'")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}'")
+
+    def generate():
+        conn = connect()
+        try:
+            rows = iter_rows(conn, dataset)
+            if fmt == "csv":
+                yield from to_csv(rows, DATASETS[dataset]["columns"])
+            else:
+                yield from to_ndjson(rows)
+        finally:
+            conn.close()
+
+    return generate()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Stream a library dataset as CSV or NDJSON.")
+    parser.add_argument("dataset", choices=sorted(DATASETS))
+    parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+    parser.add_argument("--output", "-o", help="File to write (default: stdout)")
+    args = parser.parse_args(argv)
+
+    out = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+    try:
+        for chunk in stream_export(args.dataset, args.format):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,78 +1,65 @@
 from datetime import date
 from typing import List, Optional
 
-from db import db_transaction
+from db import day_number, db_transaction
+from metrics import FINE_REFRESH_SECONDS
 
 DAILY_FINE = 0.25
 
+# Loans that owe a fine as of :today (a day number): still out past their due
+# day, or returned after it. Each half is a range scan of its own partial
+# index, and the fine is computed in SQL from the integer day columns.
+LATE_LOANS_SQL = """
+    SELECT Loan_id, :today - Due_day AS Days_late
+    FROM BOOK_LOANS
+    WHERE Date_in IS NULL AND Due_day < :today{loan}
+    UNION ALL
+    SELECT Loan_id, In_day - Due_day
+    FROM BOOK_LOANS
+    WHERE In_day > Due_day AND Due_day < :today{loan}
+"""
 
-def _parse_iso(value: str) -> date:
-    return date.fromisoformat(value)
 
+def refresh_fines(conn, today: Optional[date] = None, loan_id: Optional[int] = None) -> int:
+    """Insert or update the unpaid fine of every late loan (or just loan_id) in one statement.
 
-def refresh_fines(conn, today: Optional[date] = None, loan_id: Optional[int] = None) -> None:
+    Paid fines are left alone, and fines whose amount has not changed are not
+    rewritten, so their rollup triggers do not fire. Returns the number of
+    fines inserted or changed.
+    """
     today = today or date.today()
-    params = {"today": today.isoformat()}
-    extra_clause = ""
+    params = {"today": day_number(today), "daily_fine": DAILY_FINE}
+    loan_clause = ""
     if loan_id is not None:
-        extra_clause = " AND Loan_id = :loan_id"
+        loan_clause = " AND Loan_id = :loan_id"
         params["loan_id"] = int(loan_id)
 
-    cursor = conn.cursor()
-    rows = cursor.execute(
-        """
-        SELECT Loan_id, Due_date, Date_in
-        FROM BOOK_LOANS
-        WHERE Due_date < :today
-          AND (Date_in IS NULL OR Date_in > Due_date)
-        """
-        + extra_clause,
-        params,
-    ).fetchall()
-
-    with db_transaction(conn):
-        for row in rows:
-            due_date = _parse_iso(row["Due_date"])
-            if row["Date_in"]:
-                end_date = _parse_iso(row["Date_in"])
-            else:
-                end_date = today
-            days_late = (end_date - due_date).days
-            if days_late <= 0:
-                continue
-            fine_amt = round(days_late * DAILY_FINE, 2)
-
-            existing = conn.execute(
-                "SELECT Paid FROM FINES WHERE Loan_id = ?",
-                (row["Loan_id"],),
-            ).fetchone()
-            if existing:
-                if existing["Paid"]:
-                    continue
-                conn.execute(
-                    "UPDATE FINES SET Fine_amt = ? WHERE Loan_id = ? AND Paid = 0",
-                    (fine_amt, row["Loan_id"]),
-                )
-            else:
-                conn.execute(
-                    "INSERT INTO FINES (Loan_id, Fine_amt, Paid) VALUES (?, ?, 0)",
-                    (row["Loan_id"], fine_amt),
-                )
+    with FINE_REFRESH_SECONDS.time("all" if loan_id is None else "loan"), db_transaction(conn):
+        return conn.execute(
+            f"""
+            INSERT INTO FINES (Loan_id, Fine_amt, Paid)
+            SELECT Loan_id, ROUND(Days_late * :daily_fine, 2), 0
+            FROM ({LATE_LOANS_SQL.format(loan=loan_clause)})
+            WHERE true
+            ON CONFLICT (Loan_id) DO UPDATE SET Fine_amt = excluded.Fine_amt
+            WHERE Paid = 0 AND Fine_amt <> excluded.Fine_amt
+            """,
+            params,
+        ).rowcount
 
 
 def list_outstanding_fines(conn) -> List[dict]:
+    # BORROWER_FINES is kept current by triggers on FINES (see schema.sql)
     cursor = conn.cursor()
     cursor.execute(
         """
         SELECT
             bor.Card_id,
             bor.Bname,
-            SUM(f.Fine_amt) AS Total_Fines
-        FROM FINES f
-        JOIN BOOK_LOANS bl ON f.Loan_id = bl.Loan_id
-        JOIN BORROWER bor  ON bl.Card_id = bor.Card_id
-        WHERE f.Paid = 0
-        GROUP BY bor.Card_id, bor.Bname
+            ROUND(bf.Unpaid_amt, 2) AS Total_Fines
+        FROM BORROWER_FINES bf
+        JOIN BORROWER bor ON bf.Card_id = bor.Card_id
+        WHERE bf.Unpaid_count > 0
         ORDER BY bor.Bname
         """
     )
@@ -109,3 +96,27 @@ def pay_fines(conn, card_id: int) -> None:
         )
         if updated.rowcount == 0:
             raise ValueError("No unpaid fines for this borrower")
+
+
+def pay_fine(conn, loan_id: int, card_id: int) -> float:
+    """Mark one borrower's fine paid and return the amount."""
+    loan_id = int(loan_id)
+    with db_transaction(conn):
+        fine = conn.execute(
+            """
+            SELECT f.Fine_amt, f.Paid, bl.Card_id
+            FROM FINES f
+            JOIN BOOK_LOANS bl ON f.Loan_id = bl.Loan_id
+            WHERE f.Loan_id = ?
+            """,
+            (loan_id,),
+        ).fetchone()
+        if not fine:
+            raise ValueError("Fine not found.")
+        if fine["Card_id"] != card_id:
+            raise ValueError("You can only pay your own fines.")
+        if fine["Paid"] == 1:
+            raise ValueError("This fine has already been paid.")
+
+        conn.execute("UPDATE FINES SET Paid = 1 WHERE Loan_id = ?", (loan_id,))
+    return fine["Fine_amt"]
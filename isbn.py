@@ -0,0 +1,93 @@
+import re
+from typing import Optional
+
+ISBN10_PATTERN = re.compile(r"\d{9}[\dX]")
+ISBN13_PATTERN = re.compile(r"\d{13}")
+
+BACKFILL_BATCH_SIZE = 5000
+
+
+def canonicalize(value: str) -> str:
+    """Strip the hyphens and spaces scanners and people add, and upper-case the X check digit."""
+    return re.sub(r"[\s\-]", "", value or "").upper()
+
+
+def is_isbn10(value: str) -> bool:
+    return bool(ISBN10_PATTERN.fullmatch(value))
+
+
+def is_isbn13(value: str) -> bool:
+    return bool(ISBN13_PATTERN.fullmatch(value))
+
+
+def looks_like_isbn(value: str) -> bool:
+    """True if the input, once canonicalized, has the shape of an ISBN-10 or ISBN-13."""
+    canonical = canonicalize(value)
+    return is_isbn10(canonical) or is_isbn13(canonical)
+
+
+def isbn10_to_13(isbn10: str) -> Optional[str]:
+    isbn10 = canonicalize(isbn10)
+    if not is_isbn10(isbn10):
+        return None
+    core = "978" + isbn10[:9]
+    total = sum(int(digit) * (1 if index % 2 == 0 else 3) for index, digit in enumerate(core))
+    return core + str((10 - total % 10) % 10)
+
+
+def isbn13_to_10(isbn13: str) -> Optional[str]:
+    """Convert a 978-prefixed ISBN-13 to ISBN-10. 979 numbers have no ISBN-10 form."""
+    isbn13 = canonicalize(isbn13)
+    if not is_isbn13(isbn13) or not isbn13.startswith("978"):
+        return None
+    core = isbn13[3:12]
+    total = sum(int(digit) * weight for digit, weight in zip(core, range(10, 1, -1)))
+    check = (11 - total % 11) % 11
+    return core + ("X" if check == 10 else str(check))
+
+
+def resolve_isbn(conn, value: str) -> Optional[str]:
+    """Map scanned or typed ISBN input to the BOOK primary key using index lookups only.
+
+    Accepts ISBN-10 or ISBN-13, with or without hyphens. Returns None when no
+    book in the catalog matches.
+    """
+    canonical = canonicalize(value)
+    if is_isbn13(canonical):
+        isbn10 = isbn13_to_10(canonical)
+        # ISBN-13s derived during backfill can coincide for ISBN-10s that differ
+        # only in a bad check digit; prefer the one with the valid check digit.
+        row = conn.execute(
+            "SELECT Isbn FROM BOOK WHERE Isbn13 = ? ORDER BY Isbn = ? DESC LIMIT 1",
+            (canonical, isbn10),
+        ).fetchone()
+        if row:
+            return row[0]
+        canonical = isbn10 or ""
+
+    if canonical:
+        row = conn.execute("SELECT Isbn FROM BOOK WHERE Isbn = ?", (canonical,)).fetchone()
+        if row:
+            return row[0]
+    return None
+
+
+def backfill_isbn13(conn) -> int:
+    """Fill BOOK.Isbn13 for rows loaded before the column existed. Returns rows updated."""
+    updated = 0
+    last_isbn = ""
+    while True:
+        rows = conn.execute(
+            "SELECT Isbn FROM BOOK WHERE Isbn13 IS NULL AND Isbn > ? ORDER BY Isbn LIMIT ?",
+            (last_isbn, BACKFILL_BATCH_SIZE),
+        ).fetchall()
+        if not rows:
+            break
+        conn.executemany(
+            "UPDATE BOOK SET Isbn13 = ? WHERE Isbn = ?",
+            [(isbn10_to_13(row[0]), row[0]) for row in rows],
+        )
+        conn.commit()
+        updated += len(rows)
+        last_isbn = rows[-1][0]
+    return updated
@@ -3,9 +3,13 @@ import re
 from pathlib import Path
 from typing import Iterable, Tuple
 
-from db import get_connection
+from archive import archive_path
+from db import SCHEMA_FILE, database_file, get_connection
+from maintenance import analyze, enable_incremental_vacuum, enable_wal
+from isbn import canonicalize, is_isbn13, isbn10_to_13
+from rollups import rebuild_rollups
+from spelling import build_vocabulary
 
-SCHEMA_FILE = Path("schema.sql")
 BOOK_FILE = Path("book.csv")
 AUTHORS_FILE = Path("authors.csv")
 BOOK_AUTHORS_FILE = Path("book_authors.csv")
@@ -17,6 +21,14 @@ DROP TABLE IF EXISTS FINES;
 DROP TABLE IF EXISTS BOOK_LOANS;
 DROP TABLE IF EXISTS BOOK_AUTHORS;
 DROP TABLE IF EXISTS AUTHORS;
+DROP TABLE IF EXISTS BORROWER_LOOKUP;
+DROP TABLE IF EXISTS CARD_SEQUENCE;
+DROP TABLE IF EXISTS SEARCH_VOCAB;
+DROP TABLE IF EXISTS DAILY_CIRCULATION;
+DROP TABLE IF EXISTS BOOK_CIRCULATION;
+DROP TABLE IF EXISTS OPEN_LOANS_BY_DUE;
+DROP TABLE IF EXISTS BORROWER_FINES;
+DROP TABLE IF EXISTS CIRCULATION_TOTALS;
 DROP TABLE IF EXISTS BORROWER;
 DROP TABLE IF EXISTS BOOK;
 """
@@ -32,16 +44,28 @@ def _read_csv_rows(path: Path) -> Iterable[dict]:
 
 def initialize_schema(conn) -> None:
     conn.executescript(DROP_STATEMENTS)
+    # Rebuilding the emptied file is cheap, and later deletes can then give pages back
+    enable_incremental_vacuum(conn)
+    enable_wal(conn)
     conn.executescript(SCHEMA_FILE.read_text(encoding="utf-8"))
+    # Archived loans belong to the history just dropped, and Loan_ids start over
+    db_file = database_file(conn)
+    if db_file is not None:
+        archive_path(db_file).unlink(missing_ok=True)
 
 
 def load_book(conn) -> None:
-    rows: Tuple[Tuple[str, str], ...] = tuple(
-        (row["Isbn"].strip(), row["Title"].strip())
+    def _isbn13(row: dict) -> str:
+        # Keep the catalog's own ISBN-13 when the CSV has one, otherwise derive it
+        value = canonicalize(row.get("Isbn13") or "")
+        return value if is_isbn13(value) else isbn10_to_13(row["Isbn"])
+
+    rows: Tuple[Tuple[str, str, str], ...] = tuple(
+        (canonicalize(row["Isbn"]), row["Title"].strip(), _isbn13(row))
         for row in _read_csv_rows(BOOK_FILE)
         if row.get("Isbn") and row.get("Title")
     )
-    conn.executemany("INSERT INTO BOOK(Isbn, Title) VALUES (?, ?)", rows)
+    conn.executemany("INSERT INTO BOOK(Isbn, Title, Isbn13) VALUES (?, ?, ?)", rows)
 
 
 def load_authors(conn) -> None:
@@ -55,7 +79,7 @@ def load_authors(conn) -> None:
 
 def load_book_authors(conn) -> None:
     rows = [
-        (int(row["Author_id"]), row["Isbn"].strip())
+        (int(row["Author_id"]), canonicalize(row["Isbn"]))
         for row in _read_csv_rows(BOOK_AUTHORS_FILE)
         if row.get("Author_id") and row.get("Isbn")
     ]
@@ -91,13 +115,20 @@ def load_borrowers(conn) -> None:
     )
 
 
-def load_all(conn) -> None:
+def load_all(conn, snapshot: bool = True) -> None:
     initialize_schema(conn)
     load_book(conn)
     load_authors(conn)
     load_book_authors(conn)
     load_borrowers(conn)
     conn.commit()
+    build_vocabulary(conn)
+    rebuild_rollups(conn)
+    analyze(conn)
+    if snapshot:
+        # Imported here: it pulls in numpy, which main.py and the tests never need
+        from snapshot import write_snapshot
+        write_snapshot(conn)
 
 
 if __name__ == "__main__":
@@ -1,7 +1,9 @@
 from datetime import date, timedelta
 from typing import List, Optional
 
+from borrowers import lookup_condition
 from db import db_transaction
+from isbn import canonicalize, resolve_isbn
 
 MAX_ACTIVE_LOANS = 3
 
@@ -44,10 +46,14 @@ def checkout(conn, isbn: str, card_id: int) -> int:
     with db_transaction(conn):
         cursor = conn.cursor()
 
-        # Check if book exists
-        book = cursor.execute("SELECT Title FROM BOOK WHERE Isbn = ?", (isbn,)).fetchone()
+        # Check if book exists (scanners may send ISBN-13 or hyphenated input)
+        book = cursor.execute(
+            "SELECT Isbn, Title FROM BOOK WHERE Isbn = ?",
+            (resolve_isbn(conn, isbn) or canonicalize(isbn),),
+        ).fetchone()
         if not book:
             raise ValueError(f"Book with ISBN '{isbn}' not found in the system")
+        isbn = book["Isbn"]
 
         # Check if borrower exists
         borrower = cursor.execute(
@@ -134,14 +140,17 @@ def find_open_loans(
     params = []
 
     if isbn:
-        conditions.append("LOWER(bl.Isbn) = LOWER(?)")
-        params.append(isbn)
+        # Exact match on the canonical ISBN so the lookup can use an index
+        conditions.append("bl.Isbn = ?")
+        params.append(resolve_isbn(conn, isbn) or canonicalize(isbn))
     if card_id is not None:
         conditions.append("bl.Card_id = ?")
         params.append(int(card_id))
     if borrower_name:
-        conditions.append("LOWER(bor.Bname) LIKE ?")
-        params.append(f"%{borrower_name.lower()}%")
+        # Matches any part of the name, phone digits or SSN last four
+        lookup_sql, lookup_params = lookup_condition(borrower_name, "bl.Card_id")
+        conditions.append(lookup_sql)
+        params.extend(lookup_params)
 
     if len(conditions) == 1:
         raise ValueError("Provide at least one search parameter")
@@ -1,6 +1,8 @@
-from db import get_connection
+from db import ensure_schema, get_connection
 from load_data import load_all
 from search import search_books
+from spelling import suggest_query
+from isbn import looks_like_isbn
 from loans import checkout, find_open_loans, checkin, checkin_multiple
 from borrowers import create_borrower
 from fines import refresh_fines, list_outstanding_fines, pay_fines
@@ -39,8 +41,13 @@ def handle_search(conn):
     query = prompt("Enter ISBN, title, or author search: ")
     results = search_books(conn, query)
     if not results:
-        print("No matches found.")
-        return
+        corrected = suggest_query(conn, query) if not looks_like_isbn(query) else None
+        if corrected:
+            results = search_books(conn, corrected)
+        if not results:
+            print("No matches found.")
+            return
+        print(f'No matches for "{query}". Showing results for "{corrected}":')
     for row in results:
         authors = row.get("Authors", "") or "Unknown"
         print(f"{row['Isbn']} | {row['Title']} | {authors} | {row['Status']}")
@@ -182,6 +189,7 @@ def handle_pay_fines(conn):
 
 def main():
     with get_connection() as conn:
+        ensure_schema(conn)
         while True:
             print(MENU)
             choice = prompt("Select option: ")
@@ -0,0 +1,231 @@
+import argparse
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from db import BACKGROUND_CHECKPOINT_ENV, DB_PATH, database_file, get_connection
+
+# Background maintenance cadence. A passive checkpoint copies committed WAL
+# frames into the database without waiting on readers or writers, so commits
+# rarely find anything left to copy when their own (raised) automatic
+# checkpoint comes due; planner statistics and free pages change slowly.
+CHECKPOINT_INTERVAL = 1.0
+OPTIMIZE_INTERVAL = 3600.0
+# A WAL file larger than this is truncated once no reader still needs it
+WAL_TRUNCATE_BYTES = 64 * 1024 * 1024
+# Free pages returned to the filesystem per maintenance pass
+VACUUM_STEP_PAGES = 2000
+# Rows PRAGMA optimize samples per index when it decides to re-analyze
+ANALYSIS_LIMIT = 1000
+
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+
+
+def enable_wal(conn) -> str:
+    """Switch the database to WAL (a persistent setting) and return the journal mode now in effect."""
+    return conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+
+
+def enable_incremental_vacuum(conn) -> bool:
+    """Switch to incremental auto-vacuum; returns True if the database had to be rebuilt.
+
+    Changing the mode of a database that already has tables takes a full
+    VACUUM, which rewrites the file and blocks writers while it runs.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return False
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    return True
+
+
+def analyze(conn) -> None:
+    """Gather full planner statistics. Run after bulk loads and large deletes."""
+    conn.execute("ANALYZE")
+    conn.commit()
+
+
+def optimize(conn) -> None:
+    """Let SQLite refresh whichever statistics the connection's queries showed to be stale."""
+    conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+    if not _has_statistics(conn):
+        # PRAGMA optimize only refreshes statistics that already exist
+        conn.execute("ANALYZE")
+    conn.execute("PRAGMA optimize")
+    conn.commit()
+
+
+def _has_statistics(conn) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'").fetchone() is not None
+
+
+def checkpoint(conn, wal_limit: int = WAL_TRUNCATE_BYTES) -> tuple:
+    """Copy committed WAL frames into the database; truncate the WAL if it has grown past wal_limit.
+
+    Never waits: a truncating checkpoint that finds readers or a writer
+    active does what a passive one would and leaves truncation for later.
+    Returns SQLite's (busy, wal frames, frames checkpointed).
+    """
+    if wal_size(conn) <= wal_limit:
+        return tuple(conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone())
+    # A truncating checkpoint holds off new writers while it waits on the busy timeout
+    timeout = conn.execute("PRAGMA busy_timeout").fetchone()[0]
+    conn.execute("PRAGMA busy_timeout = 0")
+    try:
+        return tuple(conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone())
+    finally:
+        conn.execute(f"PRAGMA busy_timeout = {timeout}")
+
+
+def incremental_vacuum(conn, pages: int = VACUUM_STEP_PAGES) -> int:
+    """Return up to pages free pages (0 = all of them) to the filesystem and return how many were released."""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return 0
+    before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    # executescript steps the pragma to completion; execute() stops after one page
+    conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+    return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def wal_size(conn) -> int:
+    db_file = database_file(conn)
+    if db_file is None:
+        return 0
+    try:
+        return os.path.getsize(f"{db_file}-wal")
+    except OSError:
+        return 0
+
+
+def database_stats(conn) -> dict:
+    """File size, free pages, WAL size and how much of the schema has planner statistics."""
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    analyzed = (conn.execute("SELECT COUNT(DISTINCT tbl), COUNT(*) FROM sqlite_stat1").fetchone()
+                if _has_statistics(conn) else (0, 0))
+    return {
+        "file_bytes": page_size * page_count,
+        "page_count": page_count,
+        "freelist_pages": conn.execute("PRAGMA freelist_count").fetchone()[0],
+        "wal_bytes": wal_size(conn),
+        "journal_mode": conn.execute("PRAGMA journal_mode").fetchone()[0],
+        "auto_vacuum": AUTO_VACUUM_MODES[conn.execute("PRAGMA auto_vacuum").fetchone()[0]],
+        "analyzed_tables": analyzed[0],
+        "stat_rows": analyzed[1],
+    }
+
+
+class Maintainer:
+    """Runs checkpoints, PRAGMA optimize and incremental vacuum on a schedule.
+
+    run_once() does whatever is due and returns; start() calls it from a
+    daemon thread. Each pass opens and closes its own connection, so a
+    process can call run_once() from its main loop and still fork safely
+    between passes (serve.py's arbiter does this).
+    """
+
+    def __init__(self, db_path: Path = DB_PATH, checkpoint_interval: float = CHECKPOINT_INTERVAL,
+                 optimize_interval: float = OPTIMIZE_INTERVAL):
+        self.db_path = db_path
+        self.checkpoint_interval = checkpoint_interval
+        self.optimize_interval = optimize_interval
+        self.next_checkpoint = 0.0
+        self.next_optimize = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self, now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        if now < self.next_checkpoint and now < self.next_optimize:
+            return
+        conn = get_connection(self.db_path)
+        try:
+            if now >= self.next_checkpoint:
+                checkpoint(conn)
+                self.next_checkpoint = now + self.checkpoint_interval
+            if now >= self.next_optimize:
+                optimize(conn)
+                incremental_vacuum(conn)
+                self.next_optimize = now + self.optimize_interval
+        finally:
+            conn.close()
+
+    def start(self) -> "Maintainer":
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="db-maintenance", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = None) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(min(self.checkpoint_interval, self.optimize_interval)):
+            try:
+                self.run_once()
+            except Exception:
+                # A busy database or a full disk only skips this pass
+                pass
+
+
+def background_checkpoints() -> None:
+    """Leave routine checkpoints to a Maintainer in this process and its children.
+
+    Connections opened afterwards raise wal_autocheckpoint to
+    db.BACKGROUND_AUTOCHECKPOINT, so only processes that also run a
+    Maintainer should call this.
+    """
+    os.environ[BACKGROUND_CHECKPOINT_ENV] = "1"
+
+
+def _print_stats(label: str, stats: dict) -> None:
+    print(f"{label:7} {stats['file_bytes'] / 1e6:9.1f} MB file, {stats['freelist_pages']:,} free pages, "
+          f"{stats['wal_bytes'] / 1e6:.1f} MB WAL, journal={stats['journal_mode']}, "
+          f"auto_vacuum={stats['auto_vacuum']}, statistics for {stats['analyzed_tables']} table(s) "
+          f"({stats['stat_rows']} statistics rows)")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run database maintenance and report what it changed.")
+    parser.add_argument("--db", default=str(DB_PATH), help=f"database (default {DB_PATH})")
+    parser.add_argument("--analyze", action="store_true", help="full ANALYZE instead of PRAGMA optimize")
+    parser.add_argument("--vacuum", action="store_true",
+                        help="switch to incremental auto-vacuum if needed (one full VACUUM), then free all unused pages")
+    parser.add_argument("--stats", action="store_true", help="only report, change nothing")
+    args = parser.parse_args(argv)
+    if not Path(args.db).exists():
+        print(f"{args.db} not found.", file=sys.stderr)
+        return 1
+
+    conn = get_connection(Path(args.db))
+    try:
+        _print_stats("before", database_stats(conn))
+        if args.stats:
+            return 0
+        start = time.perf_counter()
+        enable_wal(conn)
+        if args.analyze:
+            analyze(conn)
+        else:
+            optimize(conn)
+        if args.vacuum:
+            rebuilt = enable_incremental_vacuum(conn)
+            freed = incremental_vacuum(conn, pages=0)
+            print("Rebuilt the database for incremental vacuum." if rebuilt else f"Freed {freed:,} page(s).")
+        checkpoint(conn, wal_limit=0)
+        _print_stats("after", database_stats(conn))
+        print(f"Maintenance took {time.perf_counter() - start:.1f}s.")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,332 @@
+import threading
+from array import array
+from bisect import bisect_right
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from cache import data_versions, version_key
+from isbn import looks_like_isbn, resolve_isbn
+
+try:
+    import numpy as np
+except ImportError:  # optional: matches are found with bytes.find instead
+    np = None
+
+CATALOG_TABLES = ("BOOK", "AUTHORS", "BOOK_AUTHORS")
+LOAN_TABLES = ("BOOK_LOANS",)
+
+ISBN_WIDTH = 10
+
+
+def _extend_text(display: bytearray, lowered: bytearray, offsets: array, text: str) -> None:
+    encoded = (text or "").encode("utf-8")
+    display += encoded
+    # bytes.lower() folds ASCII only, exactly like SQLite's LOWER(), and keeps
+    # byte offsets identical between the display and search buffers.
+    lowered += encoded.lower()
+    offsets.append(len(display))
+
+
+class CatalogColumns:
+    """Column-oriented, read-only copy of BOOK, AUTHORS and BOOK_AUTHORS.
+
+    Rows are books in Isbn order. Text columns are single UTF-8 buffers with
+    an offsets array (item i is buffer[offsets[i]:offsets[i + 1]]), kept once
+    as stored and once lower-cased for matching. Book/author links are two
+    CSR structures over integer row and author positions, and title_rank /
+    by_title give the ORDER BY Title order without comparing strings.
+    """
+
+    def __init__(self):
+        self.isbns = bytearray()
+        self.title_display = bytearray()
+        self.title_text = bytearray()
+        self.title_offsets = array("q", [0])
+        self.title_rank = array("i")
+        self.by_title = array("i")
+
+        self.author_display = bytearray()
+        self.author_text = bytearray()
+        self.author_offsets = array("q", [0])
+
+        self.book_author_offsets = array("q", [0])
+        self.book_authors = array("i")
+        self.author_book_offsets = array("q", [0])
+        self.author_books = array("i")
+        self._byte_counts = {}
+
+    @classmethod
+    def from_connection(cls, conn) -> "CatalogColumns":
+        columns = cls()
+        for isbn, title, rank in conn.execute(
+            "SELECT Isbn, Title, ROW_NUMBER() OVER (ORDER BY Title, Isbn) - 1 FROM BOOK ORDER BY Isbn"
+        ):
+            columns.isbns += isbn.encode("ascii").ljust(ISBN_WIDTH)[:ISBN_WIDTH]
+            _extend_text(columns.title_display, columns.title_text, columns.title_offsets, title)
+            columns.title_rank.append(rank)
+
+        for (name,) in conn.execute("SELECT Name FROM AUTHORS ORDER BY Author_id"):
+            _extend_text(columns.author_display, columns.author_text, columns.author_offsets, name)
+
+        # Links arrive sorted by Isbn, the same order as the rows, so the row
+        # index advances in step and no Isbn -> row map is needed.
+        row = 0
+        count = len(columns)
+        for isbn, author in conn.execute(
+            """
+            SELECT ba.Isbn, a.Position
+            FROM BOOK_AUTHORS ba
+            JOIN (SELECT Author_id, ROW_NUMBER() OVER (ORDER BY Author_id) - 1 AS Position FROM AUTHORS) a
+              ON a.Author_id = ba.Author_id
+            ORDER BY ba.Isbn, ba.Author_id
+            """
+        ):
+            key = isbn.encode("ascii").ljust(ISBN_WIDTH)[:ISBN_WIDTH]
+            while row < count and columns.isbns[row * ISBN_WIDTH:(row + 1) * ISBN_WIDTH] < key:
+                row += 1
+                columns.book_author_offsets.append(len(columns.book_authors))
+            if row < count and columns.isbns[row * ISBN_WIDTH:(row + 1) * ISBN_WIDTH] == key:
+                columns.book_authors.append(author)
+        while len(columns.book_author_offsets) <= count:
+            columns.book_author_offsets.append(len(columns.book_authors))
+
+        columns._finish()
+        return columns
+
+    def _finish(self) -> None:
+        """Derive by_title and the author -> books CSR from the columns loaded so far."""
+        count = len(self)
+        self.by_title = array("i", bytes(4 * count))
+        for row, rank in enumerate(self.title_rank):
+            self.by_title[rank] = row
+
+        # Counting sort of the book -> author links by author
+        author_count = len(self.author_offsets) - 1
+        totals = array("q", bytes(8 * (author_count + 1)))
+        for author in self.book_authors:
+            totals[author + 1] += 1
+        for author in range(author_count):
+            totals[author + 1] += totals[author]
+        self.author_book_offsets = array("q", totals)
+        self.author_books = array("i", bytes(4 * len(self.book_authors)))
+        for row in range(count):
+            for link in range(self.book_author_offsets[row], self.book_author_offsets[row + 1]):
+                author = self.book_authors[link]
+                self.author_books[totals[author]] = row
+                totals[author] += 1
+
+    def __len__(self) -> int:
+        return len(self.title_rank)
+
+    def isbn_at(self, row: int) -> str:
+        return self.isbns[row * ISBN_WIDTH:(row + 1) * ISBN_WIDTH].decode("ascii").rstrip()
+
+    def row_of(self, isbn: str) -> Optional[int]:
+        """Binary search the fixed-width ISBN column."""
+        key = isbn.encode("ascii")
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self.isbns[middle * ISBN_WIDTH:(middle + 1) * ISBN_WIDTH].rstrip() < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self) and self.isbn_at(low) == isbn:
+            return low
+        return None
+
+    def title_at(self, row: int) -> str:
+        return self.title_display[self.title_offsets[row]:self.title_offsets[row + 1]].decode("utf-8")
+
+    def authors_at(self, row: int) -> str:
+        names = []
+        for link in range(self.book_author_offsets[row], self.book_author_offsets[row + 1]):
+            author = self.book_authors[link]
+            names.append(
+                self.author_display[self.author_offsets[author]:self.author_offsets[author + 1]].decode("utf-8")
+            )
+        return ", ".join(names)
+
+    def byte_counts(self, name: str):
+        """Occurrences of each byte value in a text buffer, used to anchor numpy scans on a rare byte."""
+        if name not in self._byte_counts:
+            self._byte_counts[name] = np.bincount(np.frombuffer(getattr(self, name), dtype=np.uint8), minlength=256)
+        return self._byte_counts[name]
+
+    def memory_bytes(self) -> int:
+        total = len(self.isbns) + len(self.title_display) + len(self.title_text)
+        total += len(self.author_display) + len(self.author_text)
+        for column in (
+            self.title_offsets, self.title_rank, self.by_title, self.author_offsets,
+            self.book_author_offsets, self.book_authors, self.author_book_offsets, self.author_books,
+        ):
+            total += column.itemsize * len(column)
+        return total
+
+
+def _find_items_numpy(buffer, offsets, term: bytes, counts):
+    """Vectorized substring scan returning the sorted indices of items that contain term.
+
+    Candidate start positions come from the term's rarest byte (by counts) and
+    are narrowed by comparing the remaining term bytes at fixed offsets.
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    bounds = np.frombuffer(offsets, dtype=np.int64)
+    width = len(term)
+    if width > len(data):
+        return np.empty(0, dtype=np.int64)
+    anchor = min(range(width), key=lambda index: counts[term[index]])
+    candidates = np.flatnonzero(data[anchor:len(data) - width + 1 + anchor] == term[anchor])
+    for index in range(width):
+        if index != anchor:
+            candidates = candidates[data[candidates + index] == term[index]]
+    items = np.searchsorted(bounds, candidates, side="right") - 1
+    # Drop matches that run from the end of one item into the next
+    items = items[candidates + width <= bounds[items + 1]]
+    # Positions are ascending, so repeated items are adjacent
+    return items[np.concatenate(([True], items[1:] != items[:-1]))] if len(items) else items
+
+
+def _find_items_python(buffer, offsets, term: bytes) -> List[int]:
+    items = []
+    position = buffer.find(term)
+    while position != -1:
+        item = bisect_right(offsets, position) - 1
+        end = offsets[item + 1]
+        if position + len(term) <= end:
+            items.append(item)
+            position = buffer.find(term, end)
+        else:
+            position = buffer.find(term, position + 1)
+    return items
+
+
+def _find_isbns(columns: CatalogColumns, term: bytes) -> List[int]:
+    # ISBNs are kept as stored (row_of looks them up exactly), so the check
+    # digit is usually an upper-case X; try both cases, as LOWER(Isbn) does
+    rows = []
+    for variant in {term.upper(), term.lower()}:
+        position = columns.isbns.find(variant)
+        while position != -1:
+            row, start = divmod(position, ISBN_WIDTH)
+            if start + len(variant) <= len(columns.isbn_at(row)):
+                rows.append(row)
+                position = columns.isbns.find(variant, (row + 1) * ISBN_WIDTH)
+            else:
+                position = columns.isbns.find(variant, position + 1)
+    return rows
+
+
+def matching_rows(columns: CatalogColumns, query: str) -> Sequence[int]:
+    """Rows whose ISBN, title or any author name contains query (case-insensitive), in title order.
+
+    Returns a numpy array when numpy is installed, otherwise a list.
+    """
+    term = query.lower().encode("utf-8")
+    if np is not None:
+        by_title = np.frombuffer(columns.by_title, dtype=np.int32)
+        if not term:
+            return by_title
+        matched = np.zeros(len(columns), dtype=bool)
+        matched[_find_items_numpy(columns.title_text, columns.title_offsets, term,
+                                  columns.byte_counts("title_text"))] = True
+        matched[_find_isbns(columns, term)] = True
+        link_bounds = np.frombuffer(columns.author_book_offsets, dtype=np.int64)
+        links = np.frombuffer(columns.author_books, dtype=np.int32)
+        for author in _find_items_numpy(columns.author_text, columns.author_offsets, term,
+                                        columns.byte_counts("author_text")):
+            matched[links[link_bounds[author]:link_bounds[author + 1]]] = True
+        # Reading the mask in title order yields the matches already sorted
+        return by_title[matched[by_title]]
+
+    if not term:
+        return list(columns.by_title)
+
+    rows = set(_find_items_python(columns.title_text, columns.title_offsets, term))
+    rows.update(_find_isbns(columns, term))
+    for author in _find_items_python(columns.author_text, columns.author_offsets, term):
+        rows.update(columns.author_books[columns.author_book_offsets[author]:columns.author_book_offsets[author + 1]])
+    return sorted(rows, key=columns.title_rank.__getitem__)
+
+
+_columns = None
+_columns_key = None
+_loans = None
+_loans_key = None
+_lock = threading.Lock()
+
+
+def get_columns(conn) -> CatalogColumns:
+    """Return the process-wide columnar catalog, reloading it after the catalog tables change.
+
+    A current snapshot written by load_data (see snapshot.py) is mapped
+    instead of rebuilding the columns from SQL.
+    """
+    from snapshot import load_current
+
+    global _columns, _columns_key
+    key = version_key(data_versions(conn), CATALOG_TABLES)
+    with _lock:
+        if _columns is None or _columns_key != key:
+            _columns = load_current(conn)
+            if _columns is None:
+                _columns = CatalogColumns.from_connection(conn)
+            _columns_key = key
+        return _columns
+
+
+def clear() -> None:
+    """Drop the cached columns and loans, e.g. before searching a different database file."""
+    global _columns, _columns_key, _loans, _loans_key
+    with _lock:
+        _columns = _columns_key = _loans = _loans_key = None
+
+
+def open_loans(conn) -> Dict[str, int]:
+    """Isbn -> Card_id of every open loan, reloaded only after BOOK_LOANS changes."""
+    global _loans, _loans_key
+    key = version_key(data_versions(conn), LOAN_TABLES)
+    with _lock:
+        if _loans is None or _loans_key != key:
+            _loans = {
+                row[0]: row[1]
+                for row in conn.execute("SELECT Isbn, Card_id FROM BOOK_LOANS WHERE Date_in IS NULL")
+            }
+            _loans_key = key
+        return _loans
+
+
+def search_page(conn, query: str, status_filter: str = "all", offset: int = 0,
+                limit: Optional[int] = None) -> Tuple[int, List[dict]]:
+    """Answer a catalog search from the in-memory columns. Same result shape as the SQLite backend."""
+    columns = get_columns(conn)
+    loans = open_loans(conn)
+
+    if query and looks_like_isbn(query):
+        isbn = resolve_isbn(conn, query)
+        row = columns.row_of(isbn) if isbn else None
+        rows = [row] if row is not None else []
+    else:
+        rows = matching_rows(columns, query or "")
+
+    if status_filter in ("available", "checked_out"):
+        want_out = status_filter == "checked_out"
+        open_rows = [row for row in map(columns.row_of, loans) if row is not None]
+        if np is not None and isinstance(rows, np.ndarray):
+            rows = rows[np.isin(rows, open_rows) == want_out]
+        else:
+            open_rows = set(open_rows)
+            rows = [row for row in rows if (row in open_rows) == want_out]
+
+    total = len(rows)
+    page = rows[offset:] if limit is None else rows[offset:offset + limit]
+    results = []
+    for row in map(int, page):
+        isbn = columns.isbn_at(row)
+        results.append({
+            "Isbn": isbn,
+            "Title": columns.title_at(row),
+            "Authors": columns.authors_at(row),
+            "Status": "OUT" if isbn in loans else "IN",
+            "Borrower_id": loans.get(isbn),
+        })
+    return total, results
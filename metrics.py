@@ -0,0 +1,392 @@
+import hmac
+import json
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import db
+from cache import fragment_cache
+
+# Under serve.py every process (workers, the writer, the arbiter) writes its
+# metrics to a file in this directory about once a second, and /metrics adds
+# up the files, so a scrape sees the whole server whichever worker answers it.
+METRICS_DIR_ENV = "LIBRARY_METRICS_DIR"
+FLUSH_INTERVAL = 1.0
+# /metrics answers only scrapes that send "Authorization: Bearer <token>"
+# with this token, and 404 for everything while it is unset. The client
+# address is no guide: behind a local reverse proxy every request comes
+# from 127.0.0.1.
+METRICS_TOKEN_ENV = "LIBRARY_METRICS_TOKEN"
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+JOB_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Statement types get their own label value; anything else counts as OTHER
+STATEMENT_TYPES = {
+    "SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH", "BEGIN", "COMMIT", "ROLLBACK",
+    "SAVEPOINT", "RELEASE", "PRAGMA", "CREATE", "DROP", "ALTER", "ATTACH", "DETACH", "ANALYZE", "VACUUM",
+}
+
+_registry: List["_Metric"] = []
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 collect: Optional[Callable[[], Dict[tuple, float]]] = None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # collect() reports values the metric does not record itself
+        self.collect = collect
+        self._values: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def samples(self) -> Dict[tuple, object]:
+        if self.collect is not None:
+            return self.collect()
+        with self._lock:
+            return {key: (list(value) if isinstance(value, list) else value) for key, value in self._values.items()}
+
+    def reset(self) -> None:
+        self._values = {}
+        self._lock = threading.Lock()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value read when metrics are collected. Per-process gauges are summed across processes."""
+
+    kind = "gauge"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = REQUEST_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            # Per-bucket counts, then sum and count; made cumulative when rendered
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, *labels: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+
+REQUESTS = Counter("library_http_requests_total", "HTTP requests by route, method and status.",
+                   ("route", "method", "status"))
+REQUEST_SECONDS = Histogram("library_http_request_duration_seconds",
+                            "Time to produce a response, by route (streamed bodies not included).", ("route",))
+SQL_SECONDS = Histogram("library_sql_statement_duration_seconds",
+                        "SQL statements by type; execute() time, so rows fetched later are not included.",
+                        ("type",), SQL_BUCKETS)
+WRITE_LOCK_SECONDS = Histogram("library_db_write_lock_wait_seconds",
+                               "Time BEGIN IMMEDIATE waited for the database write lock.", (), SQL_BUCKETS)
+BUSY_ERRORS = Counter("library_db_busy_errors_total",
+                      "Statements that gave up on a locked database after SQLite's busy retries.")
+FINE_REFRESH_SECONDS = Histogram("library_fine_refresh_duration_seconds",
+                                 "refresh_fines runs: every loan (all) or one checkin (loan).", ("scope",), JOB_BUCKETS)
+
+_in_progress = 0
+_in_progress_lock = threading.Lock()
+
+IN_PROGRESS = Gauge("library_http_requests_in_progress", "Requests being handled right now.",
+                    collect=lambda: {(): _in_progress})
+# Opened rather than open: request connections are left to the garbage
+# collector, which closes them without calling close(), so an open count
+# would only measure collection timing
+CONNECTIONS_OPENED = Counter("library_db_connections_opened_total", "Database connections opened.")
+CACHE_LOOKUPS = Counter("library_cache_lookups_total", "Rendered-fragment cache lookups by result.",
+                        ("cache", "result"),
+                        collect=lambda: {("fragments", "hit"): fragment_cache.hits,
+                                         ("fragments", "miss"): fragment_cache.misses})
+
+
+_statement_types: Dict[str, str] = {}
+
+
+def statement_type(sql: str) -> str:
+    # The app's SQL is mostly constant strings, so the answer is cached per string
+    kind = _statement_types.get(sql)
+    if kind is None:
+        words = sql.split(None, 1)
+        kind = words[0].upper() if words else ""
+        kind = kind if kind in STATEMENT_TYPES else "OTHER"
+        if len(_statement_types) < 2048:
+            _statement_types[sql] = kind
+    return kind
+
+
+def _timed(kind: str, start: float, sql: str = "") -> None:
+    elapsed = time.perf_counter() - start
+    SQL_SECONDS.observe(elapsed, kind)
+    if kind == "BEGIN" and "IMMEDIATE" in sql.upper():
+        # BEGIN IMMEDIATE is where writers wait out the busy timeout for the lock
+        WRITE_LOCK_SECONDS.observe(elapsed)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        except sqlite3.OperationalError as err:
+            if "locked" in str(err) or "busy" in str(err):
+                BUSY_ERRORS.inc()
+            raise
+        finally:
+            _timed(statement_type(sql), start, sql)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _timed(statement_type(sql), start)
+
+    def executescript(self, script):
+        start = time.perf_counter()
+        try:
+            return super().executescript(script)
+        finally:
+            _timed("OTHER", start)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3.Connection that times every statement and commit.
+
+    Connection.execute() does not go through cursor(), so both are overridden.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        CONNECTIONS_OPENED.inc()
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            _timed("COMMIT", start)
+
+
+def _snapshot() -> dict:
+    return {metric.name: [[list(labels), value] for labels, value in metric.samples().items()]
+            for metric in _registry}
+
+
+def flush() -> None:
+    """Write this process's metrics to the shared directory, if there is one."""
+    directory = os.environ.get(METRICS_DIR_ENV)
+    if not directory:
+        return
+    path = Path(directory) / f"{os.getpid()}.json"
+    partial = path.with_name(path.name + ".tmp")
+    partial.write_text(json.dumps(_snapshot()), encoding="utf-8")
+    os.replace(partial, path)
+
+
+def _flush_forever() -> None:
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            flush()
+        except OSError:
+            # The server is shutting down and removed the directory
+            return
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _gather() -> Dict[str, Dict[tuple, object]]:
+    """Every process's samples added together; gauges only from processes still running."""
+    directory = os.environ.get(METRICS_DIR_ENV)
+    if not directory:
+        return {metric.name: metric.samples() for metric in _registry}
+    flush()
+    kinds = {metric.name: metric.kind for metric in _registry}
+    merged: Dict[str, Dict[tuple, object]] = {name: {} for name in kinds}
+    for path in Path(directory).glob("*.json"):
+        try:
+            snapshot = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        alive = _alive(int(path.stem))
+        for name, samples in snapshot.items():
+            if name not in kinds or (kinds[name] == "gauge" and not alive):
+                continue
+            totals = merged[name]
+            for labels, value in samples:
+                key = tuple(labels)
+                if isinstance(value, list):
+                    current = totals.get(key)
+                    totals[key] = value if current is None else [a + b for a, b in zip(current, value)]
+                else:
+                    totals[key] = totals.get(key, 0) + value
+    return merged
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(names: Tuple[str, ...], values: tuple, extra: Tuple[str, str] = None) -> str:
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _database_lines() -> List[str]:
+    db_file = Path(db.DB_PATH)
+    sizes = []
+    for name, suffix, help in (("library_db_file_bytes", "", "Size of the database file."),
+                               ("library_db_wal_bytes", "-wal", "Size of the WAL file.")):
+        try:
+            size = os.path.getsize(f"{db_file}{suffix}")
+        except OSError:
+            size = 0
+        sizes += [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {size}"]
+    return sizes
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    merged = _gather()
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for labels, value in sorted(merged.get(metric.name, {}).items()):
+            if metric.kind != "histogram":
+                lines.append(f"{metric.name}{_label_text(metric.labels, labels)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + (float("inf"),), value):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{metric.name}_bucket{_label_text(metric.labels, labels, ('le', le))} {cumulative}")
+            lines.append(f"{metric.name}_sum{_label_text(metric.labels, labels)} {_number(value[-2])}")
+            lines.append(f"{metric.name}_count{_label_text(metric.labels, labels)} {value[-1]}")
+    lines.extend(_database_lines())
+    return "\n".join(lines) + "\n"
+
+
+_enabled = False
+
+
+def enable() -> None:
+    """Time this process's database statements and, under serve.py, start publishing its metrics."""
+    global _enabled
+    db.connection_factory = InstrumentedConnection
+    if not _enabled and os.environ.get(METRICS_DIR_ENV):
+        threading.Thread(target=_flush_forever, name="metrics-flush", daemon=True).start()
+    _enabled = True
+
+
+def _after_fork() -> None:
+    # A forked child starts counting from zero under its own pid; the parent's
+    # numbers stay in the parent's file. Threads do not survive fork, so the
+    # child starts its own flusher.
+    global _enabled, _in_progress, _in_progress_lock
+    for metric in _registry:
+        metric.reset()
+    _in_progress = 0
+    _in_progress_lock = threading.Lock()
+    if _enabled:
+        _enabled = False
+        enable()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def init_app(app) -> None:
+    # Flask is imported here so command-line tools can time statements without it
+    from flask import Response, abort, g, request
+
+    enable()
+
+    @app.before_request
+    def start_request_timer():
+        global _in_progress
+        with _in_progress_lock:
+            _in_progress += 1
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def observe_request(exc):
+        global _in_progress
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return
+        with _in_progress_lock:
+            _in_progress -= 1
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        status = g.pop("metrics_status", 500)
+        REQUESTS.inc(route, request.method, str(status))
+        REQUEST_SECONDS.observe(time.perf_counter() - start, route)
+
+    @app.route("/metrics")
+    def metrics():
+        token = os.environ.get(METRICS_TOKEN_ENV)
+        supplied = request.headers.get("Authorization", "")
+        if not token or not hmac.compare_digest(supplied.encode(), f"Bearer {token}".encode()):
+            abort(404)
+        return Response(render(), content_type="text/plain; version=0.0.4; charset=utf-8")
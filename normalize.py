@@ -1,7 +1,5 @@
-import pandas as pd
 import sys
 import re
-import numpy as np
 
 def normalize_author_names(name):
     if not isinstance(name, str):
@@ -16,6 +14,8 @@ def find_col_indx(header_list, possible_names):
     return None
 
 def normalize_Borrowers(inputFile="borrowers.csv", outputFile="normalized_borrowers.csv"):
+    # pandas takes longer to import than the app does to start; only the CSV conversions need it
+    import pandas as pd
     try:
         df = pd.read_csv(inputFile, dtype=str)
 
@@ -79,6 +79,7 @@ def normalize_Borrowers(inputFile="borrowers.csv", outputFile="normalized_borrow
     
 
 def normalize_Books(inputFile="books.csv", outputFile="normalized_books.csv"):
+    import pandas as pd
 
     try:
         df = pd.read_csv(inputFile, dtype= str, sep='\t')
@@ -92,10 +93,12 @@ def normalize_Books(inputFile="books.csv", outputFile="normalized_books.csv"):
                 raise ValueError("No ISBN column found in input file.")
                 return
 
-        df = df.rename(columns={isbn_col: 'Isbn', 'title': 'Title', 'author': 'Author'})
+        df = df.rename(columns={isbn_col: 'Isbn', 'ISBN13': 'Isbn13', 'isbn13': 'Isbn13',
+                                'title': 'Title', 'author': 'Author'})
 
         df['Title'] = df['Title'].str.title()
-        df_book = df[['Isbn', 'Title']].drop_duplicates(subset=['Isbn'])
+        book_cols = ['Isbn', 'Title', 'Isbn13'] if 'Isbn13' in df.columns else ['Isbn', 'Title']
+        df_book = df[book_cols].drop_duplicates(subset=['Isbn'])
         df_book.to_csv(outputFile, index=False)
         print(f"Normalized books data written to {outputFile}")
 
@@ -0,0 +1,230 @@
+import argparse
+import itertools
+import json
+import os
+import socket
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from email.header import Header
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import formatdate
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from db import day_number, get_connection
+from fines import DAILY_FINE
+
+NOTICE_DIR = Path("notices")
+TEMPLATE_DIR = Path("templates") / "notices"
+FORMATS = ("text", "html", "mail")
+CHECKPOINT_FILE = "checkpoint.json"
+
+# Overdue loans are read in keyset chunks like exports.py, and at most
+# MAX_PENDING_PER_WORKER notices per worker are queued for rendering, so
+# memory stays flat however many loans are overdue.
+NOTICE_BATCH_SIZE = 2000
+MAX_PENDING_PER_WORKER = 8
+DEFAULT_WORKERS = 4
+CHECKPOINT_EVERY = 500
+MAIL_FROM = "Books4U Library <circulation@localhost>"
+
+OVERDUE_SQL = """
+    SELECT bl.Card_id, bl.Loan_id, bl.Isbn, b.Title, bl.Date_out, bl.Due_date, bor.Bname, bor.Address,
+           :today - bl.Due_day AS Days_late,
+           ROUND((:today - bl.Due_day) * :daily_fine, 2) AS Fine_amt
+    FROM BOOK_LOANS bl
+    JOIN BOOK b ON b.Isbn = bl.Isbn
+    JOIN BORROWER bor ON bor.Card_id = bl.Card_id
+    WHERE bl.Date_in IS NULL
+      AND bl.Due_day < :today
+      AND (bl.Card_id, bl.Loan_id) > (:card_id, :loan_id)
+    ORDER BY bl.Card_id, bl.Loan_id
+    LIMIT :limit
+"""
+
+_environment = Environment(
+    loader=FileSystemLoader(str(TEMPLATE_DIR)),
+    autoescape=select_autoescape(["html"]),
+    trim_blocks=True,
+    lstrip_blocks=True,
+)
+
+
+def iter_overdue_loans(conn, today: date, after_card_id: int = -1,
+                       batch_size: int = NOTICE_BATCH_SIZE) -> Iterator[dict]:
+    """Yield overdue open loans in (Card_id, Loan_id) order, starting after a borrower.
+
+    The order matches idx_book_loans_open_card, so each chunk is an index
+    range scan that resumes where the previous one stopped.
+    """
+    params = {"today": day_number(today), "daily_fine": DAILY_FINE, "card_id": after_card_id,
+              "loan_id": sys.maxsize, "limit": batch_size}
+    while True:
+        chunk = conn.execute(OVERDUE_SQL, params).fetchall()
+        for row in chunk:
+            yield dict(row)
+        if len(chunk) < batch_size:
+            return
+        params["card_id"] = chunk[-1]["Card_id"]
+        params["loan_id"] = chunk[-1]["Loan_id"]
+
+
+def iter_notices(loans: Iterator[dict]) -> Iterator[dict]:
+    """Group consecutive loans by borrower; only one borrower's loans are held at a time."""
+    for card_id, group in itertools.groupby(loans, key=lambda loan: loan["Card_id"]):
+        group = list(group)
+        yield {
+            "Card_id": card_id,
+            "Bname": group[0]["Bname"],
+            "Address": group[0]["Address"],
+            "Loans": group,
+            "Total_fine": round(sum(loan["Fine_amt"] for loan in group), 2),
+        }
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    partial = path.with_name(path.name + ".tmp")
+    partial.write_bytes(data)
+    os.replace(partial, path)
+
+
+def render_notice(notice: dict, today: date, out_dir: Path, formats: List[str], sent: str = "") -> None:
+    """Write one borrower's notice in each requested format. Rewriting an existing notice is harmless."""
+    context = {"notice": notice, "today": today, "daily_fine": DAILY_FINE}
+    text = _environment.get_template("overdue.txt").render(context)
+    html = _environment.get_template("overdue.html").render(context) if "html" in formats or "mail" in formats else None
+    name = f"card_{notice['Card_id']}"
+
+    if "text" in formats:
+        _write_atomic(out_dir / "text" / f"{name}.txt", text.encode("utf-8"))
+    if "html" in formats:
+        _write_atomic(out_dir / "html" / f"{name}.html", html.encode("utf-8"))
+    if "mail" in formats:
+        # The compat32 MIME classes build a message several times faster than EmailMessage
+        message = MIMEMultipart("alternative")
+        message["From"] = MAIL_FROM
+        message["To"] = notice["Bname"] if notice["Bname"].isascii() else Header(notice["Bname"], "utf-8")
+        message["Subject"] = f"Overdue notice: {len(notice['Loans'])} item(s) past due"
+        message["Date"] = sent or formatdate(localtime=True)
+        message["X-Library-Card"] = str(notice["Card_id"])
+        message.attach(MIMEText(text, "plain", "utf-8"))
+        message.attach(MIMEText(html, "html", "utf-8"))
+        # Maildir delivery: write under tmp/, then rename into new/
+        unique = f"{today.isoformat()}.{name}.{socket.gethostname()}"
+        partial = out_dir / "mail" / "tmp" / unique
+        partial.write_bytes(message.as_bytes())
+        os.replace(partial, out_dir / "mail" / "new" / unique)
+
+
+def _prepare(out_dir: Path, formats: List[str]) -> None:
+    for fmt in formats:
+        if fmt == "mail":
+            for folder in ("tmp", "new", "cur"):
+                (out_dir / "mail" / folder).mkdir(parents=True, exist_ok=True)
+        else:
+            (out_dir / fmt).mkdir(parents=True, exist_ok=True)
+
+
+def read_checkpoint(out_dir: Path) -> Optional[dict]:
+    try:
+        return json.loads((out_dir / CHECKPOINT_FILE).read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+
+
+def _save_checkpoint(out_dir: Path, checkpoint: dict) -> None:
+    _write_atomic(out_dir / CHECKPOINT_FILE, json.dumps(checkpoint, indent=2).encode("utf-8"))
+
+
+def generate_notices(conn, today: Optional[date] = None, out_dir: Optional[Path] = None,
+                     formats: Optional[List[str]] = None, workers: int = DEFAULT_WORKERS,
+                     restart: bool = False) -> dict:
+    """Write overdue notices for every borrower with overdue loans on today's date.
+
+    Notices go to out_dir (default notices/<date>/). Rendering runs on a pool
+    of worker threads while the next borrowers are read. checkpoint.json
+    records the last borrower whose notice, and every notice before it, is
+    on disk; running again for the same date resumes after that borrower
+    unless restart is set. Returns the final checkpoint.
+    """
+    today = today or date.today()
+    formats = list(formats or ["text", "html"])
+    unknown = set(formats) - set(FORMATS)
+    if unknown:
+        raise ValueError(f"Unknown notice format(s): {', '.join(sorted(unknown))}")
+    out_dir = Path(out_dir) if out_dir else NOTICE_DIR / today.isoformat()
+    _prepare(out_dir, formats)
+
+    checkpoint = None if restart else read_checkpoint(out_dir)
+    if checkpoint is None or checkpoint["date"] != today.isoformat() or checkpoint["formats"] != formats:
+        checkpoint = {"date": today.isoformat(), "formats": formats, "last_card_id": -1,
+                      "notices": 0, "loans": 0, "complete": False}
+    if checkpoint["complete"]:
+        return checkpoint
+
+    sent = formatdate(localtime=True)
+    pending = deque()
+    since_saved = 0
+
+    def settle(block: bool) -> None:
+        # Notices finish out of order; the checkpoint only advances past a
+        # borrower once every earlier borrower's notice has been written too.
+        nonlocal since_saved
+        while pending and (block or pending[0][1].done()):
+            notice, future = pending.popleft()
+            future.result()
+            checkpoint["last_card_id"] = notice["Card_id"]
+            checkpoint["notices"] += 1
+            checkpoint["loans"] += len(notice["Loans"])
+            since_saved += 1
+        if since_saved >= CHECKPOINT_EVERY:
+            _save_checkpoint(out_dir, checkpoint)
+            since_saved = 0
+
+    try:
+        with ThreadPoolExecutor(workers, thread_name_prefix="notice") as pool:
+            loans = iter_overdue_loans(conn, today, checkpoint["last_card_id"])
+            for notice in iter_notices(loans):
+                pending.append((notice, pool.submit(render_notice, notice, today, out_dir, formats, sent)))
+                if len(pending) >= workers * MAX_PENDING_PER_WORKER:
+                    pending[0][1].result()
+                settle(block=False)
+            settle(block=True)
+        checkpoint["complete"] = True
+    finally:
+        # Also on failure, so the next run skips the borrowers already done
+        _save_checkpoint(out_dir, checkpoint)
+    return checkpoint
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Write overdue notices, one per borrower with overdue loans.")
+    parser.add_argument("--date", type=date.fromisoformat, default=None,
+                        help="notice date, YYYY-MM-DD (default today); loans due before it are overdue")
+    parser.add_argument("--output", "-o", help="directory for this run (default notices/<date>)")
+    parser.add_argument("--format", default="text,html",
+                        help=f"comma-separated, from {', '.join(FORMATS)} (mail = Maildir spool)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="rendering threads")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint and start over")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    with get_connection() as conn:
+        try:
+            result = generate_notices(conn, args.date, args.output, args.format.split(","), args.workers, args.restart)
+        except ValueError as err:
+            print(err, file=sys.stderr)
+            return 1
+    print(f"Wrote {result['notices']} notice(s) covering {result['loans']} overdue loan(s) "
+          f"in {time.perf_counter() - start:.1f}s.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
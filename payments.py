@@ -0,0 +1,215 @@
+import argparse
+import csv
+import sys
+from typing import IO, Iterator, Optional, Tuple
+
+from db import db_transaction, get_connection
+
+STAGE_BATCH_SIZE = 5000
+
+APPLIED = "applied"
+DUPLICATE = "duplicate"
+UNMATCHED = "unmatched"
+
+REPORT_COLUMNS = ["Line", "Loan_id", "Amount", "Reference", "Status", "Reason", "Fine_amt"]
+
+STAGING_TABLE = """
+CREATE TEMP TABLE IF NOT EXISTS PAYMENT_IMPORT (
+    Line INTEGER PRIMARY KEY,
+    Loan_id INTEGER,
+    Amount REAL,
+    Reference TEXT,
+    Status TEXT,
+    Reason TEXT
+)
+"""
+
+# Classification runs in rule order: the first rule that matches a still
+# unclassified row decides its status.
+CLASSIFY_RULES = [
+    (UNMATCHED, "malformed row", "Loan_id IS NULL OR Amount IS NULL"),
+    (
+        DUPLICATE,
+        "reference repeated in file",
+        """Reference IS NOT NULL AND EXISTS (
+               SELECT 1 FROM PAYMENT_IMPORT e
+               WHERE e.Reference = PAYMENT_IMPORT.Reference AND e.Line < PAYMENT_IMPORT.Line)""",
+    ),
+    (
+        UNMATCHED,
+        "no fine for loan",
+        "NOT EXISTS (SELECT 1 FROM FINES f WHERE f.Loan_id = PAYMENT_IMPORT.Loan_id)",
+    ),
+    (
+        DUPLICATE,
+        "fine already paid",
+        "EXISTS (SELECT 1 FROM FINES f WHERE f.Loan_id = PAYMENT_IMPORT.Loan_id AND f.Paid = 1)",
+    ),
+    (
+        UNMATCHED,
+        "book still checked out",
+        """EXISTS (SELECT 1 FROM BOOK_LOANS bl
+                   WHERE bl.Loan_id = PAYMENT_IMPORT.Loan_id AND bl.Date_in IS NULL)""",
+    ),
+    (
+        UNMATCHED,
+        "amount short of fine",
+        """EXISTS (SELECT 1 FROM FINES f
+                   WHERE f.Loan_id = PAYMENT_IMPORT.Loan_id
+                     AND ROUND(PAYMENT_IMPORT.Amount, 2) < ROUND(f.Fine_amt, 2))""",
+    ),
+    # Runs after every check on the row itself, so an earlier line for the
+    # same loan only counts if it passed them too (is still unclassified and
+    # about to be applied). A short first line does not turn the corrected
+    # second line into a duplicate.
+    (
+        DUPLICATE,
+        "loan repeated in file",
+        """EXISTS (
+               SELECT 1 FROM PAYMENT_IMPORT e
+               WHERE e.Loan_id = PAYMENT_IMPORT.Loan_id AND e.Line < PAYMENT_IMPORT.Line
+                 AND e.Status IS NULL)""",
+    ),
+    (APPLIED, None, "1 = 1"),
+]
+
+
+def _field(row: dict, *names: str) -> str:
+    for name in names:
+        for key, value in row.items():
+            if key and key.strip().lower() == name:
+                return (value or "").strip()
+    return ""
+
+
+def parse_settlement(handle: IO[str]) -> Iterator[Tuple[int, Optional[int], Optional[float], Optional[str]]]:
+    """Yield (line, loan_id, amount, reference) for each settlement row without reading the whole file.
+
+    Unparseable Loan_id or amount values are yielded as None so the row still
+    appears in the reconciliation report.
+    """
+    reader = csv.DictReader(handle)
+    for row in reader:
+        loan_text = _field(row, "loan_id", "loan id", "loan")
+        amount_text = _field(row, "amount", "amt", "paid_amount").replace("$", "").replace(",", "")
+        reference = _field(row, "reference", "ref", "transaction_id", "txn_id") or None
+
+        try:
+            loan_id = int(loan_text)
+        except ValueError:
+            loan_id = None
+        try:
+            amount = round(float(amount_text), 2)
+        except ValueError:
+            amount = None
+
+        yield reader.line_num, loan_id, amount, reference
+
+
+def _stage(conn, rows) -> None:
+    conn.execute(STAGING_TABLE)
+    conn.execute("DELETE FROM PAYMENT_IMPORT")
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= STAGE_BATCH_SIZE:
+            conn.executemany(
+                "INSERT INTO PAYMENT_IMPORT(Line, Loan_id, Amount, Reference) VALUES (?, ?, ?, ?)", batch
+            )
+            batch = []
+    if batch:
+        conn.executemany(
+            "INSERT INTO PAYMENT_IMPORT(Line, Loan_id, Amount, Reference) VALUES (?, ?, ?, ?)", batch
+        )
+    conn.execute("CREATE INDEX IF NOT EXISTS temp.idx_payment_import_loan ON PAYMENT_IMPORT(Loan_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS temp.idx_payment_import_ref ON PAYMENT_IMPORT(Reference)")
+    conn.commit()
+
+
+def import_payments(conn, handle: IO[str]) -> dict:
+    """Apply every payment in a settlement file in one transaction and return a summary.
+
+    The file is staged into a temp table, each row is classified as applied,
+    duplicate or unmatched with set-based updates joined against FINES, and all
+    applied fines are marked paid with a single UPDATE.
+    """
+    _stage(conn, parse_settlement(handle))
+
+    # Take the write lock before classifying so no fine changes between the
+    # checks and the UPDATE that applies them.
+    with db_transaction(conn, immediate=True):
+        for status, reason, condition in CLASSIFY_RULES:
+            conn.execute(
+                f"UPDATE PAYMENT_IMPORT SET Status = ?, Reason = ? WHERE Status IS NULL AND ({condition})",
+                (status, reason),
+            )
+        conn.execute(
+            """
+            UPDATE FINES
+            SET Paid = 1
+            WHERE Paid = 0
+              AND Loan_id IN (SELECT Loan_id FROM PAYMENT_IMPORT WHERE Status = ?)
+            """,
+            (APPLIED,),
+        )
+
+    return summarize(conn)
+
+
+def summarize(conn) -> dict:
+    summary = {APPLIED: 0, DUPLICATE: 0, UNMATCHED: 0, "applied_amount": 0.0, "total": 0}
+    for row in conn.execute(
+        "SELECT Status, COUNT(*) AS Count, COALESCE(SUM(Amount), 0) AS Amount FROM PAYMENT_IMPORT GROUP BY Status"
+    ):
+        summary[row["Status"]] = row["Count"]
+        summary["total"] += row["Count"]
+        if row["Status"] == APPLIED:
+            summary["applied_amount"] = round(row["Amount"], 2)
+    return summary
+
+
+def iter_report(conn, statuses: Optional[Tuple[str, ...]] = None) -> Iterator[dict]:
+    """Yield reconciliation rows from the most recent import, in file order."""
+    sql = """
+        SELECT p.Line, p.Loan_id, p.Amount, p.Reference, p.Status, p.Reason, f.Fine_amt
+        FROM PAYMENT_IMPORT p
+        LEFT JOIN FINES f ON f.Loan_id = p.Loan_id
+    """
+    params = []
+    if statuses:
+        sql += f" WHERE p.Status IN ({', '.join('?' for _ in statuses)})"
+        params.extend(statuses)
+    sql += " ORDER BY p.Line"
+    for row in conn.execute(sql, params):
+        yield dict(row)
+
+
+def write_report(conn, out: IO[str]) -> None:
+    writer = csv.DictWriter(out, fieldnames=REPORT_COLUMNS, lineterminator="\n")
+    writer.writeheader()
+    for row in iter_report(conn):
+        writer.writerow(row)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Apply a payment-processor settlement file to FINES.")
+    parser.add_argument("settlement", help="CSV with Loan_id, Amount and optional Reference columns")
+    parser.add_argument("--report", "-r", help="Write the reconciliation report CSV here")
+    args = parser.parse_args(argv)
+
+    with get_connection() as conn:
+        with open(args.settlement, newline="", encoding="utf-8-sig") as handle:
+            summary = import_payments(conn, handle)
+        if args.report:
+            with open(args.report, "w", newline="", encoding="utf-8") as out:
+                write_report(conn, out)
+
+    print(
+        f"{summary['total']} payments: {summary[APPLIED]} applied (${summary['applied_amount']:.2f}), "
+        f"{summary[DUPLICATE]} duplicate, {summary[UNMATCHED]} unmatched"
+    )
+    return 0 if summary[UNMATCHED] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
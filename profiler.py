@@ -0,0 +1,239 @@
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Callable, Dict, Optional
+
+# Wall-clock sampling: every interval a background thread reads the stacks of
+# the threads being profiled with sys._current_frames(). Nothing is hooked
+# into function calls, so the code being measured runs at full speed; the
+# cost is the sampler's own ~15 us per sampled thread (about 2.5% of a CPU
+# with eight busy request threads at the default interval).
+SAMPLE_INTERVAL = 0.005
+# A single request is short, so it is sampled more often
+REQUEST_SAMPLE_INTERVAL = 0.001
+# Longest profiling or memory window one request may ask for
+MAX_SECONDS = 300
+DEFAULT_SECONDS = 10
+# Memory differences listed, and frames recorded per allocation when grouping by traceback
+TOP_ALLOCATIONS = 25
+TRACEBACK_FRAMES = 10
+MEMORY_GROUPS = ("lineno", "traceback")
+
+# Thread ident -> (method, route) of each request this process is handling
+_requests: Dict[int, tuple] = {}
+# One profile or memory window at a time per process: sampling twice only adds overhead
+_busy = threading.Lock()
+_labels = {}
+
+
+def _frame_label(code) -> str:
+    label = _labels.get(code)
+    if label is None:
+        # co_qualname (Class.method) is Python 3.11+; the line number tells same-named functions apart
+        name = getattr(code, "co_qualname", code.co_name)
+        # ';' separates frames in the collapsed format
+        label = f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+        _labels[code] = label
+    return label
+
+
+def _stack(frame, root: str) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.append(root)
+    return ";".join(reversed(labels))
+
+
+class Sampler:
+    """Samples the stacks of the threads select() returns until stopped.
+
+    select() maps thread idents to the root frame their stacks are filed
+    under (the request's route, or the thread's name), so a flame graph
+    splits by endpoint first.
+    """
+
+    def __init__(self, select: Callable[[], Dict[int, str]], interval: float = SAMPLE_INTERVAL):
+        self.select = select
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> "Sampler":
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident, root in self.select().items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.stacks[_stack(frame, root)] += 1
+            self.samples += 1
+            del frames
+
+
+def collapsed(stacks: Counter) -> str:
+    """Stacks in the collapsed format flamegraph.pl, speedscope and inferno read: 'root;caller;callee count'."""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+
+def _request_threads(route: Optional[str], exclude: int) -> Callable[[], Dict[int, str]]:
+    def select():
+        return {ident: f"{method} {rule}" for ident, (method, rule) in list(_requests.items())
+                if ident != exclude and (route is None or rule == route)}
+    return select
+
+
+def _all_threads(exclude: int) -> Callable[[], Dict[int, str]]:
+    def select():
+        sampler = threading.get_ident()
+        return {thread.ident: thread.name for thread in threading.enumerate()
+                if thread.ident not in (exclude, sampler)}
+    return select
+
+
+def _claim() -> None:
+    if not _busy.acquire(blocking=False):
+        raise RuntimeError("A profile is already running in this process")
+
+
+def profile(seconds: float, route: Optional[str] = None, all_threads: bool = False,
+            interval: float = SAMPLE_INTERVAL) -> str:
+    """Sample this process for seconds and return the collapsed stacks.
+
+    By default only threads handling a request are sampled (those of one
+    route if route is given, e.g. '/search'), so idle worker threads do not
+    bury the flame graph; all_threads also samples background threads such
+    as the group-commit writer. The calling thread is left out.
+    """
+    _claim()
+    try:
+        caller = threading.get_ident()
+        select = _all_threads(caller) if all_threads else _request_threads(route, caller)
+        sampler = Sampler(select, interval).start()
+        time.sleep(seconds)
+        stacks = sampler.stop()
+    finally:
+        _busy.release()
+    header = (f"# pid {os.getpid()}: {sampler.samples} samples in {seconds:g}s every {interval * 1000:g} ms"
+              f"{f', route {route}' if route else ''}\n")
+    return header + collapsed(stacks)
+
+
+def memory_diff(seconds: float, group: str = "lineno", top: int = TOP_ALLOCATIONS) -> str:
+    """Trace allocations for seconds and report where memory still held at the end was allocated.
+
+    Blocks that were allocated and freed inside the window (a request's
+    temporary row dicts, say) do not show in the difference; the peak line
+    shows how high they pushed the total. Tracing slows allocation-heavy
+    code while it runs. If tracemalloc was already on (PYTHONTRACEMALLOC)
+    it is left on.
+    """
+    if group not in MEMORY_GROUPS:
+        raise ValueError(f"Unknown grouping '{group}'")
+    _claim()
+    try:
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start(TRACEBACK_FRAMES if group == "traceback" else 1)
+        try:
+            before = _snapshot()
+            if hasattr(tracemalloc, "reset_peak"):  # Python 3.9+
+                tracemalloc.reset_peak()
+            time.sleep(seconds)
+            after = _snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            if not was_tracing:
+                tracemalloc.stop()
+    finally:
+        _busy.release()
+
+    stats = [stat for stat in after.compare_to(before, group) if stat.size_diff or stat.count_diff]
+    grown = sum(stat.size_diff for stat in stats)
+    lines = [f"# pid {os.getpid()}: {seconds:g}s, {_megabytes(grown)} net change, "
+             f"{current / 1e6:.3f} MB traced at the end, peak {peak / 1e6:.3f} MB"]
+    for stat in stats[:top]:
+        frames = stat.traceback.format(most_recent_first=True)
+        lines.append(f"{_megabytes(stat.size_diff):>12} {stat.count_diff:+9} blocks  "
+                     f"{frames[0].strip() if group == 'lineno' else ''}".rstrip())
+        if group == "traceback":
+            lines.extend(f"    {line}" for line in frames)
+    return "\n".join(lines) + "\n"
+
+
+def _snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+
+
+def _megabytes(size: int) -> str:
+    return f"{size / 1e6:+.3f} MB"
+
+
+def seconds_arg(value: Optional[str]) -> float:
+    """Parse a ?seconds= argument, bounded by MAX_SECONDS."""
+    try:
+        seconds = float(value) if value else DEFAULT_SECONDS
+    except ValueError:
+        raise ValueError(f"Invalid seconds: {value!r}")
+    if not 0 < seconds <= MAX_SECONDS:
+        raise ValueError(f"seconds must be between 0 and {MAX_SECONDS}")
+    return seconds
+
+
+def init_app(app, allowed: Callable[[], bool]) -> None:
+    """Track which thread serves which route, and profile single requests on demand.
+
+    Adding profile=1 to any URL, when allowed() says the session may
+    profile, returns the request's collapsed stacks instead of its page.
+    """
+    from flask import Response, g, request
+
+    @app.before_request
+    def track_request():
+        ident = threading.get_ident()
+        rule = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        _requests[ident] = (request.method, rule)
+        if request.args.get("profile") and allowed():
+            root = f"{request.method} {rule}"
+            g.profile_sampler = Sampler(lambda: {ident: root}, REQUEST_SAMPLE_INTERVAL).start()
+            g.profile_start = time.perf_counter()
+
+    @app.after_request
+    def return_profile(response):
+        sampler = g.pop("profile_sampler", None)
+        if sampler is None:
+            return response
+        stacks = sampler.stop()
+        elapsed = time.perf_counter() - g.pop("profile_start")
+        response.close()
+        header = (f"# pid {os.getpid()}: {request.method} {request.full_path} answered {response.status_code} "
+                  f"in {elapsed * 1000:.1f} ms, {sampler.samples} samples every {sampler.interval * 1000:g} ms\n")
+        profile_response = Response(header + collapsed(stacks), mimetype="text/plain")
+        profile_response.headers["Content-Disposition"] = "attachment; filename=request.folded"
+        return profile_response
+
+    @app.teardown_request
+    def untrack_request(exc):
+        _requests.pop(threading.get_ident(), None)
+        sampler = g.pop("profile_sampler", None)
+        if sampler is not None:
+            sampler.stop()
@@ -0,0 +1,115 @@
+from datetime import date, timedelta
+from typing import Optional
+
+from archive import attach_history
+from db import db_transaction
+
+ROLLUP_TABLES = ("DAILY_CIRCULATION", "BOOK_CIRCULATION", "OPEN_LOANS_BY_DUE", "BORROWER_FINES", "CIRCULATION_TOTALS")
+
+DASHBOARD_DAYS = 30
+TOP_TITLES = 10
+
+
+def rebuild_rollups(conn) -> None:
+    """Recompute every rollup table from BOOK_LOANS and FINES.
+
+    The schema triggers keep the rollups current on every write; this is for
+    databases created before the rollups existed or loaded with the triggers
+    turned off. Loan history is read through the history views, so loans
+    moved to the archive are still counted. Fines paid before the rollups
+    existed have no payment date, so they count towards PAID_FINES but not
+    towards any day.
+    """
+    attach_history(conn)
+    with db_transaction(conn, immediate=True):
+        for table in ROLLUP_TABLES:
+            conn.execute(f"DELETE FROM {table}")
+        conn.execute(
+            """
+            INSERT INTO DAILY_CIRCULATION (Day, Checkouts, Checkins)
+            SELECT Day, SUM(Checkouts), SUM(Checkins)
+            FROM (
+                SELECT Date_out AS Day, 1 AS Checkouts, 0 AS Checkins FROM LOAN_HISTORY
+                UNION ALL
+                SELECT Date_in, 0, 1 FROM LOAN_HISTORY WHERE Date_in IS NOT NULL
+            )
+            GROUP BY Day
+            """
+        )
+        conn.execute("INSERT INTO BOOK_CIRCULATION (Isbn, Checkouts) SELECT Isbn, COUNT(*) FROM LOAN_HISTORY GROUP BY Isbn")
+        conn.execute(
+            """
+            INSERT INTO OPEN_LOANS_BY_DUE (Due_date, Loans)
+            SELECT Due_date, COUNT(*) FROM BOOK_LOANS WHERE Date_in IS NULL GROUP BY Due_date
+            """
+        )
+        conn.execute(
+            """
+            INSERT INTO BORROWER_FINES (Card_id, Unpaid_amt, Unpaid_count)
+            SELECT bl.Card_id, SUM(f.Fine_amt), COUNT(*)
+            FROM FINES f
+            JOIN BOOK_LOANS bl ON f.Loan_id = bl.Loan_id
+            WHERE f.Paid = 0
+            GROUP BY bl.Card_id
+            """
+        )
+        conn.execute(
+            """
+            INSERT INTO CIRCULATION_TOTALS (Name, Value)
+            SELECT 'OPEN_LOANS', COUNT(*) FROM BOOK_LOANS WHERE Date_in IS NULL
+            UNION ALL SELECT 'UNPAID_FINES', COALESCE(SUM(Fine_amt), 0) FROM FINES WHERE Paid = 0
+            UNION ALL SELECT 'UNPAID_FINE_COUNT', COUNT(*) FROM FINES WHERE Paid = 0
+            UNION ALL SELECT 'PAID_FINES', COALESCE(SUM(Fine_amt), 0) FROM FINE_HISTORY WHERE Paid = 1
+            """
+        )
+
+
+def ensure_rollups(conn) -> None:
+    """Build the rollups for a database created before they existed."""
+    if conn.execute("SELECT 1 FROM CIRCULATION_TOTALS LIMIT 1").fetchone() is None:
+        rebuild_rollups(conn)
+
+
+def dashboard(conn, today: Optional[date] = None, days: int = DASHBOARD_DAYS, top: int = TOP_TITLES) -> dict:
+    """Circulation summary for the admin dashboard, read entirely from the rollup tables."""
+    today = today or date.today()
+    first_day = today - timedelta(days=days - 1)
+    totals = {row["Name"]: row["Value"] for row in conn.execute("SELECT Name, Value FROM CIRCULATION_TOTALS")}
+
+    by_day = {
+        row["Day"]: dict(row)
+        for row in conn.execute(
+            "SELECT Day, Checkouts, Checkins, Fines_paid FROM DAILY_CIRCULATION WHERE Day BETWEEN ? AND ?",
+            (first_day.isoformat(), today.isoformat()),
+        )
+    }
+    daily = []
+    for offset in range(days):
+        day = (first_day + timedelta(days=offset)).isoformat()
+        daily.append(by_day.get(day, {"Day": day, "Checkouts": 0, "Checkins": 0, "Fines_paid": 0}))
+
+    top_titles = conn.execute(
+        """
+        SELECT bc.Isbn, b.Title, bc.Checkouts
+        FROM BOOK_CIRCULATION bc
+        JOIN BOOK b ON b.Isbn = bc.Isbn
+        ORDER BY bc.Checkouts DESC
+        LIMIT ?
+        """,
+        (top,),
+    ).fetchall()
+    overdue = conn.execute(
+        "SELECT COALESCE(SUM(Loans), 0) FROM OPEN_LOANS_BY_DUE WHERE Due_date < ?",
+        (today.isoformat(),),
+    ).fetchone()[0]
+
+    return {
+        "today": daily[-1],
+        "daily": daily,
+        "top_titles": [dict(row) for row in top_titles],
+        "open_loans": int(totals.get("OPEN_LOANS", 0)),
+        "overdue_loans": overdue,
+        "unpaid_fines": round(totals.get("UNPAID_FINES", 0), 2),
+        "unpaid_fine_count": int(totals.get("UNPAID_FINE_COUNT", 0)),
+        "paid_fines": round(totals.get("PAID_FINES", 0), 2),
+    }
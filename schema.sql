@@ -1,8 +1,11 @@
 CREATE TABLE IF NOT EXISTS BOOK (
     Isbn CHAR(10) PRIMARY KEY,
-    Title VARCHAR(255) NOT NULL
+    Title VARCHAR(255) NOT NULL,
+    Isbn13 CHAR(13)
 );
 
+CREATE INDEX IF NOT EXISTS idx_book_isbn13 ON BOOK (Isbn13);
+
 CREATE TABLE IF NOT EXISTS AUTHORS (
     Author_id INTEGER PRIMARY KEY,
     Name VARCHAR(255) NOT NULL
@@ -31,10 +34,25 @@ CREATE TABLE IF NOT EXISTS BOOK_LOANS (
     Date_out DATE NOT NULL,
     Due_date DATE NOT NULL,
     Date_in DATE,
+    -- Day numbers (days since 1970-01-01) for fine and overdue arithmetic.
+    -- Computed from the dates on read, so nothing has to keep them in step.
+    Due_day INTEGER GENERATED ALWAYS AS (CAST(julianday(Due_date) - 2440587.5 AS INTEGER)) VIRTUAL,
+    In_day INTEGER GENERATED ALWAYS AS (CAST(julianday(Date_in) - 2440587.5 AS INTEGER)) VIRTUAL,
     FOREIGN KEY (Isbn) REFERENCES BOOK (Isbn),
     FOREIGN KEY (Card_id) REFERENCES BORROWER (Card_id)
 );
 
+-- Availability checks ("is this ISBN checked out?") only look at open loans
+CREATE INDEX IF NOT EXISTS idx_book_loans_open_isbn ON BOOK_LOANS (Isbn) WHERE Date_in IS NULL;
+
+-- Overdue notices walk open loans borrower by borrower (Card_id, then Loan_id as the rowid)
+CREATE INDEX IF NOT EXISTS idx_book_loans_open_card ON BOOK_LOANS (Card_id) WHERE Date_in IS NULL;
+
+-- Fine refreshes only visit loans that can owe a fine: open loans past their
+-- due day, and loans returned late
+CREATE INDEX IF NOT EXISTS idx_book_loans_open_due ON BOOK_LOANS (Due_day) WHERE Date_in IS NULL;
+CREATE INDEX IF NOT EXISTS idx_book_loans_late ON BOOK_LOANS (Due_day) WHERE In_day > Due_day;
+
 CREATE TABLE IF NOT EXISTS FINES (
     Loan_id INTEGER PRIMARY KEY,
     Fine_amt DECIMAL(7, 2) NOT NULL,
@@ -50,4 +68,265 @@ CREATE TABLE IF NOT EXISTS USERS (
     Is_admin INTEGER NOT NULL DEFAULT 0 CHECK (Is_admin IN (0, 1)),
     Created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (Card_id) REFERENCES BORROWER (Card_id)
-);
\ No newline at end of file
+);
+
+CREATE TABLE IF NOT EXISTS DATA_VERSION (
+    Name VARCHAR(50) PRIMARY KEY,
+    Version INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO DATA_VERSION (Name, Version) VALUES
+    ('BOOK', 0), ('AUTHORS', 0), ('BOOK_AUTHORS', 0),
+    ('BORROWER', 0), ('BOOK_LOANS', 0), ('FINES', 0);
+
+-- Every write to a cached table bumps its DATA_VERSION row so rendered
+-- fragments keyed on the version go stale across all processes.
+CREATE TRIGGER IF NOT EXISTS trg_book_version_ins AFTER INSERT ON BOOK
+BEGIN UPDATE DATA_VERSION SET Version = Version + 1 WHERE Name = 'BOOK'; END;
+CREATE TRIGGER IF NOT EXISTS trg_book_version_upd AFTER UPDATE ON BOOK
+BEGIN UPDATE DATA_VERSION SET Version = Version + 1 WHERE Name = 'BOOK'; END;
+CREATE TRIGGER IF NOT EXISTS trg_book_version_del AFTER DELETE ON BOOK
+BEGIN UPDATE DATA_VERSION SET Version = Version + 1 WHERE Name = 'BOOK'; END;
+
+CREATE TRIGGER IF NOT EXISTS trg_authors_version_ins AFTER INSERT ON AUTHORS
+BEGIN UPDATE DATA_VERSION SET Version = Version + 1 WHERE Name = 'AUTHORS'; END;
+CREATE TRIGGER IF NOT EXISTS trg_authors_version_upd AFTER UPDATE ON AUTHORS
+BEGIN UPDATE DATA_VERSION SET Version = Version + 1 WHERE Name = 'AUTHORS'; END;
+CREATE TRIGGER IF NOT EXISTS trg_authors_version_del AFTER DELETE ON AUTHORS
+BEGIN UPDATE DATA_VERSION SET Version = Version + 1 WHERE Name = 'AUTHORS'; END;
+
+CREATE TRIGGER IF NOT EXISTS trg_book_authors_version_ins AFTER INSERT ON BOOK_AUTHORS
+BEGIN UPDATE DATA_VERSION SET Version = Version + 1 WHERE Name = 'BOOK_AUTHORS'; END;
+CREATE TRIGGER IF NOT EXISTS trg_book_authors_version_upd AFTER UPDATE ON BOOK_AUTHORS
+BEGIN UPDATE DATA_VERSION SET Version = Version + 1 WHERE Name = 'BOOK_AUTHORS'; END;
+CREATE TRIGGER IF NOT EXISTS trg_book_authors_version_del AFTER DELETE ON BOOK_AUTHORS
+BEGIN UPDATE DATA_VERSION SET Version = Version + 1 WHERE Name = 'BOOK_AUTHORS'; END;
+
+CREATE TRIGGER IF NOT EXISTS trg_borrower_version_ins AFTER INSERT ON BORROWER
+BEGIN UPDATE DATA_VERSION SET Version = Version + 1 WHERE Name = 'BORROWER'; END;
+CREATE TRIGGER IF NOT EXISTS trg_borrower_version_upd AFTER UPDATE ON BORROWER
+BEGIN UPDATE DATA_VERSION SET Version = Version + 1 WHERE Name = 'BORROWER'; END;
+CREATE TRIGGER IF NOT EXISTS trg_borrower_version_del AFTER DELETE ON BORROWER
+BEGIN UPDATE DATA_VERSION SET Version = Version + 1 WHERE Name = 'BORROWER'; END;
+
+CREATE TRIGGER IF NOT EXISTS trg_book_loans_version_ins AFTER INSERT ON BOOK_LOANS
+BEGIN UPDATE DATA_VERSION SET Version = Version + 1 WHERE Name = 'BOOK_LOANS'; END;
+CREATE TRIGGER IF NOT EXISTS trg_book_loans_version_upd AFTER UPDATE ON BOOK_LOANS
+BEGIN UPDATE DATA_VERSION SET Version = Version + 1 WHERE Name = 'BOOK_LOANS'; END;
+CREATE TRIGGER IF NOT EXISTS trg_book_loans_version_del AFTER DELETE ON BOOK_LOANS
+BEGIN UPDATE DATA_VERSION SET Version = Version + 1 WHERE Name = 'BOOK_LOANS'; END;
+
+CREATE TRIGGER IF NOT EXISTS trg_fines_version_ins AFTER INSERT ON FINES
+BEGIN UPDATE DATA_VERSION SET Version = Version + 1 WHERE Name = 'FINES'; END;
+CREATE TRIGGER IF NOT EXISTS trg_fines_version_upd AFTER UPDATE ON FINES
+BEGIN UPDATE DATA_VERSION SET Version = Version + 1 WHERE Name = 'FINES'; END;
+CREATE TRIGGER IF NOT EXISTS trg_fines_version_del AFTER DELETE ON FINES
+BEGIN UPDATE DATA_VERSION SET Version = Version + 1 WHERE Name = 'FINES'; END;
+
+-- Trigram index for borrower lookup by any substring of name, phone digits
+-- or SSN last four. The rowid is the borrower's Card_id.
+CREATE VIRTUAL TABLE IF NOT EXISTS BORROWER_LOOKUP USING fts5(
+    Bname,
+    Phone_digits,
+    Ssn_last4,
+    tokenize = 'trigram'
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_borrower_lookup_ins AFTER INSERT ON BORROWER
+BEGIN
+    INSERT INTO BORROWER_LOOKUP (rowid, Bname, Phone_digits, Ssn_last4)
+    VALUES (
+        NEW.Card_id,
+        NEW.Bname,
+        REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(COALESCE(NEW.Phone, ''), '(', ''), ')', ''), '-', ''), ' ', ''), '.', ''), '+', ''),
+        substr(REPLACE(NEW.Ssn, '-', ''), -4)
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_borrower_lookup_upd AFTER UPDATE ON BORROWER
+BEGIN
+    DELETE FROM BORROWER_LOOKUP WHERE rowid = OLD.Card_id;
+    INSERT INTO BORROWER_LOOKUP (rowid, Bname, Phone_digits, Ssn_last4)
+    VALUES (
+        NEW.Card_id,
+        NEW.Bname,
+        REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(COALESCE(NEW.Phone, ''), '(', ''), ')', ''), '-', ''), ' ', ''), '.', ''), '+', ''),
+        substr(REPLACE(NEW.Ssn, '-', ''), -4)
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_borrower_lookup_del AFTER DELETE ON BORROWER
+BEGIN
+    DELETE FROM BORROWER_LOOKUP WHERE rowid = OLD.Card_id;
+END;
+
+-- Backfill databases created before the lookup index existed.
+INSERT INTO BORROWER_LOOKUP (rowid, Bname, Phone_digits, Ssn_last4)
+SELECT
+    Card_id,
+    Bname,
+    REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(COALESCE(Phone, ''), '(', ''), ')', ''), '-', ''), ' ', ''), '.', ''), '+', ''),
+    substr(REPLACE(Ssn, '-', ''), -4)
+FROM BORROWER
+WHERE NOT EXISTS (SELECT 1 FROM BORROWER_LOOKUP);
+
+-- Card_id allocator. reserve_card_ids advances Next_id with one UPDATE, which
+-- takes the write lock, so concurrent registrations never share an ID and a
+-- bulk import can reserve a whole block at once.
+CREATE TABLE IF NOT EXISTS CARD_SEQUENCE (
+    Name VARCHAR(50) PRIMARY KEY,
+    Next_id INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO CARD_SEQUENCE (Name, Next_id) VALUES ('BORROWER', 1);
+
+-- Card_ids inserted explicitly (load_data, older databases) move the sequence past them.
+CREATE TRIGGER IF NOT EXISTS trg_borrower_card_sequence AFTER INSERT ON BORROWER
+WHEN NEW.Card_id >= (SELECT Next_id FROM CARD_SEQUENCE WHERE Name = 'BORROWER')
+BEGIN
+    UPDATE CARD_SEQUENCE SET Next_id = NEW.Card_id + 1 WHERE Name = 'BORROWER';
+END;
+
+UPDATE CARD_SEQUENCE
+SET Next_id = (SELECT MAX(Card_id) + 1 FROM BORROWER)
+WHERE Name = 'BORROWER'
+  AND Next_id <= (SELECT COALESCE(MAX(Card_id), 0) FROM BORROWER);
+
+-- Title and author-name words with their catalog frequency. Rebuilt by
+-- load_data; spelling.py loads it into an in-process index for "did you mean".
+CREATE TABLE IF NOT EXISTS SEARCH_VOCAB (
+    Word VARCHAR(100) PRIMARY KEY,
+    Freq INTEGER NOT NULL
+);
+
+-- Circulation rollups, kept current by the triggers below so the admin
+-- dashboard and the fines page read a few rows instead of aggregating the
+-- whole loan and fine history. rollups.rebuild_rollups recomputes them.
+CREATE TABLE IF NOT EXISTS DAILY_CIRCULATION (
+    Day DATE PRIMARY KEY,
+    Checkouts INTEGER NOT NULL DEFAULT 0,
+    Checkins INTEGER NOT NULL DEFAULT 0,
+    Fines_paid DECIMAL(9, 2) NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS BOOK_CIRCULATION (
+    Isbn CHAR(10) PRIMARY KEY,
+    Checkouts INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS idx_book_circulation_checkouts ON BOOK_CIRCULATION (Checkouts DESC);
+
+-- Open loans per due date: the overdue count is a sum over the due dates
+-- before today, however long the loan history is.
+CREATE TABLE IF NOT EXISTS OPEN_LOANS_BY_DUE (
+    Due_date DATE PRIMARY KEY,
+    Loans INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS BORROWER_FINES (
+    Card_id INTEGER PRIMARY KEY,
+    Unpaid_amt DECIMAL(9, 2) NOT NULL DEFAULT 0,
+    Unpaid_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS CIRCULATION_TOTALS (
+    Name VARCHAR(50) PRIMARY KEY,
+    Value DECIMAL(12, 2) NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_book_loans_rollup_ins AFTER INSERT ON BOOK_LOANS
+BEGIN
+    INSERT INTO DAILY_CIRCULATION (Day, Checkouts) VALUES (NEW.Date_out, 1)
+    ON CONFLICT (Day) DO UPDATE SET Checkouts = Checkouts + 1;
+    INSERT INTO BOOK_CIRCULATION (Isbn, Checkouts) VALUES (NEW.Isbn, 1)
+    ON CONFLICT (Isbn) DO UPDATE SET Checkouts = Checkouts + 1;
+    INSERT INTO DAILY_CIRCULATION (Day, Checkins)
+    SELECT NEW.Date_in, 1 WHERE NEW.Date_in IS NOT NULL
+    ON CONFLICT (Day) DO UPDATE SET Checkins = Checkins + 1;
+    INSERT INTO OPEN_LOANS_BY_DUE (Due_date, Loans)
+    SELECT NEW.Due_date, 1 WHERE NEW.Date_in IS NULL
+    ON CONFLICT (Due_date) DO UPDATE SET Loans = Loans + 1;
+    UPDATE CIRCULATION_TOTALS SET Value = Value + 1 WHERE Name = 'OPEN_LOANS' AND NEW.Date_in IS NULL;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_book_loans_rollup_upd AFTER UPDATE OF Date_out, Due_date, Date_in ON BOOK_LOANS
+BEGIN
+    UPDATE DAILY_CIRCULATION SET Checkouts = Checkouts - 1
+    WHERE Day = OLD.Date_out AND OLD.Date_out IS NOT NEW.Date_out;
+    INSERT INTO DAILY_CIRCULATION (Day, Checkouts)
+    SELECT NEW.Date_out, 1 WHERE OLD.Date_out IS NOT NEW.Date_out
+    ON CONFLICT (Day) DO UPDATE SET Checkouts = Checkouts + 1;
+    UPDATE DAILY_CIRCULATION SET Checkins = Checkins - 1
+    WHERE Day = OLD.Date_in AND OLD.Date_in IS NOT NEW.Date_in;
+    INSERT INTO DAILY_CIRCULATION (Day, Checkins)
+    SELECT NEW.Date_in, 1 WHERE NEW.Date_in IS NOT NULL AND OLD.Date_in IS NOT NEW.Date_in
+    ON CONFLICT (Day) DO UPDATE SET Checkins = Checkins + 1;
+    UPDATE OPEN_LOANS_BY_DUE SET Loans = Loans - 1 WHERE Due_date = OLD.Due_date AND OLD.Date_in IS NULL;
+    DELETE FROM OPEN_LOANS_BY_DUE WHERE Due_date = OLD.Due_date AND Loans = 0;
+    INSERT INTO OPEN_LOANS_BY_DUE (Due_date, Loans)
+    SELECT NEW.Due_date, 1 WHERE NEW.Date_in IS NULL
+    ON CONFLICT (Due_date) DO UPDATE SET Loans = Loans + 1;
+    UPDATE CIRCULATION_TOTALS
+    SET Value = Value + (NEW.Date_in IS NULL) - (OLD.Date_in IS NULL)
+    WHERE Name = 'OPEN_LOANS';
+END;
+
+-- Deleting a loan (e.g. archiving it) only changes what is open now; the
+-- daily and per-title counters keep counting it as history.
+CREATE TRIGGER IF NOT EXISTS trg_book_loans_rollup_del AFTER DELETE ON BOOK_LOANS
+WHEN OLD.Date_in IS NULL
+BEGIN
+    UPDATE OPEN_LOANS_BY_DUE SET Loans = Loans - 1 WHERE Due_date = OLD.Due_date;
+    DELETE FROM OPEN_LOANS_BY_DUE WHERE Due_date = OLD.Due_date AND Loans = 0;
+    UPDATE CIRCULATION_TOTALS SET Value = Value - 1 WHERE Name = 'OPEN_LOANS';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_fines_rollup_ins AFTER INSERT ON FINES
+BEGIN
+    INSERT INTO BORROWER_FINES (Card_id, Unpaid_amt, Unpaid_count)
+    SELECT Card_id, NEW.Fine_amt, 1 FROM BOOK_LOANS WHERE Loan_id = NEW.Loan_id AND NEW.Paid = 0
+    ON CONFLICT (Card_id) DO UPDATE SET
+        Unpaid_amt = Unpaid_amt + excluded.Unpaid_amt,
+        Unpaid_count = Unpaid_count + 1;
+    UPDATE CIRCULATION_TOTALS
+    SET Value = Value + CASE Name
+        WHEN 'UNPAID_FINES' THEN NEW.Fine_amt * (NEW.Paid = 0)
+        WHEN 'UNPAID_FINE_COUNT' THEN (NEW.Paid = 0)
+        ELSE NEW.Fine_amt * (NEW.Paid = 1)
+    END
+    WHERE Name IN ('UNPAID_FINES', 'UNPAID_FINE_COUNT', 'PAID_FINES');
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_fines_rollup_upd AFTER UPDATE OF Fine_amt, Paid ON FINES
+BEGIN
+    INSERT INTO BORROWER_FINES (Card_id, Unpaid_amt, Unpaid_count)
+    SELECT
+        Card_id,
+        NEW.Fine_amt * (NEW.Paid = 0) - OLD.Fine_amt * (OLD.Paid = 0),
+        (NEW.Paid = 0) - (OLD.Paid = 0)
+    FROM BOOK_LOANS WHERE Loan_id = NEW.Loan_id
+    ON CONFLICT (Card_id) DO UPDATE SET
+        Unpaid_amt = Unpaid_amt + excluded.Unpaid_amt,
+        Unpaid_count = Unpaid_count + excluded.Unpaid_count;
+    UPDATE CIRCULATION_TOTALS
+    SET Value = Value + CASE Name
+        WHEN 'UNPAID_FINES' THEN NEW.Fine_amt * (NEW.Paid = 0) - OLD.Fine_amt * (OLD.Paid = 0)
+        WHEN 'UNPAID_FINE_COUNT' THEN (NEW.Paid = 0) - (OLD.Paid = 0)
+        ELSE NEW.Fine_amt * (NEW.Paid = 1) - OLD.Fine_amt * (OLD.Paid = 1)
+    END
+    WHERE Name IN ('UNPAID_FINES', 'UNPAID_FINE_COUNT', 'PAID_FINES');
+    INSERT INTO DAILY_CIRCULATION (Day, Fines_paid)
+    SELECT date('now', 'localtime'), NEW.Fine_amt WHERE OLD.Paid = 0 AND NEW.Paid = 1
+    ON CONFLICT (Day) DO UPDATE SET Fines_paid = Fines_paid + excluded.Fines_paid;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_fines_rollup_del AFTER DELETE ON FINES
+WHEN OLD.Paid = 0
+BEGIN
+    UPDATE BORROWER_FINES
+    SET Unpaid_amt = Unpaid_amt - OLD.Fine_amt, Unpaid_count = Unpaid_count - 1
+    WHERE Card_id = (SELECT Card_id FROM BOOK_LOANS WHERE Loan_id = OLD.Loan_id);
+    UPDATE CIRCULATION_TOTALS
+    SET Value = Value - CASE Name WHEN 'UNPAID_FINES' THEN OLD.Fine_amt ELSE 1 END
+    WHERE Name IN ('UNPAID_FINES', 'UNPAID_FINE_COUNT');
+END;
@@ -1,4 +1,12 @@
-from typing import List
+import os
+from typing import List, Optional, Tuple
+
+from isbn import looks_like_isbn, resolve_isbn
+
+# "sqlite" runs every search as SQL; "memory" answers from the columnar copy
+# of the catalog in memsearch.py. Set LIBRARY_SEARCH_BACKEND to switch.
+SEARCH_BACKEND = os.environ.get("LIBRARY_SEARCH_BACKEND", "sqlite")
+BACKENDS = ("sqlite", "memory")
 
 SEARCH_BASE = """
 SELECT
@@ -10,7 +18,20 @@ SELECT
             SELECT 1 FROM BOOK_LOANS bl WHERE bl.Isbn = b.Isbn AND bl.Date_in IS NULL
         ) THEN 'OUT'
         ELSE 'IN'
-    END AS Status
+    END AS Status,
+    (
+        SELECT bl.Card_id
+        FROM BOOK_LOANS bl
+        WHERE bl.Isbn = b.Isbn AND bl.Date_in IS NULL
+        LIMIT 1
+    ) AS Borrower_id
+FROM BOOK b
+LEFT JOIN BOOK_AUTHORS ba ON b.Isbn = ba.Isbn
+LEFT JOIN AUTHORS a ON ba.Author_id = a.Author_id
+"""
+
+COUNT_BASE = """
+SELECT COUNT(DISTINCT b.Isbn)
 FROM BOOK b
 LEFT JOIN BOOK_AUTHORS ba ON b.Isbn = ba.Isbn
 LEFT JOIN AUTHORS a ON ba.Author_id = a.Author_id
@@ -19,22 +40,61 @@ LEFT JOIN AUTHORS a ON ba.Author_id = a.Author_id
 TAIL = " GROUP BY b.Isbn, b.Title ORDER BY b.Title"
 
 
-def search_books(conn, query: str) -> List[dict]:
+def _sqlite_search_page(conn, query: str, status_filter: str, offset: int,
+                        limit: Optional[int]) -> Tuple[int, List[dict]]:
+    # Build WHERE clause based on filters
+    where_conditions = []
+    params = []
+
+    if query and looks_like_isbn(query):
+        # Scanned ISBN-10/13: resolve through the ISBN indexes instead of a LIKE scan
+        where_conditions.append("b.Isbn = ?")
+        params.append(resolve_isbn(conn, query) or "")
+    elif query:
+        # Search in ISBN, Title, or Author
+        where_conditions.append("(LOWER(b.Isbn) LIKE ? OR LOWER(b.Title) LIKE ? OR LOWER(a.Name) LIKE ?)")
+        search_term = f"%{query.lower()}%"
+        params.extend([search_term, search_term, search_term])
+
+    # Status filter
+    if status_filter == "available":
+        where_conditions.append("NOT EXISTS (SELECT 1 FROM BOOK_LOANS bl WHERE bl.Isbn = b.Isbn AND bl.Date_in IS NULL)")
+    elif status_filter == "checked_out":
+        where_conditions.append("EXISTS (SELECT 1 FROM BOOK_LOANS bl WHERE bl.Isbn = b.Isbn AND bl.Date_in IS NULL)")
+
+    where_clause = " WHERE " + " AND ".join(where_conditions) if where_conditions else ""
+
+    cursor = conn.cursor()
+    total_count = cursor.execute(COUNT_BASE + where_clause, params).fetchone()[0]
+
+    sql = SEARCH_BASE + where_clause + TAIL
+    if limit is not None:
+        sql += " LIMIT ? OFFSET ?"
+        params = params + [limit, offset]
+    cursor.execute(sql, params)
+    return total_count, [dict(row) for row in cursor.fetchall()]
+
+
+def search_page(conn, query: str, status_filter: str = "all", offset: int = 0,
+                limit: Optional[int] = None, backend: Optional[str] = None) -> Tuple[int, List[dict]]:
+    """Return (total matches, one page of books) for an ISBN, title or author query.
+
+    Each book has Isbn, Title, Authors, Status ('IN'/'OUT') and Borrower_id.
+    status_filter is 'all', 'available' or 'checked_out'.
+    """
+    backend = backend or SEARCH_BACKEND
+    if backend == "memory":
+        import memsearch
+        return memsearch.search_page(conn, query, status_filter, offset, limit)
+    if backend != "sqlite":
+        raise ValueError(f"Unknown search backend '{backend}'")
+    return _sqlite_search_page(conn, query, status_filter, offset, limit)
+
+
+def search_books(conn, query: str, backend: Optional[str] = None) -> List[dict]:
     query = (query or "").strip()
     if not query:
         return []
-
-    cursor = conn.cursor()
-    if len(query) == 10 and query.isalnum():
-        sql = SEARCH_BASE + " WHERE b.Isbn = ?" + TAIL
-        cursor.execute(sql, (query,))
-    else:
-        term = f"%{query.lower()}%"
-        sql = (
-            SEARCH_BASE
-            + " WHERE LOWER(b.Isbn) LIKE ? OR LOWER(b.Title) LIKE ? OR LOWER(a.Name) LIKE ?"
-            + TAIL
-        )
-        cursor.execute(sql, (term, term, term))
-
-    return [dict(row) for row in cursor.fetchall()]
+    if looks_like_isbn(query) and resolve_isbn(conn, query) is None:
+        return []
+    return search_page(conn, query, backend=backend)[1]
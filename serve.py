@@ -0,0 +1,298 @@
+import argparse
+import logging
+import os
+import secrets
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from werkzeug.serving import BaseWSGIServer
+
+from db import DB_PATH, get_connection
+import maintenance
+import metrics
+import writequeue
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+DEFAULT_WORKERS = os.cpu_count() or 1
+DEFAULT_THREADS = 8
+# How long a replaced or stopping worker may spend finishing in-flight requests
+GRACEFUL_TIMEOUT = 30.0
+# A worker that dies sooner than this after starting is treated as a startup
+# failure (bad code, missing database) and stops the server instead of respawning
+BOOT_TIMEOUT = 2.0
+
+log = logging.getLogger("serve")
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug WSGI server that handles requests on a fixed pool of threads."""
+
+    multithread = True
+
+    def __init__(self, host: str, port: int, app, threads: int, fd: int):
+        # The base class calls server_close() while adopting fd, before the pool exists
+        self.pool = None
+        super().__init__(host, port, app, fd=fd)
+        self.pool = ThreadPoolExecutor(threads, thread_name_prefix="request")
+
+    def process_request(self, request, client_address) -> None:
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self) -> None:
+        super().server_close()
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+
+
+def load_app():
+    """Build the Flask app and warm it up (database setup, templates, in-process read caches)."""
+    from app import create_app
+    import startup
+
+    app = create_app()
+    startup.warmup(app)
+    return app
+
+
+def _database_setup() -> None:
+    # WAL lets every worker read while the writer process commits
+    conn = get_connection()
+    try:
+        maintenance.enable_wal(conn)
+    finally:
+        conn.close()
+
+
+class Arbiter:
+    """Prefork supervisor: one listening socket, N worker processes, one writer process.
+
+    Workers serve requests with a thread pool and read from their own SQLite
+    connections. Checkouts, checkins and payments are sent to the writer
+    process, which commits them in groups, so concurrent writes never queue
+    on the database lock. SIGHUP replaces the workers one generation at a
+    time; SIGTERM or SIGINT stops everything after in-flight requests finish.
+    The arbiter also checkpoints the WAL and keeps planner statistics fresh
+    between its other duties, so no request pays for that work.
+    """
+
+    def __init__(self, host: str, port: int, workers: int, threads: int, preload: bool, writer: bool):
+        self.host = host
+        self.port = port
+        self.worker_count = workers
+        self.threads = threads
+        self.preload = preload
+        self.use_writer = writer
+        self.app = None
+        self.listener = None
+        self.workers = {}
+        self.spawned = {}
+        self.writer_pid = None
+        self.writer_dir = None
+        self.metrics_dir = None
+        self.generation = 0
+        self.stopping = False
+        self.maintainer = maintenance.Maintainer()
+        self._signals = []
+
+    def run(self) -> int:
+        _database_setup()
+        maintenance.background_checkpoints()
+        self.listener = socket.create_server((self.host, self.port), backlog=1024)
+        # Non-blocking, so workers that lose the race for a connection go back to waiting
+        self.listener.setblocking(False)
+
+        # Every process publishes its metrics here for /metrics to add up
+        self.metrics_dir = tempfile.mkdtemp(prefix="library-metrics-")
+        os.environ[metrics.METRICS_DIR_ENV] = self.metrics_dir
+        if self.use_writer:
+            self.writer_dir = tempfile.mkdtemp(prefix="library-writer-")
+            address = os.path.join(self.writer_dir, "writer.sock")
+            os.environ[writequeue.WRITER_ADDRESS_ENV] = address
+            os.environ[writequeue.WRITER_AUTHKEY_ENV] = secrets.token_hex(16)
+            self.writer_pid = self._spawn_writer()
+        if self.preload:
+            self.app = load_app()
+
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(sig, lambda signum, frame: self._signals.append(signum))
+        self._spawn_generation()
+        log.info("Serving on http://%s:%d with %d workers x %d threads", self.host, self.port,
+                 self.worker_count, self.threads)
+
+        while True:
+            while self._signals:
+                signum = self._signals.pop(0)
+                if signum == signal.SIGHUP:
+                    self.reload()
+                elif signum in (signal.SIGTERM, signal.SIGINT):
+                    self.stop()
+                    return 0
+            try:
+                self._reap()
+            except RuntimeError as err:
+                log.error("%s", err)
+                self.stop()
+                return 1
+            try:
+                self.maintainer.run_once()
+            except Exception:
+                log.exception("Database maintenance failed")
+            time.sleep(0.2)
+
+    def reload(self) -> None:
+        """Start a new generation of workers, then let the old one finish its requests and exit."""
+        old = [pid for pid, generation in self.workers.items() if generation == self.generation]
+        log.info("Reloading %d workers", len(old))
+        self._spawn_generation()
+        for pid in old:
+            self._kill(pid, signal.SIGTERM)
+
+    def stop(self) -> None:
+        self.stopping = True
+        for pid in list(self.workers):
+            self._kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT
+        while self.workers and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in list(self.workers):
+            self._kill(pid, signal.SIGKILL)
+        if self.writer_pid is not None:
+            # The workers are gone, so nothing is waiting on the writer any more
+            self._kill(self.writer_pid, signal.SIGTERM)
+            try:
+                os.waitpid(self.writer_pid, 0)
+            except ChildProcessError:
+                pass
+            shutil.rmtree(self.writer_dir, ignore_errors=True)
+        shutil.rmtree(self.metrics_dir, ignore_errors=True)
+        self.listener.close()
+
+    def _kill(self, pid: int, sig: int) -> None:
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _reap(self) -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if self.stopping:
+                self.workers.pop(pid, None)
+            elif pid == self.writer_pid:
+                log.warning("Writer process exited (status %d), restarting", status)
+                self.writer_pid = self._spawn_writer()
+            elif self.workers.pop(pid, None) == self.generation:
+                if time.monotonic() - self.spawned.pop(pid) < BOOT_TIMEOUT:
+                    raise RuntimeError(f"Worker {pid} failed to start (status {status})")
+                log.warning("Worker %d exited (status %d), restarting", pid, status)
+                self._spawn_worker()
+            else:
+                self.spawned.pop(pid, None)
+
+    def _spawn_generation(self) -> None:
+        self.generation += 1
+        for _ in range(self.worker_count):
+            self._spawn_worker()
+
+    def _spawn_writer(self) -> int:
+        pid = os.fork()
+        if pid == 0:
+            self._child_signals()
+            self.listener.close()
+            address = os.environ[writequeue.WRITER_ADDRESS_ENV]
+            if os.path.exists(address):
+                os.unlink(address)
+            metrics.enable()
+            writequeue.serve_writer(address, bytes.fromhex(os.environ[writequeue.WRITER_AUTHKEY_ENV]))
+            os._exit(0)
+        return pid
+
+    def _spawn_worker(self) -> None:
+        pid = os.fork()
+        if pid == 0:
+            self._child_signals()
+            code = 0
+            try:
+                self._serve()
+            except BaseException:
+                log.exception("Worker failed")
+                code = 1
+            finally:
+                os._exit(code)
+        self.workers[pid] = self.generation
+        self.spawned[pid] = time.monotonic()
+
+    def _serve(self) -> None:
+        app = self.app if self.app is not None else load_app()
+        server = PooledWSGIServer(self.host, self.port, app, self.threads, self.listener.fileno())
+
+        def shutdown(signum, frame):
+            # shutdown() waits for serve_forever to return, so it cannot run on this thread
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        server.serve_forever()
+        server.server_close()
+        metrics.flush()
+
+    def _child_signals(self) -> None:
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGCHLD):
+            signal.signal(sig, signal.SIG_DFL)
+        # Ctrl+C reaches the whole process group; the arbiter decides when workers stop
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Serve the library app with a pool of worker processes.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"worker processes (default: one per CPU, {DEFAULT_WORKERS} here)")
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS,
+                        help=f"request threads per worker (default {DEFAULT_THREADS})")
+    parser.add_argument("--no-preload", action="store_true",
+                        help="import the app in each worker instead of once before forking, "
+                             "so a reload also picks up code changes")
+    parser.add_argument("--no-writer", action="store_true",
+                        help="let every worker write to the database directly")
+    parser.add_argument("--access-log", action="store_true", help="log every request")
+    args = parser.parse_args(argv)
+    if args.workers < 1 or args.threads < 1:
+        parser.error("--workers and --threads must be at least 1")
+
+    logging.basicConfig(level=logging.INFO, format="[%(process)d] %(message)s")
+    if not args.access_log:
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    if not Path(DB_PATH).exists():
+        print(f"{DB_PATH} not found. Run load_data.py first.", file=sys.stderr)
+        return 1
+
+    arbiter = Arbiter(args.host, args.port, args.workers, args.threads,
+                      preload=not args.no_preload, writer=not args.no_writer)
+    return arbiter.run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
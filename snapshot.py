@@ -0,0 +1,144 @@
+import argparse
+import mmap
+import os
+import struct
+import sys
+from array import array
+from pathlib import Path
+from typing import Optional
+
+from cache import data_versions, version_key
+from db import DB_PATH, database_file, get_connection
+from memsearch import CATALOG_TABLES, CatalogColumns
+
+MAGIC = b"LIBSNAP1"
+# Every section starts on a page boundary so it can be mapped on its own:
+# mmap offsets must be multiples of the allocation granularity.
+ALIGNMENT = mmap.ALLOCATIONGRANULARITY
+HEADER = struct.Struct("<8s8sII")
+SECTION = struct.Struct("<24s2sQQ")
+
+# CatalogColumns attribute -> storage. "B" sections are raw byte buffers
+# (fixed-width ISBNs and the UTF-8 string pools); the rest are integer arrays.
+SECTIONS = (
+    ("isbns", "B"),
+    ("title_display", "B"),
+    ("title_text", "B"),
+    ("title_offsets", "q"),
+    ("title_rank", "i"),
+    ("by_title", "i"),
+    ("author_display", "B"),
+    ("author_text", "B"),
+    ("author_offsets", "q"),
+    ("book_author_offsets", "q"),
+    ("book_authors", "i"),
+    ("author_book_offsets", "q"),
+    ("author_books", "i"),
+)
+
+
+def snapshot_path(db_path: Path) -> Path:
+    return Path(db_path).with_suffix(".snap")
+
+
+def _catalog_key(conn) -> bytes:
+    return ",".join(str(version) for version in version_key(data_versions(conn), CATALOG_TABLES)).encode("ascii")
+
+
+def write_snapshot(conn, path: Optional[Path] = None) -> Path:
+    """Build the catalog columns from conn and write them to path (default: next to the database file).
+
+    The file is written beside the target and renamed over it, so workers
+    that already have the old snapshot mapped keep reading a complete file.
+    """
+    if path is None:
+        db_file = database_file(conn)
+        if db_file is None:
+            raise ValueError("An in-memory database has no snapshot location.")
+        path = snapshot_path(db_file)
+    path = Path(path)
+    key = _catalog_key(conn)
+    columns = CatalogColumns.from_connection(conn)
+
+    header_size = HEADER.size + SECTION.size * len(SECTIONS) + len(key)
+    position = -(-header_size // ALIGNMENT) * ALIGNMENT
+    entries = []
+    for name, typecode in SECTIONS:
+        length = len(memoryview(getattr(columns, name)).cast("B"))
+        entries.append((name, typecode, position, length))
+        position += -(-length // ALIGNMENT) * ALIGNMENT
+
+    partial = path.with_name(path.name + ".tmp")
+    with partial.open("wb") as handle:
+        handle.write(HEADER.pack(MAGIC, sys.byteorder.encode("ascii"), len(SECTIONS), len(key)))
+        for name, typecode, offset, length in entries:
+            handle.write(SECTION.pack(name.encode("ascii"), typecode.encode("ascii"), offset, length))
+        handle.write(key)
+        for name, _, offset, _ in entries:
+            handle.seek(offset)
+            handle.write(getattr(columns, name))
+        handle.truncate(position)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(partial, path)
+    return path
+
+
+def open_snapshot(path: Path, key: Optional[bytes] = None) -> Optional[CatalogColumns]:
+    """Map a snapshot read-only and return CatalogColumns backed by it.
+
+    Nothing is copied: byte sections are mmap objects and integer sections
+    are memoryviews cast over them, so every process that opens the same
+    file shares one copy in the page cache. Returns None when the file is
+    missing, unreadable, or was written for a different catalog version.
+    """
+    try:
+        handle = open(path, "rb")
+    except OSError:
+        return None
+    with handle:
+        raw = handle.read(HEADER.size)
+        if len(raw) < HEADER.size:
+            return None
+        magic, byteorder, section_count, key_length = HEADER.unpack(raw)
+        if magic != MAGIC or byteorder.rstrip(b"\0").decode("ascii") != sys.byteorder:
+            return None
+        entries = [SECTION.unpack(handle.read(SECTION.size)) for _ in range(section_count)]
+        if key is not None and handle.read(key_length) != key:
+            return None
+
+        columns = CatalogColumns()
+        for name, typecode, offset, length in entries:
+            name = name.rstrip(b"\0").decode("ascii")
+            typecode = typecode.rstrip(b"\0").decode("ascii")
+            if length == 0:
+                section = bytearray() if typecode == "B" else array(typecode)
+            else:
+                mapped = mmap.mmap(handle.fileno(), length, offset=offset, access=mmap.ACCESS_READ)
+                section = mapped if typecode == "B" else memoryview(mapped).cast(typecode)
+            setattr(columns, name, section)
+    return columns
+
+
+def load_current(conn) -> Optional[CatalogColumns]:
+    """Open the snapshot next to conn's database if it matches the catalog as it is now."""
+    db_file = database_file(conn)
+    if db_file is None:
+        return None
+    return open_snapshot(snapshot_path(db_file), _catalog_key(conn))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Write the memory-mapped catalog snapshot used by the memory search backend.")
+    parser.add_argument("--db", default=str(DB_PATH), help=f"library database (default {DB_PATH})")
+    parser.add_argument("--output", help="snapshot file (default: the database path with a .snap suffix)")
+    args = parser.parse_args(argv)
+
+    with get_connection(Path(args.db)) as conn:
+        path = write_snapshot(conn, Path(args.output) if args.output else None)
+    print(f"Wrote catalog snapshot {path} ({path.stat().st_size / 1e6:.1f} MB).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from cache import data_versions, version_key
+
+# SymSpell parameters: every vocabulary word's first PREFIX_LENGTH letters are
+# indexed under all strings reachable by up to MAX_EDIT_DISTANCE deletions.
+# A misspelling is looked up by generating its own deletions, so finding
+# candidates costs a few dozen dict probes instead of a scan of the vocabulary.
+MAX_EDIT_DISTANCE = 2
+PREFIX_LENGTH = 7
+MIN_WORD_LENGTH = 3
+# Short words get fewer edits, otherwise nearly any three-letter typo matches something
+SHORT_WORD_LENGTH = 5
+
+VOCAB_TABLES = ("BOOK", "AUTHORS")
+
+WORD_PATTERN = re.compile(r"[a-z]+")
+
+
+def words(text: str) -> List[str]:
+    return [word for word in WORD_PATTERN.findall((text or "").lower()) if len(word) >= MIN_WORD_LENGTH]
+
+
+def build_vocabulary(conn) -> int:
+    """Rebuild SEARCH_VOCAB from book titles and author names. Returns the number of words."""
+    counts = Counter()
+    for (title,) in conn.execute("SELECT Title FROM BOOK"):
+        counts.update(words(title))
+    for (name,) in conn.execute("SELECT Name FROM AUTHORS"):
+        counts.update(words(name))
+
+    conn.execute("DELETE FROM SEARCH_VOCAB")
+    conn.executemany("INSERT INTO SEARCH_VOCAB (Word, Freq) VALUES (?, ?)", counts.items())
+    conn.commit()
+    return len(counts)
+
+
+def ensure_vocabulary(conn) -> None:
+    """Build SEARCH_VOCAB for a database loaded before it existed."""
+    if conn.execute("SELECT 1 FROM SEARCH_VOCAB LIMIT 1").fetchone() is None:
+        build_vocabulary(conn)
+
+
+def _deletes(word: str, max_distance: int) -> set:
+    found = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {
+            candidate[:index] + candidate[index + 1:]
+            for candidate in frontier
+            for index in range(len(candidate))
+        }
+        found |= frontier
+    return found
+
+
+def edit_distance(source: str, target: str, limit: int) -> int:
+    """Damerau-Levenshtein (optimal string alignment) distance, or limit + 1 once it exceeds limit."""
+    if abs(len(source) - len(target)) > limit:
+        return limit + 1
+    previous_previous = None
+    previous = list(range(len(target) + 1))
+    for i in range(1, len(source) + 1):
+        current = [i] + [0] * len(target)
+        for j in range(1, len(target) + 1):
+            cost = 0 if source[i - 1] == target[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (
+                previous_previous is not None
+                and i > 1 and j > 1
+                and source[i - 1] == target[j - 2]
+                and source[i - 2] == target[j - 1]
+            ):
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+
+class SpellIndex:
+    """SymSpell deletion dictionary over the catalog vocabulary."""
+
+    def __init__(self, frequencies: Dict[str, int]):
+        self.frequencies = frequencies
+        self.deletes = defaultdict(list)
+        for word in frequencies:
+            for deleted in _deletes(word[:PREFIX_LENGTH], MAX_EDIT_DISTANCE):
+                self.deletes[deleted].append(word)
+
+    def lookup(self, term: str, max_distance: Optional[int] = None) -> List[Tuple[str, int, int]]:
+        """Return (word, distance, frequency) suggestions, closest and most common first."""
+        term = term.lower()
+        if max_distance is None:
+            max_distance = 1 if len(term) <= SHORT_WORD_LENGTH else MAX_EDIT_DISTANCE
+        max_distance = min(max_distance, MAX_EDIT_DISTANCE)
+        if term in self.frequencies:
+            return [(term, 0, self.frequencies[term])]
+
+        seen = set()
+        suggestions = []
+        for deleted in _deletes(term[:PREFIX_LENGTH], max_distance):
+            for word in self.deletes.get(deleted, ()):
+                if word in seen:
+                    continue
+                seen.add(word)
+                distance = edit_distance(term, word, max_distance)
+                if distance <= max_distance:
+                    suggestions.append((word, distance, self.frequencies[word]))
+        suggestions.sort(key=lambda suggestion: (suggestion[1], -suggestion[2], suggestion[0]))
+        return suggestions
+
+    def correct(self, query: str) -> Optional[str]:
+        """Return the query with each unknown word replaced by its best suggestion, or None if nothing changed."""
+        changed = False
+
+        def replace(match):
+            nonlocal changed
+            word = match.group(0)
+            if len(word) < MIN_WORD_LENGTH:
+                return word
+            suggestions = self.lookup(word)
+            if not suggestions or suggestions[0][1] == 0:
+                return word
+            changed = True
+            return suggestions[0][0]
+
+        corrected = WORD_PATTERN.sub(replace, (query or "").lower())
+        return corrected if changed else None
+
+
+_index = None
+_index_key = None
+_lock = threading.Lock()
+
+
+def get_index(conn) -> SpellIndex:
+    """Return the in-process index, reloading it from SEARCH_VOCAB after a catalog reload."""
+    global _index, _index_key
+    key = version_key(data_versions(conn), VOCAB_TABLES)
+    with _lock:
+        if _index is None or _index_key != key:
+            rows = conn.execute("SELECT Word, Freq FROM SEARCH_VOCAB").fetchall()
+            _index = SpellIndex({row[0]: row[1] for row in rows})
+            _index_key = key
+        return _index
+
+
+def suggest_query(conn, query: str) -> Optional[str]:
+    """'Did you mean' text for a catalog query, or None if every word is known."""
+    return get_index(conn).correct(query)
@@ -0,0 +1,140 @@
+import os
+import threading
+import time
+from pathlib import Path
+
+from db import DB_PATH, ensure_schema, get_connection
+
+# Set LIBRARY_WARMUP=1 to warm up in the background when the app is created;
+# /readyz answers 503 until it has finished. serve.py always warms up, before
+# its workers start.
+WARMUP_ENV = "LIBRARY_WARMUP"
+# Warmup reads at most this much of the database file, so the pages the first
+# requests need come from the OS page cache instead of the disk
+WARMUP_READ_BYTES = 256 * 1024 * 1024
+READ_CHUNK_BYTES = 1024 * 1024
+
+_init_lock = threading.Lock()
+_initialized = False
+_warmup_pending = False
+# Set once this process serves at full speed: the database has been
+# initialized and any warmup that was asked for has finished
+_ready = threading.Event()
+# Seconds each startup phase took in this process, reported by /readyz
+timings = {}
+
+
+def init_database(db_path: Path = DB_PATH) -> bool:
+    """Bring an older database up to date and create the default admin account.
+
+    Runs once per process, and a forked worker inherits it from the process
+    that ran it. Returns True if this call did the work.
+    """
+    global _initialized
+    with _init_lock:
+        if _initialized:
+            return False
+        import auth
+
+        start = time.perf_counter()
+        with get_connection(db_path) as conn:
+            ensure_schema(conn)
+            auth.initialize_default_user(conn)
+        conn.close()
+        timings["init_database"] = time.perf_counter() - start
+        _initialized = True
+    if not _warmup_pending:
+        _ready.set()
+    return True
+
+
+def warmup(app, db_path: Path = DB_PATH) -> None:
+    """Do the work that would otherwise slow down the first requests.
+
+    Initializes the database, compiles every page template, builds the
+    in-process spelling and author indexes (and the columnar catalog for
+    the memory search backend) and reads the database file into the OS page
+    cache. Call it before forking workers so they all share the result.
+    """
+    global _warmup_pending
+    import authors
+    import search
+    import spelling
+
+    _warmup_pending = True
+    try:
+        init_database(db_path)
+        start = time.perf_counter()
+        for name in app.jinja_env.list_templates(extensions=["html"]):
+            app.jinja_env.get_template(name)
+        conn = get_connection(db_path)
+        try:
+            spelling.get_index(conn)
+            authors.get_index(conn)
+            if search.SEARCH_BACKEND == "memory":
+                import memsearch
+                memsearch.get_columns(conn)
+        finally:
+            conn.close()
+        _read_through(db_path)
+        timings["warmup"] = time.perf_counter() - start
+    finally:
+        # A warmup that failed part way only costs speed
+        _warmup_pending = False
+        if _initialized:
+            _ready.set()
+
+
+def _read_through(path: Path, limit: int = WARMUP_READ_BYTES) -> None:
+    buffer = bytearray(READ_CHUNK_BYTES)
+    for name in (path, Path(f"{path}-wal")):
+        try:
+            with open(name, "rb", buffering=0) as handle:
+                remaining = limit
+                while remaining > 0 and handle.readinto(buffer):
+                    remaining -= READ_CHUNK_BYTES
+        except FileNotFoundError:
+            pass
+
+
+def init_app(app, warm: bool = None) -> None:
+    """Initialize the database on the first request, warm up if asked to, and serve /healthz and /readyz.
+
+    /healthz only says the process is up and answering. /readyz answers 503
+    until init_database() (and warmup, when it was requested) has run and
+    while the database cannot be queried, so a load balancer holds traffic
+    back until then.
+    """
+    global _warmup_pending
+    from flask import jsonify, request
+
+    if warm is None:
+        warm = os.environ.get(WARMUP_ENV) == "1"
+    if warm and not _ready.is_set():
+        _warmup_pending = True
+        threading.Thread(target=warmup, args=(app,), name="warmup", daemon=True).start()
+
+    @app.before_request
+    def initialize_database():
+        # The probes answer even when the database does not
+        if not _initialized and request.endpoint not in ("healthz", "readyz"):
+            init_database()
+
+    @app.route("/healthz")
+    def healthz():
+        return jsonify(status="ok", pid=os.getpid())
+
+    @app.route("/readyz")
+    def readyz():
+        try:
+            init_database()
+            if not _ready.is_set():
+                return jsonify(status="starting", timings=timings), 503
+            conn = get_connection()
+            try:
+                conn.execute("SELECT 1 FROM BOOK LIMIT 1").fetchone()
+            finally:
+                conn.close()
+        except Exception as err:
+            return jsonify(status="database unavailable", error=str(err)), 503
+        return jsonify(status="ready", timings=timings)
@@ -1,19 +1,27 @@
 #!/usr/bin/env python3
 """
 Test script to verify all checkout requirements are working correctly.
+
+Runs against a private copy of the template database (db.clone_database)
+unless a database path is given, so it never changes library.db by default.
 """
-import sqlite3
 from datetime import date, timedelta
 import sys
 
-def test_checkout_requirements(db_path='library.db'):
+from db import clone_database, get_connection
+
+
+def test_checkout_requirements():
+    assert check_checkout_requirements()
+
+
+def check_checkout_requirements(db_path=None):
     """Test all checkout requirements"""
     print("=" * 70)
     print("TESTING CHECKOUT REQUIREMENTS")
     print("=" * 70)
     
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
+    conn = clone_database() if db_path is None else get_connection(db_path)
     cursor = conn.cursor()
     
     # Get a test borrower
@@ -225,11 +233,8 @@ def test_checkout_requirements(db_path='library.db'):
     return True
 
 if __name__ == '__main__':
-    db_path = sys.argv[1] if len(sys.argv) > 1 else 'library.db'
-    
-    # Add parent directory to path to import loans module
-    import os
-    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    # Pass a database path to test a real database; it will be changed
+    db_path = sys.argv[1] if len(sys.argv) > 1 else None
     
-    success = test_checkout_requirements(db_path)
+    success = check_checkout_requirements(db_path)
     sys.exit(0 if success else 1)
@@ -0,0 +1,274 @@
+"""
+Circulation tests against private clones of the template database.
+
+Each test gets its own in-memory copy of the loaded catalog (see
+db.clone_database), so tests never touch library.db, can run in any order
+and can run in parallel.
+"""
+import io
+import json
+import os
+from datetime import date, timedelta
+
+import pytest
+
+import borrowers
+import cli
+import memsearch
+import search
+from db import clone_database
+from fines import DAILY_FINE, pay_fines, refresh_fines
+from loans import MAX_ACTIVE_LOANS, checkin, checkout
+from payments import import_payments, iter_report
+from rollups import rebuild_rollups
+from writequeue import GroupCommitWriter
+
+# What the triggers and rebuild_rollups must agree on. The triggers keep rows
+# that have dropped back to zero, and Fines_paid is dated by when the payment
+# was made, which a rebuild cannot know.
+ROLLUP_QUERIES = [
+    "SELECT Day, Checkouts, Checkins FROM DAILY_CIRCULATION WHERE Checkouts OR Checkins",
+    "SELECT Isbn, Checkouts FROM BOOK_CIRCULATION",
+    "SELECT Due_date, Loans FROM OPEN_LOANS_BY_DUE",
+    "SELECT Card_id, Unpaid_amt, Unpaid_count FROM BORROWER_FINES WHERE Unpaid_count > 0",
+    "SELECT Name, Value FROM CIRCULATION_TOTALS",
+]
+
+
+@pytest.fixture
+def conn():
+    conn = clone_database()
+    yield conn
+    conn.close()
+
+
+def _books(conn, count):
+    return [row[0] for row in conn.execute("SELECT Isbn FROM BOOK ORDER BY Isbn LIMIT ?", (count,))]
+
+
+def _card(conn):
+    return conn.execute("SELECT MIN(Card_id) FROM BORROWER").fetchone()[0]
+
+
+def _late_loan(conn, isbn, card_id, days_late, returned=False):
+    """Insert a loan that fell due days_late days ago, returned today if returned."""
+    today = date.today()
+    due = today - timedelta(days=days_late)
+    cursor = conn.execute(
+        "INSERT INTO BOOK_LOANS (Isbn, Card_id, Date_out, Due_date, Date_in) VALUES (?, ?, ?, ?, ?)",
+        (isbn, card_id, (due - timedelta(days=14)).isoformat(), due.isoformat(),
+         today.isoformat() if returned else None),
+    )
+    conn.commit()
+    return cursor.lastrowid
+
+
+def _rollups(conn):
+    return [
+        sorted(tuple(round(value, 2) if isinstance(value, float) else value for value in row)
+               for row in conn.execute(sql))
+        for sql in ROLLUP_QUERIES
+    ]
+
+
+def test_clones_are_isolated(conn):
+    other = clone_database()
+    try:
+        checkout(conn, _books(conn, 1)[0], _card(conn))
+        assert conn.execute("SELECT COUNT(*) FROM BOOK_LOANS").fetchone()[0] == 1
+        assert other.execute("SELECT COUNT(*) FROM BOOK_LOANS").fetchone()[0] == 0
+    finally:
+        other.close()
+
+
+def test_clone_to_file(tmp_path):
+    path = tmp_path / "sandbox.db"
+    clone_database(path).close()
+    copy = clone_database(path)
+    try:
+        assert copy.execute("SELECT COUNT(*) FROM BOOK").fetchone()[0] > 0
+        assert copy.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    finally:
+        copy.close()
+
+
+def test_checkout_sets_dates(conn):
+    loan_id = checkout(conn, _books(conn, 1)[0], _card(conn))
+    loan = conn.execute("SELECT Date_out, Due_date, Date_in FROM BOOK_LOANS WHERE Loan_id = ?", (loan_id,)).fetchone()
+    assert loan["Date_out"] == date.today().isoformat()
+    assert loan["Due_date"] == (date.today() + timedelta(days=14)).isoformat()
+    assert loan["Date_in"] is None
+
+
+def test_checkout_limit(conn):
+    card_id = _card(conn)
+    books = _books(conn, MAX_ACTIVE_LOANS + 1)
+    for isbn in books[:-1]:
+        checkout(conn, isbn, card_id)
+    with pytest.raises(ValueError, match="Maximum allowed"):
+        checkout(conn, books[-1], card_id)
+
+
+def test_book_already_out(conn):
+    isbn = _books(conn, 1)[0]
+    cards = [row[0] for row in conn.execute("SELECT Card_id FROM BORROWER ORDER BY Card_id LIMIT 2")]
+    checkout(conn, isbn, cards[0])
+    with pytest.raises(ValueError, match="currently checked out"):
+        checkout(conn, isbn, cards[1])
+
+
+def test_late_checkin_creates_fine(conn):
+    isbn = _books(conn, 1)[0]
+    loan_id = _late_loan(conn, isbn, _card(conn), days_late=10)
+    checkin(conn, loan_id)
+    fine = conn.execute("SELECT Fine_amt, Paid FROM FINES WHERE Loan_id = ?", (loan_id,)).fetchone()
+    assert fine["Fine_amt"] == pytest.approx(10 * DAILY_FINE)
+    assert fine["Paid"] == 0
+
+
+def test_refresh_fines_leaves_paid_fines(conn):
+    card_id = _card(conn)
+    first, second = _books(conn, 2)
+    paid = _late_loan(conn, first, card_id, days_late=4, returned=True)
+    open_loan = _late_loan(conn, second, card_id, days_late=6)
+    assert refresh_fines(conn) == 2
+    conn.execute("UPDATE FINES SET Paid = 1 WHERE Loan_id = ?", (paid,))
+    conn.commit()
+
+    later = date.today() + timedelta(days=2)
+    assert refresh_fines(conn, later) == 1
+    amounts = dict(conn.execute("SELECT Loan_id, Fine_amt FROM FINES").fetchall())
+    assert amounts[paid] == pytest.approx(4 * DAILY_FINE)
+    assert amounts[open_loan] == pytest.approx(8 * DAILY_FINE)
+    assert refresh_fines(conn, later) == 0
+
+
+def test_unpaid_fine_blocks_checkout_until_paid(conn):
+    card_id = _card(conn)
+    late, wanted = _books(conn, 2)
+    _late_loan(conn, late, card_id, days_late=3, returned=True)
+    refresh_fines(conn)
+    with pytest.raises(ValueError, match="unpaid fine"):
+        checkout(conn, wanted, card_id)
+    pay_fines(conn, card_id)
+    assert checkout(conn, wanted, card_id)
+
+
+def test_rollup_triggers_match_rebuild(conn):
+    card_id = _card(conn)
+    books = _books(conn, 3)
+    first = checkout(conn, books[0], card_id)
+    checkout(conn, books[1], card_id)
+    checkin(conn, first)
+    _late_loan(conn, books[2], card_id + 1, days_late=5, returned=True)
+    refresh_fines(conn)
+    pay_fines(conn, card_id + 1)
+
+    maintained = _rollups(conn)
+    rebuild_rollups(conn)
+    assert _rollups(conn) == maintained
+
+
+def test_cli_batch_reports_each_line(conn):
+    books = _books(conn, 2)
+    items = iter([(1, f"{books[0]} {_card(conn)}"), (2, "0000000000 1"), (3, f'{{"isbn": "{books[1]}", "card_id": 2}}')])
+    out = io.StringIO()
+    summary = cli.apply_operations(conn, cli.OPERATIONS["checkout"], items, out)
+    results = out.getvalue().splitlines()
+    assert summary == {"ok": 2, "rejected": 1, "failed": 0}
+    assert len(results) == 3 and '"ok": false' in results[1]
+    assert conn.execute("SELECT COUNT(*) FROM BOOK_LOANS").fetchone()[0] == 2
+
+
+def test_cli_batch_reports_whole_batch_before_stopping_on_error(conn):
+    def operation(conn, text):
+        if text == "boom":
+            raise KeyError(text)
+        return cli._checkin(conn, text)
+
+    loans = [checkout(conn, isbn, _card(conn)) for isbn in _books(conn, 3)]
+    items = iter([(1, str(loans[0])), (2, "boom"), (3, str(loans[1])), (4, str(loans[2]))])
+    out = io.StringIO()
+    summary = cli.apply_operations(conn, operation, items, out, batch_size=3)
+    assert summary == {"ok": 2, "rejected": 0, "failed": 1}
+    assert [json.loads(line)["ok"] for line in out.getvalue().splitlines()] == [True, False, True]
+    # The failed line's batch committed; the next batch never ran
+    open_loans = conn.execute("SELECT Loan_id FROM BOOK_LOANS WHERE Date_in IS NULL").fetchall()
+    assert [row[0] for row in open_loans] == [loans[2]]
+
+
+def test_short_payment_does_not_shadow_corrected_line(conn):
+    loan_id = _late_loan(conn, _books(conn, 1)[0], _card(conn), days_late=8, returned=True)
+    refresh_fines(conn)
+    settlement = io.StringIO(f"Loan_id,Amount\n{loan_id},0.50\n{loan_id},{8 * DAILY_FINE:.2f}\n{loan_id},{8 * DAILY_FINE:.2f}\n")
+    summary = import_payments(conn, settlement)
+    assert [(row["Status"], row["Reason"]) for row in iter_report(conn)] == [
+        ("unmatched", "amount short of fine"), ("applied", None), ("duplicate", "loan repeated in file"),
+    ]
+    assert summary["applied"] == 1
+    assert conn.execute("SELECT Paid FROM FINES WHERE Loan_id = ?", (loan_id,)).fetchone()[0] == 1
+
+
+def test_borrower_ssns_match_in_any_format(conn):
+    conn.execute("UPDATE BORROWER SET Ssn = '123456789' WHERE Card_id = ?", (_card(conn),))
+    conn.commit()
+    # Done once at startup by ensure_schema
+    assert borrowers.normalize_stored_ssns(conn) == 1
+    assert borrowers.normalize_stored_ssns(conn) == 0
+    with pytest.raises(ValueError, match="already exists"):
+        borrowers.create_borrower(conn, "123 45 6789", "Dup", "1 Main St")
+    borrowers.create_borrower(conn, "987654321", "Registered Meanwhile", "2 Main St")
+
+    csv_text = "Ssn,Bname,Address\n123-45-6789,Old,1 Main St\n555-44-3333,New,3 Main St\n"
+    summary = borrowers.import_borrowers(conn, io.StringIO(csv_text))
+    assert summary["imported"] == 1 and summary["rejected"] == [(2, "SSN 123-45-6789 already registered")]
+
+    # A row registered after the import read the existing SSNs is rejected on its own
+    card_ids, rejected = borrowers._insert_batch(conn, [(2, ("987-65-4321", "Late", "4 Main St", None)),
+                                                        (3, ("111-22-3333", "Fine", "5 Main St", None))])
+    assert rejected == [(2, "SSN 987-65-4321 already registered")]
+    assert card_ids == [summary["last_card_id"] + 1]
+    assert conn.execute("SELECT Bname FROM BORROWER WHERE Card_id = ?", (card_ids[0],)).fetchone()[0] == "Fine"
+
+
+def test_search_backends_agree_on_isbn_check_digit(conn):
+    isbn = conn.execute("SELECT MIN(Isbn) FROM BOOK WHERE Isbn LIKE '%X'").fetchone()[0]
+    memsearch.clear()
+    try:
+        for query in (isbn[-5:].lower(), isbn[-5:]):
+            sqlite_total, sqlite_books = search.search_page(conn, query, backend="sqlite")
+            memory_total, memory_books = search.search_page(conn, query, backend="memory")
+            assert sqlite_total == memory_total > 0
+            assert [book["Isbn"] for book in sqlite_books] == [book["Isbn"] for book in memory_books]
+    finally:
+        memsearch.clear()
+
+
+# The writer thread is running when the test forks, which is the point
+@pytest.mark.filterwarnings("ignore:This process .* is multi-threaded")
+def test_group_commit_writer_works_in_forked_worker(tmp_path):
+    path = tmp_path / "preloaded.db"
+    conn = clone_database(path)
+    writer = GroupCommitWriter(path).start()
+    try:
+        isbn, card_id = _books(conn, 1)[0], _card(conn)
+        # Fork once the writer is idle, as serve.py's arbiter is by then, not
+        # while its thread is still opening its connection
+        writer.call(lambda writer_conn: None)
+        pid = os.fork()
+        if pid == 0:
+            # Like a serve.py worker forked after create_app() started the writer
+            try:
+                writer.submit(checkout, isbn, card_id).result(timeout=10)
+                os._exit(0)
+            except BaseException:
+                os._exit(1)
+        assert os.waitpid(pid, 0)[1] == 0
+        assert conn.execute("SELECT COUNT(*) FROM BOOK_LOANS WHERE Isbn = ?", (isbn,)).fetchone()[0] == 1
+        # The parent's own writer still works
+        loan_id = conn.execute("SELECT Loan_id FROM BOOK_LOANS WHERE Isbn = ?", (isbn,)).fetchone()[0]
+        writer.call(checkin, loan_id)
+        assert conn.execute("SELECT Date_in FROM BOOK_LOANS WHERE Loan_id = ?", (loan_id,)).fetchone()[0]
+    finally:
+        writer.stop()
+        conn.close()
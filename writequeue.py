@@ -0,0 +1,228 @@
+import os
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Optional
+
+from db import DB_PATH, get_connection, run_batch
+from maintenance import optimize
+
+MAX_BATCH_SIZE = 64
+# How long the writer waits for more work after the first queued operation.
+# Zero still groups everything that arrived while the previous batch was
+# committing, which is where the gain comes from under load.
+LINGER_SECONDS = 0.0
+
+# serve.py runs one writer process and tells its workers where to find it
+WRITER_ADDRESS_ENV = "LIBRARY_WRITER_ADDRESS"
+WRITER_AUTHKEY_ENV = "LIBRARY_WRITER_AUTHKEY"
+
+_STOP = object()
+# Every writer in this process, so a forked child can reset them
+_writers = weakref.WeakSet()
+
+
+class GroupCommitWriter:
+    """Single writer thread that commits queued circulation writes in batches.
+
+    Callers submit fn(conn, *args) operations and get a Future for their own
+    result. The writer drains whatever is queued (up to MAX_BATCH_SIZE), runs
+    each operation in its own savepoint and commits the batch once, so a burst
+    of checkouts pays one fsync instead of one per request. A ValueError or any
+    other error raised by an operation is set on that operation's Future only.
+    """
+
+    def __init__(
+        self,
+        db_path: Path = DB_PATH,
+        max_batch: int = MAX_BATCH_SIZE,
+        linger: float = LINGER_SECONDS,
+    ):
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self.linger = linger
+        self.batches = 0
+        self.operations = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        # Set by start(); a forked process starts its own writer on first use
+        self._forked = False
+        self._start_lock = threading.Lock()
+        _writers.add(self)
+
+    def start(self) -> "GroupCommitWriter":
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="group-commit-writer", daemon=True)
+                self._thread.start()
+                self._forked = False
+        return self
+
+    def _after_fork(self) -> None:
+        # The writer thread does not survive fork() (serve.py preloads the
+        # app, and with it this writer, before forking its workers). Operations
+        # queued in the child would never be committed, so the child gets an
+        # empty queue and starts a thread of its own when it first submits.
+        self._start_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._forked = self._thread is not None
+        self._thread = None
+
+    def stop(self, timeout: float = None) -> None:
+        """Commit everything already queued, then stop the writer thread."""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        if self._thread is None:
+            if not self._forked:
+                raise RuntimeError("Write queue is not running")
+            self.start()
+        future = Future()
+        self._queue.put((fn, args, kwargs, future))
+        return future
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """Queue an operation and wait for its committed result (or its error)."""
+        return self.submit(fn, *args, **kwargs).result()
+
+    def _collect(self, first) -> tuple:
+        batch = [first]
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.max_batch:
+            try:
+                remaining = deadline - time.monotonic()
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self) -> None:
+        conn = get_connection(self.db_path)
+        try:
+            stopping = False
+            while not stopping:
+                item = self._queue.get()
+                if item is _STOP:
+                    break
+                batch, stopping = self._collect(item)
+                self._commit(conn, batch)
+        finally:
+            # Long-lived connection: refresh the statistics its queries relied on before closing
+            optimize(conn)
+            conn.close()
+
+    def _commit(self, conn, batch) -> None:
+        live = [item for item in batch if item[3].set_running_or_notify_cancel()]
+        if not live:
+            return
+        try:
+            outcomes = run_batch(conn, [(fn, args, kwargs) for fn, args, kwargs, _ in live])
+        except Exception as err:
+            # The commit itself failed, so nothing in the batch was written.
+            for *_, future in live:
+                future.set_exception(err)
+            return
+
+        self.batches += 1
+        self.operations += len(live)
+        for (*_, future), (result, error) in zip(live, outcomes):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+def _after_fork() -> None:
+    for writer in list(_writers):
+        writer._after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def serve_writer(address: str, authkey: bytes, db_path: Path = DB_PATH) -> None:
+    """Accept operations from other processes on address and commit them through one GroupCommitWriter.
+
+    Every client connection gets a thread that forwards its operations to
+    the writer, so writes from all worker processes share batches. Runs
+    until the process is terminated.
+    """
+    from multiprocessing import AuthenticationError
+    from multiprocessing.connection import Listener
+
+    writer = GroupCommitWriter(db_path).start()
+    with Listener(address, authkey=authkey) as listener:
+        while True:
+            try:
+                client = listener.accept()
+            except (AuthenticationError, OSError):
+                continue
+            threading.Thread(target=_serve_client, args=(writer, client), daemon=True).start()
+
+
+def _serve_client(writer: GroupCommitWriter, client) -> None:
+    with client:
+        while True:
+            try:
+                fn, args, kwargs = client.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                reply = (writer.call(fn, *args, **kwargs), None)
+            except Exception as err:
+                reply = (None, err)
+            try:
+                client.send(reply)
+            except Exception as err:
+                # The error (or result) did not pickle; report it as text instead
+                client.send((None, RuntimeError(f"{type(err).__name__}: {err}")))
+
+
+class RemoteWriter:
+    """Client side of serve_writer, with the same call() as GroupCommitWriter.
+
+    Operations are sent by reference (module-level functions pickle by name)
+    together with their arguments; each thread keeps its own connection.
+    """
+
+    def __init__(self, address: str, authkey: bytes):
+        self.address = address
+        self.authkey = authkey
+        self._local = threading.local()
+
+    def call(self, fn: Callable, *args, **kwargs):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # multiprocessing is only imported by processes that talk to serve.py's writer
+            from multiprocessing.connection import Client
+            connection = self._local.connection = Client(self.address, authkey=self.authkey)
+        try:
+            connection.send((fn, args, kwargs))
+            result, error = connection.recv()
+        except (EOFError, OSError):
+            # The writer went away; reconnect on the next call
+            self._local.connection = None
+            connection.close()
+            raise
+        if error is not None:
+            raise error
+        return result
+
+
+def from_environment() -> Optional[object]:
+    """The write queue the app should use: serve.py's writer process, a local group-commit thread, or None."""
+    address = os.environ.get(WRITER_ADDRESS_ENV)
+    if address:
+        return RemoteWriter(address, bytes.fromhex(os.environ[WRITER_AUTHKEY_ENV]))
+    if os.environ.get("LIBRARY_GROUP_COMMIT") == "1":
+        return GroupCommitWriter().start()
+    return None